@@ -381,17 +381,10 @@ def install_git_hooks():
 
 
 @cmd
-def bench_oneshot():
-    """Benchmarks for oneshot() ctx manager (see #799)."""
+def bench():
+    """Benchmark all copy strategies (pass ARGS via the ARGS env var)."""
     install()
-    sh("%s -Wa scripts\\internal\\bench_oneshot.py" % PYTHON)
-
-
-@cmd
-def bench_oneshot_2():
-    """Same as above but using perf module (supposed to be more precise)."""
-    install()
-    sh("%s -Wa scripts\\internal\\bench_oneshot_2.py" % PYTHON)
+    sh("%s -m zerocopy.bench %s" % (PYTHON, os.environ.get("ARGS", "")))
 
 
 def set_python(s):
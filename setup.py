@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import os
+import sys
 import warnings
 
 with warnings.catch_warnings():
@@ -44,6 +45,8 @@ def get_description():
 
 VERSION = get_version()
 install_requires = ['six']
+if sys.version_info[0] == 2:
+    install_requires.extend(['futures', 'scandir'])
 if os.name == 'posix':
     ext_modules = [Extension('_zerocopy', ['zerocopy/_zerocopymodule.c'])]
 else:
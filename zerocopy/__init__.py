@@ -1,9 +1,33 @@
+from zerocopy._copyfile import copy_many  # NOQA
+from zerocopy._copyfile import CopyCancelledError  # NOQA
 from zerocopy._copyfile import copyfile  # NOQA
+from zerocopy._copyfile import cowcopy  # NOQA
+from zerocopy._copyfile import fs_capabilities  # NOQA
+from zerocopy._copyfile import reset_fs_capabilities  # NOQA
 from zerocopy._copyfile import SameFileError  # NOQA
 from zerocopy._copyfile import SpecialFileError  # NOQA
+from zerocopy._copytree import copy2  # NOQA
+from zerocopy._copytree import copytree  # NOQA
+from zerocopy._copytree import synctree  # NOQA
+from zerocopy._sendfile import sendfile  # NOQA
+from zerocopy._shutil import patch_shutil  # NOQA
+from zerocopy._shutil import patched_shutil  # NOQA
+from zerocopy._shutil import unpatch_shutil  # NOQA
+from zerocopy._splice import copy_to_many  # NOQA
+from zerocopy._splice import recvfile  # NOQA
+from zerocopy._splice import relay  # NOQA
+from zerocopy._stats import CopyStats  # NOQA
+from zerocopy._stats import enable_metrics  # NOQA
+from zerocopy._stats import metrics  # NOQA
+from zerocopy._stats import reset_metrics  # NOQA
+from zerocopy._stats import set_metrics_hook  # NOQA
 
 __version__ = "0.1.0"
 version_info = tuple([int(num) for num in __version__.split('.')])
 __all__ = [
-    "SpecialFileError", "SameFileError"
-    "copyfile"]
+    "CopyCancelledError", "CopyStats", "SpecialFileError", "SameFileError",
+    "copy2", "copy_many", "copy_to_many", "copyfile", "copytree",
+    "cowcopy", "enable_metrics", "fs_capabilities", "metrics",
+    "patch_shutil", "patched_shutil", "recvfile", "relay",
+    "reset_fs_capabilities", "reset_metrics", "sendfile",
+    "set_metrics_hook", "synctree", "unpatch_shutil"]
@@ -1,22 +1,99 @@
+import binascii
+import contextlib
 import errno
+import itertools
+import mmap
 import os
 import shutil
 import stat
 import sys
+import threading
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # Python 2 without "futures" backport
+    ThreadPoolExecutor = None
+
+from zerocopy import _stats
 
 if os.name == 'posix':
     import _zerocopy
+    import fcntl
 else:
     _zerocopy = None
+    fcntl = None
     import win32file
     import pywintypes
 
 
+HAS_FICLONE = hasattr(_zerocopy, "ficlone")
+HAS_COPY_FILE_RANGE = hasattr(_zerocopy, "copy_file_range")
 HAS_SENDFILE = hasattr(_zerocopy, "sendfile")
+HAS_COPYFD = hasattr(_zerocopy, "copyfd")
+HAS_COPY_MANY = hasattr(_zerocopy, "copy_many")
 HAS_FCOPYFILE = hasattr(_zerocopy, "fcopyfile")
 HAS_WIN32_COPYFILE = os.name == 'nt'
+# Python >= 3.3, Linux >= 3.1, Solaris, FreeBSD
+HAS_SEEK_HOLE = hasattr(os, "SEEK_DATA") and hasattr(os, "SEEK_HOLE")
+HAS_SYNC_FILE_RANGE = hasattr(_zerocopy, "sync_file_range")
+HAS_FALLOCATE = hasattr(_zerocopy, "fallocate")
+# Python >= 3.4, Linux >= 3.11; linking the file requires /proc
+_O_TMPFILE = getattr(os, "O_TMPFILE", 0)
+HAS_O_TMPFILE = bool(_O_TMPFILE) and hasattr(_zerocopy, "linkat") and \
+    os.path.isdir("/proc/self/fd")
+# Python >= 3.3
+HAS_PREAD = hasattr(os, "pread")
+# On Linux glibc emulates posix_fallocate() by writing zeros if the
+# filesystem can't preallocate, which would double the disk writes.
+HAS_POSIX_FALLOCATE = hasattr(os, "posix_fallocate") and \
+    not sys.platform.startswith("linux")
+# Python >= 3.3
+HAS_FADVISE = hasattr(os, "posix_fadvise")
 PY3 = sys.version_info[0] == 3
 
+# so that opening a named pipe does not block
+_O_NONBLOCK = getattr(os, "O_NONBLOCK", 0)
+
+# min size of the ranges copied concurrently by copyfile(workers=N)
+_PARALLEL_MIN_CHUNKSIZE = 2 ** 23  # 8MB
+
+# buffer size used by the read() / write() fallback (rounded to
+# st_blksize)
+_COPY_BUFSIZE = 2 ** 20  # 1MB
+# min file size for the mmap() fallback, and size of each write()
+_MMAP_MIN_SIZE = 2 ** 23  # 8MB
+_MMAP_CHUNKSIZE = 2 ** 23  # 8MB
+# default number of bytes copied between copyfile(progress=...)
+# callbacks and cancel checks; also the size passed to each zero-copy
+# syscall, which keeps the per-chunk overhead well below 1%
+_PROGRESS_CHUNKSIZE = 2 ** 26  # 64MB
+
+# copyfile(delta=True): files are compared DELTA_CHUNKSIZE bytes at a
+# time and only the DELTA_BLOCKSIZE blocks which differ are rewritten
+_DELTA_CHUNKSIZE = 2 ** 20  # 1MB
+_DELTA_BLOCKSIZE = 2 ** 16  # 64KB
+
+# errnos meaning that O_TMPFILE is not supported by the kernel (EISDIR)
+# or the filesystem
+_O_TMPFILE_UNSUPPORTED_ERRNOS = frozenset([
+    errno.EISDIR, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL])
+_replace = getattr(os, "replace", os.rename)  # Python 2: POSIX only
+
+# O_DIRECT engine: buffer size, and alignment of buffers, file offsets
+# and sizes (the logical block size is 512 or 4096)
+_O_DIRECT = getattr(os, "O_DIRECT", 0)
+_DIRECT_BUFSIZE = 2 ** 23  # 8MB
+_DIRECT_ALIGN = 4096
+
+# {(src st_dev, dst st_dev): {strategy: works?}}
+_fs_caps = {}
+_fs_caps_lock = threading.Lock()
+# errnos meaning a strategy can't work between 2 filesystems (as
+# opposed to transient failures), which are worth remembering
+_FS_CAP_UNSUPPORTED_ERRNOS = frozenset([
+    errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+    errno.ENOTSUP, errno.ENOTSOCK, errno.ENOTTY])
+
 
 # =====================================================================
 # --- shutil module compatibility between Python 2 and 3
@@ -40,6 +117,12 @@ else:
         """Raised when source and destination are the same file."""
 
 
+class CopyCancelledError(Exception):
+    """Raised by copyfile() when the copy is cancelled via its cancel
+    argument.
+    """
+
+
 class _GiveupOnZeroCopy(Exception):
     """Raised as a signal to fallback on using raw file copy
     when zero-copy functions fail to do so.
@@ -64,6 +147,54 @@ def _samefile(src, dst):
 # =====================================================================
 
 
+def _get_blocksize(infd, size=None):
+    """Return the number of bytes to pass to zero-copy syscalls: the
+    whole file size (min 8MB), so that hopefully one call is enough,
+    or the progress chunk size if the copy reports its progress.
+    size is src file size, if the caller knows it already.
+    """
+    progress = _get_progress()
+    if progress is not None:
+        return progress.chunksize
+    if size is None:
+        try:
+            size = os.fstat(infd).st_size
+        except Exception:
+            return 2 ** 27  # 128MB
+    return max(size, 2 ** 23)  # min 8MB
+
+
+# errnos meaning the filesystem (or the fs pair) can't reflink
+_REFLINK_UNSUPPORTED_ERRNOS = frozenset([
+    errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP,
+    errno.ENOTTY, errno.EBADF, errno.ETXTBSY])
+
+
+def _zerocopy_reflink(fsrc, fdst):
+    """Make dst share the same data extents of src by using the
+    FICLONE ioctl (copy-on-write clone). This takes constant time
+    regardless of the file size.
+    This should work on Linux >= 4.5 with Btrfs, XFS, OCFS2 and
+    other CoW-capable filesystems only.
+    """
+    try:
+        infd = fsrc.fileno()
+        outfd = fdst.fileno()
+    except Exception as err:
+        raise _GiveupOnZeroCopy(err)  # not a regular file
+
+    try:
+        _stats.add_syscalls()
+        _zerocopy.ficlone(infd, outfd)
+    except OSError as err:
+        if err.errno in _REFLINK_UNSUPPORTED_ERRNOS:
+            raise _GiveupOnZeroCopy(err)
+        raise  # six.raise_from(err, None)
+    # FICLONE doesn't move the file offset; leave it at EOF as the
+    # other strategies do.
+    os.lseek(outfd, 0, os.SEEK_END)
+
+
 def _zerocopy_osx(fsrc, fdst):
     """Copy 2 regular mmap-like files by using high-performance
     fcopyfile() syscall (OSX only).
@@ -75,6 +206,7 @@ def _zerocopy_osx(fsrc, fdst):
         raise _GiveupOnZeroCopy(err)  # not a regular file
 
     try:
+        _stats.add_syscalls()
         _zerocopy.fcopyfile(infd, outfd)
     except OSError as err:
         if err.errno in {errno.EINVAL, errno.ENOTSUP}:
@@ -95,12 +227,65 @@ def _zerocopy_win(src, dst):
             raise OSError(err.winerror, err.strerror, src)
 
 
-def _zerocopy_sendfile(fsrc, fdst):
+def _zerocopy_copy_file_range(fsrc, fdst, size=None):
+    """Copy data from one regular mmap-like fd to another by using
+    high-performance copy_file_range() syscall. Depending on the
+    filesystem this may result in an in-kernel copy, a server-side
+    copy (NFS, CIFS) or a reflink (XFS, Btrfs).
+    This should work on Linux >= 4.5 only.
+    """
+    try:
+        infd = fsrc.fileno()
+        outfd = fdst.fileno()
+    except Exception as err:
+        raise _GiveupOnZeroCopy(err)  # not a regular file
+
+    blocksize = _get_blocksize(infd, size)
+
+    # Offsets are not passed so that the position of both fds is
+    # updated by the kernel, as with read() / write().
+    offset = 0
+    stats = _stats.current()
+    progress = _get_progress()
+    while True:
+        if stats is not None:
+            stats.syscalls += 1
+        try:
+            copied = _zerocopy.copy_file_range(infd, outfd, blocksize)
+        except OSError as err:
+            if err.errno == errno.EINTR:
+                continue
+            if err.errno == errno.ENOSYS:
+                # Kernel < 4.5 or syscall blocked (e.g. seccomp).
+                raise _GiveupOnZeroCopy(err)
+
+            if err.errno == errno.ENOSPC:  # filesystem is full
+                raise  # six.raise_from(err, None)
+
+            # Give up on first call and if no data was copied. This
+            # covers EXDEV (cross-filesystem copy on Linux < 5.3),
+            # EINVAL, EOPNOTSUPP and alike.
+            if offset == 0 and os.lseek(outfd, 0, os.SEEK_CUR) == 0:
+                raise _GiveupOnZeroCopy(err)
+
+            raise  # six.raise_from(err, None)
+        else:
+            if copied == 0:
+                # Some filesystems (e.g. procfs) silently return 0
+                # on first call even if there's data to copy.
+                if offset == 0:
+                    raise _GiveupOnZeroCopy("no data copied")
+                break  # EOF
+            offset += copied
+            if progress is not None:
+                progress.update(copied)
+
+
+def _zerocopy_sendfile(fsrc, fdst, size=None):
     """Copy data from one regular mmap-like fd to another by using
     high-performance sendfile() method.
     This should work on Linux >= 2.6.33 and Solaris only.
     """
-    global HAS_SENDFILE
     try:
         infd = fsrc.fileno()
         outfd = fdst.fileno()
@@ -112,21 +297,23 @@ def _zerocopy_sendfile(fsrc, fdst):
     # so a bufsize smaller or bigger than the actual file size
     # should not make any difference, also in case the file content
     # changes while being copied.
-    try:
-        blocksize = max(os.fstat(infd).st_size, 2 ** 23)  # min 8MB
-    except Exception:
-        blocksize = 2 ** 27  # 128MB
+    blocksize = _get_blocksize(infd, size)
 
     offset = 0
+    stats = _stats.current()
+    progress = _get_progress()
     while True:
+        if stats is not None:
+            stats.syscalls += 1
         try:
             sent = _zerocopy.sendfile(outfd, infd, offset, blocksize)
         except OSError as err:
+            if err.errno == errno.EINTR:
+                continue
             if err.errno == errno.ENOTSOCK:
                 # sendfile() on this platform (probably Linux < 2.6.33)
                 # does not support copies between regular files (only
                 # sockets).
-                HAS_SENDFILE = False
                 raise _GiveupOnZeroCopy(err)
 
             if err.errno == errno.ENOSPC:  # filesystem is full
@@ -141,13 +328,729 @@ def _zerocopy_sendfile(fsrc, fdst):
             if sent == 0:
                 break  # EOF
             offset += sent
+            if progress is not None:
+                progress.update(sent)
+
+
+def _zerocopy_copyfd(fsrc, fdst, size=None):
+    """Same as _zerocopy_sendfile() but the whole sendfile() loop is
+    executed in C, releasing the GIL only once instead of once per
+    chunk, which reduces contention with other Python threads.
+    This should work on Linux >= 2.6.33 only.
+    """
+    try:
+        infd = fsrc.fileno()
+        outfd = fdst.fileno()
+    except Exception as err:
+        raise _GiveupOnZeroCopy(err)  # not a regular file
+
+    blocksize = _get_blocksize(infd, size)
+    _stats.add_syscalls()
+    try:
+        _zerocopy.copyfd(infd, outfd, blocksize)
+    except OSError as err:
+        if err.errno == errno.ENOTSOCK:
+            # sendfile() does not support copies between regular
+            # files on this platform (see _zerocopy_sendfile()).
+            raise _GiveupOnZeroCopy(err)
+
+        if err.errno == errno.ENOSPC:  # filesystem is full
+            raise  # six.raise_from(err, None)
+
+        # Give up if no data was copied (dst position is untouched).
+        if os.lseek(outfd, 0, os.SEEK_CUR) == 0:
+            raise _GiveupOnZeroCopy(err)
+
+        raise  # six.raise_from(err, None)
+
+
+def _copy_file_range_at(infd, outfd, offset, count):
+    """Copy count bytes from infd to outfd, both starting at offset,
+    by using copy_file_range(). File positions are not altered, so
+    this is safe to use from multiple threads sharing the same fds.
+    Return the number of bytes copied (less than count on EOF).
+    """
+    copied = 0
+    while copied < count:
+        _stats.add_syscalls()
+        try:
+            n = _zerocopy.copy_file_range(
+                infd, outfd, count - copied,
+                offset_src=offset + copied, offset_dst=offset + copied)
+        except OSError as err:
+            if err.errno == errno.EINTR:
+                continue
+            raise
+        if n == 0:
+            break  # EOF
+        copied += n
+    return copied
+
+
+def _copy_range(infd, outfd, offset, count):
+    """Copy count bytes from infd to outfd, both starting at offset,
+    by using the best primitive available: copy_file_range(), then
+    sendfile(), then pread() / pwrite().
+    Return the number of bytes copied (less than count on EOF).
+    """
+    if HAS_COPY_FILE_RANGE:
+        try:
+            return _copy_file_range_at(infd, outfd, offset, count)
+        except OSError as err:
+            if err.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL,
+                                 errno.EOPNOTSUPP, errno.ENOTSUP):
+                raise
+            # Note: a partially copied range is simply re-copied.
+
+    copied = 0
+    if HAS_SENDFILE:
+        # sendfile() writes at the current dst position.
+        os.lseek(outfd, offset, os.SEEK_SET)
+        try:
+            while copied < count:
+                _stats.add_syscalls()
+                try:
+                    n = _zerocopy.sendfile(outfd, infd, offset + copied,
+                                           count - copied)
+                except OSError as err:
+                    if err.errno == errno.EINTR:
+                        continue
+                    raise
+                if n == 0:
+                    return copied  # EOF
+                copied += n
+            return copied
+        except OSError as err:
+            if err.errno != errno.ENOTSOCK:
+                raise
+
+    while copied < count:
+        _stats.add_syscalls()
+        chunk = os.pread(infd, min(count - copied, 2 ** 20),
+                         offset + copied)
+        if not chunk:
+            break  # EOF
+        view = memoryview(chunk)
+        while view:
+            _stats.add_syscalls()
+            n = os.pwrite(outfd, view, offset + copied)
+            view = view[n:]
+            copied += n
+    return copied
+
+
+def _iter_data_extents(fd, size):
+    """Yield (offset, length) tuples of the data regions of fd,
+    skipping holes, by using lseek() SEEK_DATA / SEEK_HOLE.
+    """
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as err:
+            if err.errno == errno.ENXIO:
+                return  # there's only a trailing hole left
+            raise
+        # There's always an implicit hole at EOF.
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        if end <= start:
+            return
+        yield (start, end - start)
+        offset = end
+
+
+def _zerocopy_sparse(fsrc, fdst, size=None):
+    """Copy data from one regular file to another by copying data
+    extents only and recreating holes via ftruncate(), so that the
+    sparse layout of src is preserved (e.g. VM images).
+    This should work on Linux >= 3.1, Solaris and FreeBSD.
+    """
+    if not HAS_SEEK_HOLE:
+        raise _GiveupOnZeroCopy("SEEK_DATA / SEEK_HOLE not supported")
+    try:
+        infd = fsrc.fileno()
+        outfd = fdst.fileno()
+    except Exception as err:
+        raise _GiveupOnZeroCopy(err)  # not a regular file
+
+    if size is None:
+        size = os.fstat(infd).st_size
+    extents = _iter_data_extents(infd, size)
+    try:
+        first = next(extents, None)
+    except OSError as err:
+        # Filesystem does not support SEEK_DATA (EINVAL) or alike.
+        raise _GiveupOnZeroCopy(err)
+
+    progress = _get_progress()
+    if first is not None:
+        pos = 0
+        for offset, length in itertools.chain([first], extents):
+            if progress is None:
+                _copy_range(infd, outfd, offset, length)
+                continue
+            progress.update(offset - pos)  # skipped hole
+            pos = offset + length
+            chunksize = progress.chunksize
+            for off in range(offset, pos, chunksize):
+                progress.update(_copy_range(infd, outfd, off,
+                                            min(chunksize, pos - off)))
+    # Recreate trailing hole (if any) and set the final size.
+    os.ftruncate(outfd, size)
+    os.lseek(outfd, size, os.SEEK_SET)
+
 
+def _zerocopy_parallel(fsrc, fdst, workers, size=None):
+    """Copy data from one regular file to another by splitting it in
+    ranges which are copied concurrently by a pool of threads via
+    positional copy_file_range() calls (the GIL is released while
+    copying). This is meant to saturate fast NVMe disks and striped
+    network filesystems when copying very large files.
+    This should work on Linux >= 4.5 only.
+    """
+    if not HAS_COPY_FILE_RANGE or ThreadPoolExecutor is None:
+        raise _GiveupOnZeroCopy("copy_file_range() not supported")
+    try:
+        infd = fsrc.fileno()
+        outfd = fdst.fileno()
+    except Exception as err:
+        raise _GiveupOnZeroCopy(err)  # not a regular file
+
+    if size is None:
+        size = os.fstat(infd).st_size
+    if size <= _PARALLEL_MIN_CHUNKSIZE:
+        raise _GiveupOnZeroCopy("file too small")
+
+    # Probe copy_file_range() support for this fd pair in the main
+    # thread first, so that we can give up if no data was copied.
+    probesize = 65536
+    try:
+        probed = _copy_file_range_at(infd, outfd, 0, probesize)
+    except OSError as err:
+        if err.errno == errno.ENOSPC:
+            raise
+        raise _GiveupOnZeroCopy(err)
 
-def _copyfileobj2(fsrc, fdst):
-    """Copy 2 regular mmap-like fds by using zero-copy sendfile(2)
-    (Linux) and fcopyfile(2) (OSX) syscalls.
+    # Size dst upfront so that each range can be written independently
+    # (disk space is allocated by copyfile(preallocate=True), if asked).
+    os.ftruncate(outfd, size)
+    chunksize = max(-(-(size - probed) // workers), _PARALLEL_MIN_CHUNKSIZE)
+    progress = _get_progress()
+    if progress is not None:
+        # Smaller ranges, so that progress is reported as they're done.
+        chunksize = min(chunksize, progress.chunksize)
+    ranges = [(off, min(chunksize, size - off))
+              for off in range(probed, size, chunksize)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_copy_file_range_at, infd, outfd, off, n)
+                   for off, n in ranges]
+        if progress is not None:
+            progress.update(probed)
+            try:
+                for fut in futures:
+                    progress.update(fut.result())
+            except CopyCancelledError:
+                # Don't start the ranges which are left.
+                for fut in futures:
+                    fut.cancel()
+                raise
+    # Workers don't see this thread's stats: at least 1 call per range.
+    _stats.add_syscalls(len(ranges))
+    # All ranges are done; raise the first error (in file order), if any.
+    results = [fut.result() for fut in futures]
+
+    # src may have shrunk while being copied.
+    for (off, n), copied in zip(ranges, results):
+        if copied < n:
+            size = off + copied
+            os.ftruncate(outfd, size)
+            break
+    os.lseek(outfd, size, os.SEEK_SET)
+
+
+# per-thread reusable buffer of the read() / write() fallback
+_tls = threading.local()
+
+
+def _get_bufsize(size=None, blksize=None):
+    """Return the buffer size to use to copy a file of the given size
+    with read() / write(): _COPY_BUFSIZE rounded to a multiple of the
+    filesystem block size, or less for small files so that the whole
+    file is read in one call.
+    """
+    blksize = blksize or 8192
+    bufsize = max(blksize, _COPY_BUFSIZE // blksize * blksize)
+    if size:
+        # +1 so that the file is read at once *and* EOF is hit.
+        bufsize = min(bufsize, -(-(size + 1) // blksize) * blksize)
+    return bufsize
+
+
+def _get_buffer(bufsize):
+    """Return a memoryview of bufsize bytes backed by a bytearray which
+    is reused by all the copies done in the same thread.
+    """
+    buf = getattr(_tls, "buf", None)
+    if buf is None or len(buf) < bufsize:
+        buf = _tls.buf = bytearray(max(bufsize, _COPY_BUFSIZE))
+    return memoryview(buf)[:bufsize]
+
+
+def _copyfileobj_readinto(fsrc, fdst, size=None, blksize=None):
+    """Copy data from fsrc to fdst 'till EOF by using readinto() with a
+    reusable preallocated buffer, so that no bytes object is created
+    on each read (as opposed to shutil.copyfileobj()).
+    size and blksize are src file size and the filesystem block size
+    (st_blksize), used to pick the buffer size.
+    """
+    bufsize = _get_bufsize(size, blksize)
+    view = _get_buffer(bufsize)
+    # localize variable access to minimize overhead
+    fsrc_readinto = fsrc.readinto
+    fdst_write = fdst.write
+    progress = _get_progress()
+    calls = 0
+    try:
+        while True:
+            calls += 1
+            n = fsrc_readinto(view)
+            if not n:
+                break  # EOF
+            calls += 1
+            if n < bufsize:
+                fdst_write(view[:n])
+            else:
+                fdst_write(view)
+            if progress is not None:
+                progress.update(n)
+    finally:
+        _stats.add_syscalls(calls)
+
+
+def _copyfileobj_mmap(fsrc, fdst, size):
+    """Copy data from fsrc to fdst by mmap()ing src and writing from
+    the mapping, which saves copying data into a user space buffer.
+    Only for big regular files. Note: if src gets truncated while
+    being copied the process is killed by SIGBUS.
+    """
+    if not PY3 or size < _MMAP_MIN_SIZE:
+        raise _GiveupOnZeroCopy("mmap() not worth it")
+    try:
+        mm = mmap.mmap(fsrc.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception as err:
+        raise _GiveupOnZeroCopy(err)  # e.g. the fs does not support it
+
+    with contextlib.closing(mm):
+        if hasattr(mm, "madvise"):  # Python >= 3.8
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        mapped = len(mm)
+        view = memoryview(mm)
+        progress = _get_progress()
+        chunksize = _MMAP_CHUNKSIZE
+        if progress is not None:
+            chunksize = min(chunksize, progress.chunksize)
+        try:
+            for offset in range(0, mapped, chunksize):
+                _stats.add_syscalls()
+                fdst.write(view[offset:offset + chunksize])
+                if progress is not None:
+                    progress.update(min(chunksize, mapped - offset))
+        finally:
+            view.release()
+    # src may have grown in the meantime.
+    fsrc.seek(mapped)
+    _copyfileobj_readinto(fsrc, fdst)
+
+
+def _copyfileobj_direct(fsrc, fdst, size=None):
+    """Copy data from fsrc to fdst with read() / write() on fds
+    switched to O_DIRECT, through a page-aligned buffer, so that data
+    does not go through the page cache at all. The last unaligned
+    chunk (if any) is written without O_DIRECT.
+    Linux only; not all filesystems support it (e.g. tmpfs < 6.6).
+    """
+    if not _O_DIRECT or not hasattr(os, "readv"):
+        raise _GiveupOnZeroCopy("O_DIRECT not supported")
+    try:
+        infd = fsrc.fileno()
+        outfd = fdst.fileno()
+    except Exception as err:
+        raise _GiveupOnZeroCopy(err)  # not a regular file
+
+    inpos = os.lseek(infd, 0, os.SEEK_CUR)
+    if inpos % _DIRECT_ALIGN or os.lseek(outfd, 0, os.SEEK_CUR) % \
+            _DIRECT_ALIGN:
+        raise _GiveupOnZeroCopy("unaligned file position")
+    in_flags = fcntl.fcntl(infd, fcntl.F_GETFL)
+    out_flags = fcntl.fcntl(outfd, fcntl.F_GETFL)
+    bufsize = _DIRECT_BUFSIZE
+    if size:
+        bufsize = min(bufsize, -(-(size + 1) // _DIRECT_ALIGN) *
+                      _DIRECT_ALIGN)
+    # Anonymous mappings are page aligned.
+    buf = mmap.mmap(-1, bufsize)
+    view = memoryview(buf)
+    progress = _get_progress()
+    copied = 0
+    try:
+        try:
+            fcntl.fcntl(infd, fcntl.F_SETFL, in_flags | _O_DIRECT)
+            fcntl.fcntl(outfd, fcntl.F_SETFL, out_flags | _O_DIRECT)
+        except (IOError, OSError) as err:
+            raise _GiveupOnZeroCopy(err)
+
+        while True:
+            _stats.add_syscalls()
+            try:
+                n = os.readv(infd, [view])
+                if not n:
+                    break  # EOF
+                if n % _DIRECT_ALIGN:
+                    # Last chunk: can't be written with O_DIRECT.
+                    fcntl.fcntl(outfd, fcntl.F_SETFL, out_flags)
+                written = 0
+                while written < n:
+                    _stats.add_syscalls()
+                    written += os.write(outfd, view[written:n])
+            except OSError as err:
+                if copied == 0 and err.errno == errno.EINVAL:
+                    # Unsupported alignment or filesystem.
+                    os.lseek(infd, inpos, os.SEEK_SET)
+                    os.lseek(outfd, 0, os.SEEK_SET)
+                    raise _GiveupOnZeroCopy(err)
+                raise  # six.raise_from(err, None)
+            copied += n
+            if progress is not None:
+                progress.update(n)
+    finally:
+        fcntl.fcntl(infd, fcntl.F_SETFL, in_flags)
+        fcntl.fcntl(outfd, fcntl.F_SETFL, out_flags)
+        view.release()
+        buf.close()
+
+
+def _copyfileobj_delta(fsrc, fdst, size, dst_size):
+    """Update an existing dst so that it's equal to src by comparing
+    them block by block and rewriting only the blocks which differ
+    (adjacent ones are coalesced) via positional zero-copy calls.
+    dst must be open for reading and writing. Return the number of
+    bytes written.
+    """
+    infd = fsrc.fileno()
+    outfd = fdst.fileno()
+    progress = _get_progress()
+    common = min(size, dst_size)
+    written = 0
+    offset = 0
+    pending = None  # start of the differing range not written yet
+    while offset < common:
+        _stats.add_syscalls(2)
+        a = os.pread(infd, min(_DELTA_CHUNKSIZE, common - offset), offset)
+        if not a:
+            size = offset  # src shrank
+            break
+        b = os.pread(outfd, len(a), offset)
+        if a == b:
+            if pending is not None:
+                written += _copy_range(infd, outfd, pending, offset - pending)
+                pending = None
+        else:
+            for i in range(0, len(a), _DELTA_BLOCKSIZE):
+                same = a[i:i + _DELTA_BLOCKSIZE] == b[i:i + _DELTA_BLOCKSIZE]
+                if not same and pending is None:
+                    pending = offset + i
+                elif same and pending is not None:
+                    written += _copy_range(infd, outfd, pending,
+                                           offset + i - pending)
+                    pending = None
+        offset += len(a)
+        if progress is not None:
+            progress.update(len(a))
+
+    # Write the last differing range along with the part of src past
+    # dst EOF, if any.
+    start = offset if pending is None else pending
+    if size > start:
+        n = _copy_range(infd, outfd, start, size - start)
+        written += n
+        size = start + n
+        if progress is not None:
+            progress.update(size - offset)
+    if dst_size > size:
+        os.ftruncate(outfd, size)
+    os.lseek(outfd, size, os.SEEK_SET)
+    return written
+
+
+# =====================================================================
+# --- preallocation
+# =====================================================================
+
+
+# errnos meaning the filesystem can't preallocate
+_FALLOCATE_UNSUPPORTED_ERRNOS = frozenset([
+    errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS, errno.EINVAL])
+
+
+def _check_free_space(path, size, fd=None):
+    """Raise OSError(ENOSPC) if the filesystem of path (or fd) has
+    less than size bytes available to unprivileged users. Do nothing
+    if that can't be determined.
+    """
+    try:
+        if fd is not None and hasattr(os, "fstatvfs"):
+            st = os.fstatvfs(fd)
+            free = st.f_bavail * st.f_frsize
+        elif hasattr(shutil, "disk_usage"):  # Python >= 3.3
+            free = shutil.disk_usage(path).free
+        else:
+            return
+    except OSError:
+        return
+    if free < size:
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC), path)
+
+
+def _preallocate(fdst, size):
+    """Allocate size bytes of disk space for fdst upfront, so that the
+    filesystem can lay it out contiguously and the copy fails at once
+    with ENOSPC if there's not enough space. On Linux dst size is not
+    changed (FALLOC_FL_KEEP_SIZE) so that a partial copy still looks
+    partial. If the filesystem can't preallocate only check there's
+    enough free space.
+    """
+    outfd = fdst.fileno()
+    try:
+        if HAS_FALLOCATE:
+            _zerocopy.fallocate(outfd, _zerocopy.FALLOC_FL_KEEP_SIZE, 0,
+                                size)
+            return
+        if HAS_POSIX_FALLOCATE:
+            os.posix_fallocate(outfd, 0, size)
+            return
+    except OSError as err:
+        if err.errno not in _FALLOCATE_UNSUPPORTED_ERRNOS:
+            raise  # six.raise_from(err, None)
+    _check_free_space(None, size, fd=outfd)
+
+
+# =====================================================================
+# --- progress and cancellation
+# =====================================================================
+
+
+class _Progress(object):
+    """State of a copyfile(progress=..., cancel=..., cache=...) call,
+    shared with the copy engines via a thread-local. Engines copy at
+    most chunksize bytes per syscall and call update() after each of
+    them; once every chunksize bytes the callback is called, the
+    cancel event is checked and, if drop_fds is set, the chunks copied
+    so far are evicted from the page cache.
+    """
+
+    __slots__ = ("callback", "cancel", "chunksize", "total", "copied",
+                 "drop_fds", "_next", "_reported", "_dropped",
+                 "_writeback")
+
+    def __init__(self, callback, cancel, chunksize):
+        self.callback = callback
+        self.cancel = cancel
+        self.chunksize = chunksize
+        self.total = None
+        self.copied = 0
+        # (src fd, dst fd) if the copy should bypass the page cache
+        self.drop_fds = None
+        self._next = chunksize
+        self._reported = None
+        self._dropped = 0
+        # dst range whose writeback was started but not waited for
+        self._writeback = None
+
+    def check(self):
+        if self.cancel is not None and self.cancel.is_set():
+            raise CopyCancelledError("copy was cancelled")
+
+    def report(self):
+        if self.callback is not None:
+            self._reported = self.copied
+            self.callback(self.copied, self.total)
+
+    def update(self, n):
+        self.copied += n
+        if self.copied >= self._next:
+            self._next = self.copied + self.chunksize
+            if self.drop_fds is not None:
+                self.drop_cache()
+            self.report()
+            self.check()
+
+    def drop_cache(self):
+        """Evict the range copied since the last call from the page
+        cache. src pages are clean and go away at once; dirty dst
+        pages must be written back first: writeback of this range is
+        started and the one of the previous range (which likely
+        completed in the meantime) is waited for before evicting it,
+        so that the copy does not stall on every chunk.
+        """
+        infd, outfd = self.drop_fds
+        start, end = self._dropped, self.copied
+        if end <= start:
+            return
+        os.posix_fadvise(infd, start, end - start, os.POSIX_FADV_DONTNEED)
+        if HAS_SYNC_FILE_RANGE:
+            _zerocopy.sync_file_range(outfd, start, end - start,
+                                      _zerocopy.SYNC_FILE_RANGE_WRITE)
+            if self._writeback is not None:
+                wstart, wend = self._writeback
+                _zerocopy.sync_file_range(
+                    outfd, wstart, wend - wstart,
+                    _zerocopy.SYNC_FILE_RANGE_WAIT_BEFORE |
+                    _zerocopy.SYNC_FILE_RANGE_WRITE |
+                    _zerocopy.SYNC_FILE_RANGE_WAIT_AFTER)
+                os.posix_fadvise(outfd, wstart, wend - wstart,
+                                 os.POSIX_FADV_DONTNEED)
+            self._writeback = (start, end)
+        else:
+            os.fdatasync(outfd)
+            os.posix_fadvise(outfd, start, end - start,
+                             os.POSIX_FADV_DONTNEED)
+        self._dropped = end
+
+    def drop_all(self):
+        # Engines such as sparse may have written past self.copied.
+        infd, outfd = self.drop_fds
+        if HAS_SYNC_FILE_RANGE:
+            _zerocopy.sync_file_range(
+                outfd, 0, 0,
+                _zerocopy.SYNC_FILE_RANGE_WAIT_BEFORE |
+                _zerocopy.SYNC_FILE_RANGE_WRITE |
+                _zerocopy.SYNC_FILE_RANGE_WAIT_AFTER)
+        else:
+            os.fdatasync(outfd)
+        os.posix_fadvise(outfd, 0, 0, os.POSIX_FADV_DONTNEED)
+        os.posix_fadvise(infd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+    def finish(self, copied):
+        # Engines such as reflink don't call update(). The copy is
+        # complete: don't check for cancellation anymore.
+        self.copied = copied
+        if self.drop_fds is not None:
+            self.drop_all()
+        if self._reported != copied:
+            self.report()
+
+
+def _get_progress():
+    return getattr(_tls, "progress", None)
+
+
+# =====================================================================
+# --- per-filesystem capability cache
+# =====================================================================
+
+
+def _fs_key(fsrc, fdst, src_st=None, dst_st=None):
+    """Return the (src st_dev, dst st_dev) key identifying the
+    filesystem pair of 2 file objects, or None if unknown.
+    src_st and dst_st are their stat results, if already known.
+    """
+    try:
+        st = src_st or os.fstat(fsrc.fileno())
+        dst_dev = (dst_st or os.fstat(fdst.fileno())).st_dev
+    except Exception:
+        return None  # not a regular file
+    if not st.st_size:
+        # Either empty or a procfs-like file, for which a failed
+        # strategy tells nothing about the filesystem.
+        return None
+    return (st.st_dev, dst_dev)
+
+
+def _fs_cap_known_broken(key, strategy):
+    return key is not None and \
+        _fs_caps.get(key, {}).get(strategy) is False
+
+
+def _set_fs_cap(key, strategy, works):
+    if key is not None:
+        with _fs_caps_lock:
+            _fs_caps.setdefault(key, {})[strategy] = works
+
+
+def _giveup_is_permanent(err):
+    """Whether a strategy gave up because it's not supported by the
+    filesystem pair, so that it's not worth trying it again.
+    """
+    reason = err.args[0] if err.args else None
+    return getattr(reason, "errno", None) in _FS_CAP_UNSUPPORTED_ERRNOS
+
+
+def _try_strategy(key, strategy, fun, *args):
+    """Run a zero-copy strategy unless it's known to not work for
+    the filesystem pair identified by key, and remember the outcome
+    (transient failures are not remembered).
+    Return True on success, False if it gave up (or was skipped).
+    """
+    if _fs_cap_known_broken(key, strategy):
+        return False
+    _stats.attempt(strategy)
+    try:
+        fun(*args)
+    except _GiveupOnZeroCopy as err:
+        _stats.giveup(strategy, err)
+        if _giveup_is_permanent(err):
+            _set_fs_cap(key, strategy, False)
+        return False
+    _set_fs_cap(key, strategy, True)
+    return True
+
+
+def fs_capabilities():
+    """Return which copy strategies were found to work (True) or not
+    (False) for each filesystem pair copyfile() has dealt with, as a
+    {(src st_dev, dst st_dev): {strategy: bool}} dict.
+    Strategies are "reflink", "direct", "copy_file_range", "sendfile"
+    and "fcopyfile"; if all of them fail plain read() / write() is
+    used.
+    Strategies which are known to be unsupported are skipped by the
+    next copies between the same filesystems; transient failures are
+    not recorded.
+    """
+    with _fs_caps_lock:
+        return dict((key, dict(caps)) for key, caps in _fs_caps.items())
+
+
+def reset_fs_capabilities():
+    """Forget what fs_capabilities() learned, e.g. after a filesystem
+    was remounted with different options or upgraded.
+    """
+    with _fs_caps_lock:
+        _fs_caps.clear()
+
+
+def _copyfileobj2(fsrc, fdst, reflink=False, sparse=False, workers=None,
+                  use_mmap=False, cache=None, preallocate=False,
+                  src_st=None, dst_st=None):
+    """Copy 2 regular mmap-like fds by using zero-copy
+    copy_file_range(2) and sendfile(2) (Linux) and fcopyfile(2) (OSX)
+    syscalls.
     In case of error fallback on using plain read()/write() if no
-    data was copied.
+    data was copied (from mmap()ed src if use_mmap is True).
+    If reflink is True or "auto" try to clone the file first; if
+    True give up by raising OSError in case that's not possible.
+    If sparse is True only copy data extents and preserve holes.
+    If workers > 1 copy file ranges concurrently using N threads.
+    If cache is "direct" try read() / write() with O_DIRECT first.
+    If preallocate is True allocate dst disk space before copying data
+    (unless the file was cloned or copied sparse).
+    Strategies which are known to not work between the filesystems
+    of fsrc and fdst are skipped (see fs_capabilities()).
+    If the copy reports its progress data is copied in chunks and
+    strategies copying the whole file in one call are skipped.
+    src_st and dst_st are the stat results of fsrc and fdst, if the
+    caller has them already.
+    Return dst size if the file was cloned, else None, in which case
+    dst offset is at EOF.
     """
     # Note: copyfileobj() is left alone in order to not introduce any
     # unexpected breakage. Possible risks by using zero-copy calls
@@ -158,22 +1061,293 @@ def _copyfileobj2(fsrc, fdst):
     #   GzipFile (which decompresses data), HTTPResponse (which decodes
     #   chunks).
     # - possibly others
-    if HAS_SENDFILE:
+    key = _fs_key(fsrc, fdst, src_st, dst_st)
+    size = src_st.st_size if src_st is not None else None
+    if reflink is True and not HAS_FICLONE:
+        raise OSError(errno.ENOTSUP,
+                      "reflink is not supported on this platform")
+    if reflink and HAS_FICLONE:
+        if reflink != "auto" or not _fs_cap_known_broken(key, "reflink"):
+            _stats.attempt("reflink")
+            try:
+                _zerocopy_reflink(fsrc, fdst)
+            except _GiveupOnZeroCopy as err:
+                if _giveup_is_permanent(err):
+                    _set_fs_cap(key, "reflink", False)
+                if reflink != "auto":
+                    if isinstance(err.args[0], OSError):
+                        raise err.args[0]
+                    raise OSError(errno.ENOTSUP, str(err))
+                _stats.giveup("reflink", err)
+            else:
+                _set_fs_cap(key, "reflink", True)
+                return os.fstat(fdst.fileno()).st_size
+
+    if sparse:
+        _stats.attempt("sparse")
         try:
-            return _zerocopy_sendfile(fsrc, fdst)
-        except _GiveupOnZeroCopy:
-            pass
+            return _zerocopy_sparse(fsrc, fdst, size)
+        except _GiveupOnZeroCopy as err:
+            _stats.giveup("sparse", err)
+
+    if preallocate and size and dst_st is not None and \
+            stat.S_ISREG(dst_st.st_mode):
+        _preallocate(fdst, size)
+
+    if cache == "direct":
+        if _try_strategy(key, "direct", _copyfileobj_direct, fsrc, fdst,
+                         size):
+            return
 
-    if HAS_FCOPYFILE:
+    if workers is not None and workers > 1 and \
+            not _fs_cap_known_broken(key, "copy_file_range"):
+        _stats.attempt("parallel")
         try:
-            return _zerocopy_osx(fsrc, fdst)
-        except _GiveupOnZeroCopy:
-            pass
+            return _zerocopy_parallel(fsrc, fdst, workers, size)
+        except _GiveupOnZeroCopy as err:
+            _stats.giveup("parallel", err)
 
-    return shutil.copyfileobj(fsrc, fdst)
+    if HAS_COPY_FILE_RANGE:
+        if _try_strategy(key, "copy_file_range",
+                         _zerocopy_copy_file_range, fsrc, fdst, size):
+            return
 
+    # copyfd() and fcopyfile() copy the whole file in one call, hence
+    # they can't report progress or be cancelled.
+    progress = _get_progress()
+    if HAS_COPYFD and progress is None:
+        if _try_strategy(key, "sendfile", _zerocopy_copyfd, fsrc, fdst,
+                         size):
+            return
+    elif HAS_SENDFILE:
+        if _try_strategy(key, "sendfile", _zerocopy_sendfile, fsrc, fdst,
+                         size):
+            return
+
+    if HAS_FCOPYFILE and progress is None:
+        if _try_strategy(key, "fcopyfile", _zerocopy_osx, fsrc, fdst):
+            return
+
+    if use_mmap and src_st is not None and stat.S_ISREG(src_st.st_mode):
+        _stats.attempt("mmap")
+        try:
+            return _copyfileobj_mmap(fsrc, fdst, size)
+        except _GiveupOnZeroCopy as err:
+            _stats.giveup("mmap", err)
+
+    _stats.attempt("readinto")
+    blksize = max(getattr(src_st, "st_blksize", 0),
+                  getattr(dst_st, "st_blksize", 0))
+    return _copyfileobj_readinto(fsrc, fdst, size, blksize)
+
+
+def _open_nonblock(path, flags, mode=0o777):
+    """os.open() path with O_NONBLOCK, so that opening a named pipe
+    does not block. If a file lease is held by another process (which
+    makes the open fail with EWOULDBLOCK) re-open it in blocking mode,
+    waiting for the lease to be broken as a plain open() does.
+    """
+    try:
+        return os.open(path, flags | _O_NONBLOCK, mode)
+    except OSError as err:
+        if not _O_NONBLOCK or \
+                err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+            raise
+    return os.open(path, flags, mode)
 
-def copyfile(src, dst, follow_symlinks=True):
+
+def _clear_nonblock(fd):
+    # O_NONBLOCK is only needed to open special files: don't keep it
+    # for regular files (e.g. it makes I/O on leased files fail).
+    if _O_NONBLOCK:
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        if flags & _O_NONBLOCK:
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~_O_NONBLOCK)
+
+
+def _open_src(src, src_st=None):
+    """Open src for reading and return a (file object, stat result)
+    tuple. Named pipes are detected via fstat() without blocking on
+    open(), so that src is not stat()ed by path.
+    """
+    if src_st is not None:
+        if stat.S_ISFIFO(src_st.st_mode):
+            raise SpecialFileError("`%s` is a named pipe" % src)
+        return open(src, 'rb'), src_st
+
+    try:
+        fd = _open_nonblock(src, os.O_RDONLY)
+    except OSError as err:
+        if PY3:
+            raise
+        raise IOError(err.errno, err.strerror, src)
+    try:
+        st = os.fstat(fd)
+        if stat.S_ISREG(st.st_mode):
+            _clear_nonblock(fd)
+    except Exception:
+        os.close(fd)
+        raise
+    if not stat.S_ISREG(st.st_mode):
+        os.close(fd)
+        if stat.S_ISFIFO(st.st_mode):
+            raise SpecialFileError("`%s` is a named pipe" % src)
+        # e.g. a character device: don't leave it in non-blocking mode
+        return open(src, 'rb'), st
+    return os.fdopen(fd, 'rb'), st
+
+
+def _can_delta(src_st, dst_st=None):
+    return HAS_PREAD and stat.S_ISREG(src_st.st_mode) and (
+        dst_st is None or (stat.S_ISREG(dst_st.st_mode) and dst_st.st_size))
+
+
+def _open_dst(src, dst, src_st, delta=False):
+    """Open dst for writing and return a (file object, stat result)
+    tuple. Same as _open_src() but raise SameFileError if dst is the
+    same file as src, in which case dst is not truncated.
+    If delta is True dst is opened for reading as well and it's not
+    truncated (see _copyfileobj_delta()).
+    """
+    delta = delta and _can_delta(src_st)
+    flags = os.O_RDWR if delta else os.O_WRONLY
+    try:
+        fd = _open_nonblock(dst, flags | os.O_CREAT, 0o666)
+    except OSError as err:
+        # ENXIO: a named pipe with no reader.
+        if err.errno == errno.ENXIO and stat.S_ISFIFO(os.stat(dst).st_mode):
+            raise SpecialFileError("`%s` is a named pipe" % dst)
+        if PY3:
+            raise
+        raise IOError(err.errno, err.strerror, dst)
+    try:
+        st = os.fstat(fd)
+        if stat.S_ISFIFO(st.st_mode):
+            raise SpecialFileError("`%s` is a named pipe" % dst)
+        if st.st_dev == src_st.st_dev and st.st_ino == src_st.st_ino:
+            raise SameFileError("%r and %r are the same file" % (src, dst))
+        if not stat.S_ISREG(st.st_mode):
+            os.close(fd)
+            return open(dst, 'wb'), st
+        _clear_nonblock(fd)
+        if st.st_size and not delta:
+            os.ftruncate(fd, 0)
+    except BaseException:
+        try:
+            os.close(fd)
+        except OSError:
+            pass  # already closed
+        raise
+    return os.fdopen(fd, 'wb'), st
+
+
+def _tmpname(dst):
+    """Return a random, hidden file name in dst directory."""
+    head, tail = os.path.split(dst)
+    rand = binascii.hexlify(os.urandom(6)).decode("ascii")
+    return os.path.join(head, ".%s.%s.tmp" % (tail, rand))
+
+
+def _mkstemp(dst):
+    """Create a temporary file next to dst and return a (fd, name)
+    tuple. Differently from tempfile.mkstemp() it's created with
+    0666 & ~umask permissions, same as dst would.
+    """
+    while True:
+        name = _tmpname(dst)
+        try:
+            return os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                           0o666), name
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+
+
+def _open_dst_atomic(src, dst, src_st):
+    """Same as _open_dst() but open a temporary file which replaces
+    dst once it's written (see _publish()): an anonymous one via
+    O_TMPFILE (Linux), which never shows up in dst directory and
+    vanishes if the process dies, else a hidden file next to dst.
+    Return a (file object, stat result, tmpname, dst) tuple, tmpname
+    being None in case of O_TMPFILE and dst the path to replace
+    (symlinks are resolved). Return None if dst exists and it's not a
+    regular file (e.g. /dev/null), which can't be replaced.
+    """
+    try:
+        st = os.lstat(dst)
+        if stat.S_ISLNK(st.st_mode):
+            dst = os.path.realpath(dst)
+            st = os.stat(dst)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        mode = None
+    else:
+        if st.st_dev == src_st.st_dev and st.st_ino == src_st.st_ino:
+            raise SameFileError("%r and %r are the same file" % (src, dst))
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        # same as when writing into dst
+        mode = stat.S_IMODE(st.st_mode)
+
+    fd = tmpname = None
+    if HAS_O_TMPFILE:
+        dirname = os.path.dirname(os.path.abspath(dst))
+        try:
+            fd = os.open(dirname, _O_TMPFILE | os.O_WRONLY, 0o666)
+        except OSError as err:
+            if err.errno not in _O_TMPFILE_UNSUPPORTED_ERRNOS:
+                raise
+    if fd is None:
+        fd, tmpname = _mkstemp(dst)
+    try:
+        if mode is not None:
+            os.fchmod(fd, mode)
+        st = os.fstat(fd)
+    except BaseException:
+        os.close(fd)
+        if tmpname is not None:
+            _remove_partial(tmpname)
+        raise
+    return os.fdopen(fd, 'wb'), st, tmpname, dst
+
+
+def _publish(fd, tmpname, dst):
+    """Atomically replace dst with the temporary file fd opened by
+    _open_dst_atomic(). An O_TMPFILE file is linked straight to dst
+    if it doesn't exist, else to a temporary name first, since
+    linkat() can't replace an existing file.
+    """
+    if tmpname is None:
+        path = "/proc/self/fd/%d" % fd
+        try:
+            _zerocopy.linkat(_zerocopy.AT_FDCWD, path, _zerocopy.AT_FDCWD,
+                             dst, _zerocopy.AT_SYMLINK_FOLLOW)
+            return
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        while True:
+            tmpname = _tmpname(dst)
+            try:
+                _zerocopy.linkat(_zerocopy.AT_FDCWD, path,
+                                 _zerocopy.AT_FDCWD, tmpname,
+                                 _zerocopy.AT_SYMLINK_FOLLOW)
+                break
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+    try:
+        _replace(tmpname, dst)
+    except BaseException:
+        _remove_partial(tmpname)
+        raise
+
+
+def copyfile(src, dst, follow_symlinks=True, reflink=False, sparse=False,
+             workers=None, use_mmap=False, src_stat=None, stats=None,
+             progress=None, cancel=None, chunksize=None, cache=None,
+             preallocate=False, delta=False, atomic=False):
     """Copy data from src to dst in the most efficient way possible.
 
     Internally, platform-specific zero-copy syscalls [1] are used by
@@ -183,29 +1357,289 @@ def copyfile(src, dst, follow_symlinks=True):
 
     If follow_symlinks is not set and src is a symbolic link, a new
     symlink will be created instead of copying the file it points to.
+
+    If reflink is "auto" try to create an instantaneous CoW (Copy on
+    Write) clone of src first, then fallback on the zero-copy
+    strategies above. If True raise OSError if cloning the file is
+    not possible (see cowcopy()).
+
+    If sparse is True and src is a sparse file only its data extents
+    are copied and holes are recreated in dst, preserving its disk
+    usage. Fallback on a plain copy if the platform or filesystem
+    does not support SEEK_DATA / SEEK_HOLE.
+
+    If workers is > 1 big files are split in ranges which are copied
+    concurrently by a pool of N threads (Linux only). This can help
+    saturating NVMe disks and striped network filesystems.
+
+    If zero-copy syscalls can't be used (e.g. FUSE, overlayfs) data is
+    copied with readinto() / write() via a reusable per-thread buffer.
+    If use_mmap is True big files are mmap()ed instead, which saves a
+    memory copy but kills the process with SIGBUS if src is truncated
+    by somebody else while being copied.
+
+    Named pipe, same file and size checks are done via fstat() on
+    the opened files. src_stat can be an os.stat_result or an
+    os.DirEntry of src which the caller already has (e.g. from
+    os.scandir()), saving one more syscall; it must not follow
+    symlinks if follow_symlinks is False.
+
+    If stats is a CopyStats instance it's filled with the strategy
+    which was used, the fallbacks, the number of bytes and syscalls
+    and the elapsed time (see also enable_metrics()).
+
+    If progress is a callable it's called as progress(copied, total)
+    every chunksize bytes (default 64MB) and once more when the copy
+    is done, total being src size (None if it's not a regular file).
+    If cancel is a threading.Event (or any object with an is_set()
+    method) it's checked every chunksize bytes: once it's set the
+    copy stops, the partial dst is removed and CopyCancelledError is
+    raised. Both run in the calling thread. Zero-copy syscalls are
+    then issued chunksize bytes at a time instead of once per file.
+
+    If cache is "bypass" data is copied in chunks (see chunksize)
+    which are evicted from the page cache of both files as soon as
+    they're copied (dst ones once written back to disk), via
+    posix_fadvise(POSIX_FADV_DONTNEED), so that copying big files
+    does not evict the hot pages of other processes. Note that src
+    pages which were cached before the copy are evicted as well.
+    If cache is "direct" data is also read and written with
+    O_DIRECT, not going through the page cache at all; if the
+    filesystem doesn't support it this is the same as "bypass".
+    POSIX only; ignored on platforms lacking posix_fadvise().
+
+    If preallocate is True disk space for the whole dst is allocated
+    before copying any data (via fallocate() / posix_fallocate()),
+    which reduces fragmentation under concurrent writers and makes
+    the copy fail at once with ENOSPC if there's not enough free
+    space, instead of halfway through. If the filesystem can't
+    preallocate only the free space is checked. Not done if the file
+    is cloned (reflink) or copied sparse.
+
+    If delta is True and dst is an existing regular file, src and dst
+    are compared block by block and only the blocks which differ are
+    rewritten (then dst is truncated to src size), which is a lot
+    cheaper for big files changing in small regions (e.g. database
+    snapshots, VM images). The other copy options are ignored in
+    that case, and stats.bytes is the number of bytes actually
+    written (see CopyStats). Python 3 and POSIX only; dst must be
+    readable.
+
+    If atomic is True data is written into a temporary file in dst
+    directory which replaces dst only once the copy succeeded, so
+    that readers never see a partially written dst, and dst is left
+    untouched on error or cancellation. On Linux the temporary file
+    is anonymous (O_TMPFILE) and it's published via linkat(), so
+    nothing is left behind if the process crashes; elsewhere it's a
+    hidden file renamed over dst. An existing dst is replaced, not
+    written into: its permission bits are kept but hard links to it
+    won't see the new content. If dst is a symlink the file it
+    points to is replaced. Data is not fsync()ed.
     """
-    if _samefile(src, dst):
-        raise SameFileError("%r and %r are the same file" % (src, dst))
+    if reflink not in (True, False, "auto"):
+        raise ValueError("invalid reflink value %r" % (reflink, ))
+    if workers is not None and workers < 1:
+        raise ValueError("workers must be >= 1 (got %r)" % (workers, ))
+    if reflink is True and not HAS_FICLONE:
+        raise OSError(errno.ENOTSUP,
+                      "reflink is not supported on this platform")
+    if chunksize is not None and chunksize < 1:
+        raise ValueError("chunksize must be >= 1 (got %r)" % (chunksize, ))
+    if cache not in (None, "bypass", "direct"):
+        raise ValueError("invalid cache value %r" % (cache, ))
+    if delta and atomic:
+        raise ValueError("delta and atomic are mutually exclusive")
+    if src_stat is not None and not hasattr(src_stat, "st_mode"):
+        src_stat = src_stat.stat(follow_symlinks=follow_symlinks)
 
-    for fn in [src, dst]:
-        try:
-            st = os.stat(fn)
-        except OSError:
-            # File most likely does not exist
-            pass
+    chunked = progress is not None or cancel is not None or \
+        cache is not None
+    stats = _stats.start(stats, src, dst)
+    if stats is None and not chunked:
+        return _copyfile(src, dst, follow_symlinks, reflink, sparse,
+                         workers, use_mmap, cache, preallocate, delta,
+                         atomic, src_stat)
+    if chunked:
+        _tls.progress = _Progress(progress, cancel,
+                                  chunksize or _PROGRESS_CHUNKSIZE)
+    try:
+        return _copyfile(src, dst, follow_symlinks, reflink, sparse,
+                         workers, use_mmap, cache, preallocate, delta,
+                         atomic, src_stat)
+    except BaseException as err:
+        if stats is not None:
+            stats.error = err
+        raise
+    finally:
+        _tls.progress = None
+        if stats is not None:
+            _stats.finish(stats)
+
+
+def _copyfile(src, dst, follow_symlinks, reflink, sparse, workers,
+              use_mmap, cache, preallocate, delta, atomic, src_stat):
+    progress = _get_progress()
+    if progress is not None:
+        progress.check()
+    if HAS_WIN32_COPYFILE:
+        if _samefile(src, dst):
+            raise SameFileError("%r and %r are the same file" % (src, dst))
+        if not follow_symlinks and os.path.islink(src):
+            _stats.attempt("symlink")
+            os.symlink(os.readlink(src), dst)
         else:
-            # XXX What about other special files? (sockets, devices...)
-            if stat.S_ISFIFO(st.st_mode):
-                raise SpecialFileError("`%s` is a named pipe" % fn)
+            if preallocate:
+                # CopyFileW() preallocates dst by itself.
+                _check_free_space(os.path.dirname(os.path.abspath(dst)),
+                                  os.path.getsize(src))
+            _stats.attempt("CopyFileW")
+            # CopyFileW() is a single call: progress is only reported
+            # when it's done.
+            if atomic:
+                fd, tmpname = _mkstemp(dst)
+                os.close(fd)
+                try:
+                    _zerocopy_win(src, tmpname)
+                    _replace(tmpname, dst)
+                except BaseException:
+                    _remove_partial(tmpname)
+                    raise
+            else:
+                _zerocopy_win(src, dst)
+            stats = _stats.current()
+            if stats is not None:
+                stats.syscalls += 1
+                stats.bytes = os.path.getsize(dst)
+            if progress is not None:
+                progress.total = os.path.getsize(dst)
+                progress.finish(progress.total)
+        return dst
 
-    if not follow_symlinks and os.path.islink(src):
-        os.symlink(os.readlink(src), dst)
-    else:
-        if HAS_WIN32_COPYFILE:
-            _zerocopy_win(src, dst)
+    if not follow_symlinks:
+        if src_stat is None:
+            src_stat = os.lstat(src)
+        if stat.S_ISLNK(src_stat.st_mode):
+            _stats.attempt("symlink")
+            os.symlink(os.readlink(src), dst)
             return dst
 
-        with open(src, 'rb') as fsrc:
-            with open(dst, 'wb') as fdst:
-                _copyfileobj2(fsrc, fdst)
+    fsrc, src_st = _open_src(src, src_stat)
+    with fsrc:
+        tmp = _open_dst_atomic(src, dst, src_st) if atomic else None
+        if tmp is not None:
+            fdst, dst_st, tmpname, target = tmp
+        else:
+            fdst, dst_st = _open_dst(src, dst, src_st, delta=delta)
+        if progress is not None and stat.S_ISREG(src_st.st_mode):
+            progress.total = src_st.st_size
+            if cache is not None and HAS_FADVISE and \
+                    stat.S_ISREG(dst_st.st_mode):
+                progress.drop_fds = (fsrc.fileno(), fdst.fileno())
+        try:
+            with fdst:
+                if delta and _can_delta(src_st, dst_st):
+                    _stats.attempt("delta")
+                    written = _copyfileobj_delta(
+                        fsrc, fdst, src_st.st_size, dst_st.st_size)
+                    copied = fdst.tell()
+                else:
+                    if delta and dst_st.st_size and \
+                            stat.S_ISREG(dst_st.st_mode):
+                        os.ftruncate(fdst.fileno(), 0)  # not truncated yet
+                    copied = _copyfileobj2(
+                        fsrc, fdst, reflink=reflink, sparse=sparse,
+                        workers=workers, use_mmap=use_mmap, cache=cache,
+                        preallocate=preallocate, src_st=src_st,
+                        dst_st=dst_st)
+                    if copied is None:
+                        copied = fdst.tell()
+                    if preallocate and stat.S_ISREG(dst_st.st_mode) and \
+                            copied < src_st.st_size:
+                        # src shrank: release the space allocated past
+                        # EOF.
+                        fdst.flush()
+                        os.ftruncate(fdst.fileno(), copied)
+                    written = copied
+                stats = _stats.current()
+                if stats is not None:
+                    stats.bytes = written
+                if progress is not None:
+                    progress.finish(copied)
+                if tmp is not None:
+                    fdst.flush()
+                    _publish(fdst.fileno(), tmpname, target)
+                    tmp = None
+        except BaseException as err:
+            if tmp is not None:
+                # O_TMPFILE files vanish once closed
+                if tmpname is not None:
+                    _remove_partial(tmpname)
+            elif isinstance(err, CopyCancelledError) and \
+                    stat.S_ISREG(dst_st.st_mode):
+                _remove_partial(dst)
+            raise
     return dst
+
+
+def _remove_partial(dst):
+    try:
+        os.remove(dst)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+
+
+def cowcopy(src, dst, follow_symlinks=True):
+    """Create an instantaneous CoW (Copy on Write) clone of src in
+    dst. Data blocks are shared between the 2 files until one of
+    them gets modified, hence the copy takes constant time and no
+    extra disk space.
+
+    Differently from copyfile() there's no fallback: OSError is
+    raised if the filesystem doesn't support cloning or src and dst
+    live on different mounts, in which case dst is left untouched
+    (the clone is made into a temporary file which replaces dst, see
+    copyfile(atomic=True)).
+    This currently works on Linux only (Btrfs, XFS, OCFS2...).
+    """
+    return copyfile(src, dst, follow_symlinks=follow_symlinks, reflink=True,
+                    atomic=True)
+
+
+def copy_many(pairs):
+    """Copy many files given as an iterable of (src, dst) pairs.
+    This is meant for batches of many small files, where the
+    per-call overhead of copyfile() dominates the actual copy: on
+    Linux the whole batch is opened, copied and closed in C with the
+    GIL released once.
+
+    Errors do not interrupt the batch. Return a list with one result
+    per pair, being either dst on success or the exception instance
+    that copyfile() would have raised (OSError, SameFileError or
+    SpecialFileError).
+    """
+    pairs = [(src, dst) for src, dst in pairs]
+    ret = []
+    if not HAS_COPY_MANY:
+        for src, dst in pairs:
+            try:
+                ret.append(copyfile(src, dst))
+            except (EnvironmentError, shutil.Error) as err:
+                ret.append(err)
+        return ret
+
+    results = _zerocopy.copy_many(pairs)
+    for (src, dst), (copied, err, which) in zip(pairs, results):
+        if err == 0:
+            ret.append(dst)
+        elif err == _zerocopy.COPY_MANY_SAMEFILE:
+            ret.append(SameFileError("%r and %r are the same file" % (
+                src, dst)))
+        elif err == _zerocopy.COPY_MANY_SPECIALFILE:
+            ret.append(SpecialFileError("`%s` is a named pipe" % (
+                (src, dst)[which])))
+        elif which == 2:
+            ret.append(OSError(err, os.strerror(err)))
+        else:
+            ret.append(OSError(err, os.strerror(err), (src, dst)[which]))
+    return ret
@@ -0,0 +1,347 @@
+import errno
+import functools
+import os
+import shutil
+import stat
+
+try:
+    from os import scandir
+except ImportError:  # Python < 3.5
+    from scandir import scandir  # requires "pip install scandir"
+
+from zerocopy._copyfile import _check_free_space
+from zerocopy._copyfile import copyfile
+from zerocopy._copyfile import ThreadPoolExecutor
+
+
+# buffer size used by synctree(compare="content")
+_COMPARE_BUFSIZE = 2 ** 20  # 1MB
+
+
+def _copystat(src, dst, follow_symlinks=True):
+    try:
+        shutil.copystat(src, dst, follow_symlinks=follow_symlinks)
+    except TypeError:  # Python 2
+        if follow_symlinks:
+            shutil.copystat(src, dst)
+
+
+def copy2(src, dst, follow_symlinks=True, src_stat=None, preallocate=False):
+    """Same as shutil.copy2() (copy data and metadata) but using
+    zero-copy copyfile(). Return the file's destination.
+    src_stat and preallocate are passed to copyfile().
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    copyfile(src, dst, follow_symlinks=follow_symlinks, src_stat=src_stat,
+             preallocate=preallocate)
+    _copystat(src, dst, follow_symlinks=follow_symlinks)
+    return dst
+
+
+def _makedirs(path, exist_ok=False):
+    try:
+        os.makedirs(path)
+    except OSError as err:
+        if not exist_ok or err.errno != errno.EEXIST or \
+                not os.path.isdir(path):
+            raise
+
+
+def _walk(src, dst, symlinks, ignore, copy_function,
+          ignore_dangling_symlinks, dirs_exist_ok, jobs, dirs, errors):
+    """Recursively walk src, create dst directories and symlinks and
+    append (srcname, dstname) file copies to do to jobs.
+    """
+    entries = sorted(scandir(src), key=lambda x: x.name)
+    if ignore is not None:
+        ignored_names = ignore(src, [x.name for x in entries])
+    else:
+        ignored_names = set()
+
+    _makedirs(dst, exist_ok=dirs_exist_ok)
+    dirs.append((src, dst))
+    for entry in entries:
+        if entry.name in ignored_names:
+            continue
+        srcname = os.path.join(src, entry.name)
+        dstname = os.path.join(dst, entry.name)
+        try:
+            is_symlink = entry.is_symlink()
+            if is_symlink:
+                linkto = os.readlink(srcname)
+                if symlinks:
+                    # We can't just leave it to copy_function because
+                    # legacy code with a custom copy_function may
+                    # rely on copytree() doing the right thing.
+                    os.symlink(linkto, dstname)
+                    _copystat(srcname, dstname, follow_symlinks=False)
+                    continue
+                # ignore dangling symlink if the flag is on
+                if not os.path.exists(srcname) and ignore_dangling_symlinks:
+                    continue
+            if entry.is_dir():
+                _walk(srcname, dstname, symlinks, ignore, copy_function,
+                      ignore_dangling_symlinks, dirs_exist_ok, jobs, dirs,
+                      errors)
+            else:
+                jobs.append((srcname, dstname, entry))
+        except EnvironmentError as why:
+            errors.append((srcname, dstname, str(why)))
+
+
+def _total_size(jobs):
+    """Return the total size of the regular files to copy."""
+    total = 0
+    for _, _, entry in jobs:
+        try:
+            st = entry.stat()
+        except OSError:
+            continue  # will fail later
+        if stat.S_ISREG(st.st_mode):
+            total += st.st_size
+    return total
+
+
+def copytree(src, dst, symlinks=False, ignore=None, copy_function=copy2,
+             ignore_dangling_symlinks=False, dirs_exist_ok=False,
+             workers=None, preallocate=False):
+    """Recursively copy a directory tree and return the destination
+    directory. Arguments have the same meaning as shutil.copytree().
+
+    The whole tree is walked first (via os.scandir()) and directories
+    are created upfront. File copies are then done via copy_function,
+    which by default uses zero-copy copyfile(). If workers is > 1
+    files are copied concurrently by a pool of N threads, which is
+    usually faster on network filesystems and fast SSDs.
+
+    If preallocate is True OSError(ENOSPC) is raised before copying
+    any file if dst filesystem does not have enough free space for
+    all of them, and each file is preallocated (see copyfile()) if
+    copy_function is copy2() or copyfile().
+
+    If exceptions occur a shutil.Error is raised at the end with a
+    list of (srcname, dstname, reason) tuples, sorted by tree
+    traversal order regardless of the number of workers.
+    """
+    if workers is not None and workers < 1:
+        raise ValueError("workers must be >= 1 (got %r)" % (workers, ))
+    jobs = []
+    dirs = []
+    errors = []
+    _walk(src, dst, symlinks, ignore, copy_function,
+          ignore_dangling_symlinks, dirs_exist_ok, jobs, dirs, errors)
+    if preallocate:
+        _check_free_space(dst, _total_size(jobs))
+        if copy_function in (copy2, copyfile):
+            copy_function = functools.partial(copy_function,
+                                              preallocate=True)
+
+    for res in _copy_files(jobs, copy_function, workers):
+        if res:
+            errors.extend(res)
+    _copy_dirs_stat(dirs, errors)
+    if errors:
+        raise shutil.Error(errors)
+    return dst
+
+
+def _copy_files(jobs, copy_function, workers):
+    """Copy (srcname, dstname, entry) jobs via copy_function, by using
+    a pool of threads if workers is > 1. Return a list with one item
+    per job, being None on success or a list of (srcname, dstname,
+    reason) errors. If copy_function is copy2() or copyfile() the
+    DirEntry is passed as src_stat, saving a stat() per file.
+    """
+    # functools.partial, see copytree(preallocate=True)
+    pass_stat = getattr(copy_function, "func", copy_function) in (
+        copy2, copyfile)
+
+    def copy(job):
+        srcname, dstname, entry = job
+        try:
+            if pass_stat:
+                copy_function(srcname, dstname, src_stat=entry)
+            else:
+                copy_function(srcname, dstname)
+        except shutil.Error as err:
+            # errors from a copytree() used as copy_function
+            if err.args and isinstance(err.args[0], list):
+                return err.args[0]
+            return [(srcname, dstname, str(err))]
+        except EnvironmentError as why:
+            return [(srcname, dstname, str(why))]
+
+    if workers is not None and workers > 1 and len(jobs) > 1 and \
+            ThreadPoolExecutor is not None:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(copy, jobs))
+    return [copy(job) for job in jobs]
+
+
+def _copy_dirs_stat(dirs, errors):
+    # Copy dirs metadata last (bottom-up) so that mtimes are preserved.
+    for srcdir, dstdir in reversed(dirs):
+        try:
+            _copystat(srcdir, dstdir)
+        except EnvironmentError as why:
+            # Copying file access times may fail on Windows
+            if getattr(why, 'winerror', None) is None:
+                errors.append((srcdir, dstdir, str(why)))
+
+
+# =====================================================================
+# --- sync
+# =====================================================================
+
+
+def _same_content(src, dst):
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'rb') as fdst:
+            while True:
+                chunk = fsrc.read(_COMPARE_BUFSIZE)
+                if chunk != fdst.read(_COMPARE_BUFSIZE):
+                    return False
+                if not chunk:
+                    return True
+
+
+def _up_to_date(srcname, dstname, src_st, dst_st, compare):
+    """Return True if dst regular file doesn't need to be copied again
+    according to the compare mode (see synctree()).
+    """
+    if not stat.S_ISREG(dst_st.st_mode) or \
+            src_st.st_size != dst_st.st_size:
+        return False
+    if compare == "content":
+        return _same_content(srcname, dstname)
+    # Whole seconds, as not all filesystems store sub-second mtimes.
+    if int(src_st.st_mtime) != int(dst_st.st_mtime):
+        return False
+    if compare == "ctime":
+        # src inode was changed after dst was copied (e.g. its mtime
+        # was set back).
+        return src_st.st_ctime <= dst_st.st_ctime
+    return True
+
+
+def _remove(entry):
+    if entry.is_dir(follow_symlinks=False):
+        shutil.rmtree(entry.path)
+    else:
+        os.remove(entry.path)
+
+
+def _sync_walk(src, dst, symlinks, ignore, compare, delete, jobs, dirs,
+               copied, removed, errors):
+    """Recursively walk src and dst, create missing dst directories,
+    update symlinks, remove extraneous dst entries (if delete is True)
+    and append (srcname, dstname, entry) copies of new or changed
+    files to jobs.
+    """
+    entries = sorted(scandir(src), key=lambda x: x.name)
+    if ignore is not None:
+        ignored_names = ignore(src, [x.name for x in entries])
+    else:
+        ignored_names = set()
+    try:
+        dst_entries = dict((x.name, x) for x in scandir(dst))
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        _makedirs(dst)
+        dst_entries = {}
+
+    dirs.append((src, dst))
+    for entry in entries:
+        if entry.name in ignored_names:
+            continue
+        srcname = os.path.join(src, entry.name)
+        dstname = os.path.join(dst, entry.name)
+        dst_entry = dst_entries.pop(entry.name, None)
+        try:
+            if symlinks and entry.is_symlink():
+                linkto = os.readlink(srcname)
+                if dst_entry is not None:
+                    if dst_entry.is_symlink() and \
+                            os.readlink(dstname) == linkto:
+                        continue
+                    _remove(dst_entry)
+                os.symlink(linkto, dstname)
+                _copystat(srcname, dstname, follow_symlinks=False)
+                copied.append(dstname)
+            elif entry.is_dir():
+                if dst_entry is not None and (
+                        dst_entry.is_symlink() or not dst_entry.is_dir()):
+                    _remove(dst_entry)
+                _sync_walk(srcname, dstname, symlinks, ignore, compare,
+                           delete, jobs, dirs, copied, removed, errors)
+            else:
+                if dst_entry is not None:
+                    if dst_entry.is_symlink() or dst_entry.is_dir():
+                        # don't write through a symlink
+                        _remove(dst_entry)
+                    elif _up_to_date(srcname, dstname, entry.stat(),
+                                     dst_entry.stat(), compare):
+                        continue
+                jobs.append((srcname, dstname, entry))
+        except EnvironmentError as why:
+            errors.append((srcname, dstname, str(why)))
+
+    if delete and dst_entries:
+        if ignore is not None:
+            ignored_names = ignore(src, list(dst_entries))
+        for name, dst_entry in sorted(dst_entries.items()):
+            if name in ignored_names:
+                continue
+            try:
+                _remove(dst_entry)
+            except EnvironmentError as why:
+                errors.append((os.path.join(src, name), dst_entry.path,
+                               str(why)))
+            else:
+                removed.append(dst_entry.path)
+
+
+def synctree(src, dst, symlinks=False, ignore=None, compare="mtime",
+             delete=False, copy_function=copy2, workers=None):
+    """Incrementally mirror src directory tree into dst, copying only
+    new files and files which changed since the last sync, and return
+    a (copied, removed) tuple of lists of dst paths.
+
+    Files are compared via os.scandir() entries. With compare="mtime"
+    a file is copied again if its size or (whole seconds) mtime
+    differ; "ctime" also copies it again if src inode changed after
+    dst was copied (e.g. its mtime was set back); "content" compares
+    files of the same size byte by byte instead. copy_function must
+    preserve mtime (as copy2() does), or files will be copied again
+    on every sync.
+
+    If delete is True dst entries not present in src (and not
+    ignored) are removed. symlinks, ignore and workers have the same
+    meaning as in copytree(). If exceptions occur a shutil.Error is
+    raised at the end with a list of (srcname, dstname, reason)
+    tuples.
+    """
+    if compare not in ("mtime", "ctime", "content"):
+        raise ValueError("invalid compare value %r" % (compare, ))
+    if workers is not None and workers < 1:
+        raise ValueError("workers must be >= 1 (got %r)" % (workers, ))
+    jobs = []
+    dirs = []
+    copied = []
+    removed = []
+    errors = []
+    _sync_walk(src, dst, symlinks, ignore, compare, delete, jobs, dirs,
+               copied, removed, errors)
+
+    for (_, dstname, _), res in zip(
+            jobs, _copy_files(jobs, copy_function, workers)):
+        if res:
+            errors.extend(res)
+        else:
+            copied.append(dstname)
+    _copy_dirs_stat(dirs, errors)
+    if errors:
+        raise shutil.Error(errors)
+    return (copied, removed)
@@ -0,0 +1,212 @@
+import errno
+import io
+import numbers
+import os
+import select
+import socket
+
+if os.name == 'posix':
+    import _zerocopy
+else:
+    _zerocopy = None
+
+try:
+    import ssl
+except ImportError:  # Python compiled without OpenSSL
+    ssl = None
+
+
+HAS_SENDFILE = hasattr(_zerocopy, "sendfile")
+_RETRY_ERRNOS = frozenset([errno.EAGAIN, errno.EWOULDBLOCK, errno.EBUSY])
+# Flags which Python < 3.7 includes in sock.type on Linux.
+_SOCK_TYPE_FLAGS = getattr(socket, "SOCK_NONBLOCK", 0) | \
+    getattr(socket, "SOCK_CLOEXEC", 0)
+
+
+class _GiveupOnSendfile(Exception):
+    """Raised as a signal to fallback on using send() when sendfile()
+    can't be used.
+    """
+
+
+def _check_stream_socket(sock):
+    if sock.type & ~_SOCK_TYPE_FLAGS != socket.SOCK_STREAM:
+        raise ValueError("only SOCK_STREAM type sockets are supported")
+
+
+def _check_params(sock, file, count):
+    """Common checks of sendfile() and recvfile() arguments."""
+    if 'b' not in getattr(file, 'mode', 'b'):
+        raise ValueError("file should be opened in binary mode")
+    _check_stream_socket(sock)
+    if count is not None:
+        if not isinstance(count, numbers.Integral) or count <= 0:
+            raise ValueError(
+                "count must be a positive integer (got %r)" % (count, ))
+
+
+def _check_sendfile_params(sock, file, offset, count):
+    _check_params(sock, file, count)
+    if not isinstance(offset, numbers.Integral) or offset < 0:
+        raise ValueError(
+            "offset must be a non-negative integer (got %r)" % (offset, ))
+
+
+def _is_ssl_socket(sock):
+    # Data sent over an SSL socket is encrypted in user space, hence
+    # its fd can't be passed to sendfile() / splice().
+    return ssl is not None and isinstance(sock, ssl.SSLSocket)
+
+
+def _wait_fd(fd, timeout, readable=False):
+    """Wait until the fd can be written (or read if readable=True).
+    timeout=None means wait forever; raise socket.timeout on timeout.
+    """
+    # poll() and select() have the advantage of not requiring any
+    # extra file descriptor, contrarily to epoll() / kqueue().
+    if hasattr(select, "poll"):
+        poller = select.poll()
+        poller.register(fd, select.POLLIN if readable else select.POLLOUT)
+        ready = poller.poll(None if timeout is None else timeout * 1000)
+    elif readable:
+        ready = select.select([fd], [], [], timeout)[0]
+    else:
+        ready = select.select([], [fd], [], timeout)[1]
+    if not ready:
+        raise socket.timeout('timed out')
+
+
+def _wait_writable(sockno, timeout):
+    _wait_fd(sockno, timeout)
+
+
+def _wait_readable(sockno, timeout):
+    _wait_fd(sockno, timeout, readable=True)
+
+
+def _sendfile_use_sendfile(sock, file, offset=0, count=None):
+    if not HAS_SENDFILE:
+        raise _GiveupOnSendfile("sendfile() not available")
+    if _is_ssl_socket(sock):
+        raise _GiveupOnSendfile("SSL socket")
+    try:
+        fileno = file.fileno()
+    except (AttributeError, io.UnsupportedOperation) as err:
+        raise _GiveupOnSendfile(err)  # not a regular file
+    try:
+        fsize = os.fstat(fileno).st_size
+    except OSError as err:
+        raise _GiveupOnSendfile(err)  # not a regular file
+    if not fsize:
+        return 0  # empty file
+    # Truncate to 1GiB to avoid OverflowError.
+    blocksize = min(count or fsize, 2 ** 30)
+    sockno = sock.fileno()
+    # Non-blocking sockets (timeout == 0) are waited for as well, so
+    # that the whole file is sent in any case.
+    timeout = sock.gettimeout() or None
+
+    total_sent = 0
+    # localize variable access to minimize overhead
+    zerocopy_sendfile = _zerocopy.sendfile
+    try:
+        while True:
+            if count:
+                blocksize = min(count - total_sent, blocksize)
+                if blocksize <= 0:
+                    break
+            try:
+                sent = zerocopy_sendfile(sockno, fileno, offset, blocksize)
+            except OSError as err:
+                if err.errno in _RETRY_ERRNOS:
+                    # Block until the socket is ready to send some
+                    # data; avoids hogging CPU resources.
+                    _wait_writable(sockno, timeout)
+                    continue
+                if err.errno == errno.EINTR:
+                    continue
+                if total_sent == 0:
+                    # We can get here for different reasons, the main
+                    # one being 'file' is not a regular mmap(2)-like
+                    # file, in which case we'll fall back on using
+                    # plain send().
+                    raise _GiveupOnSendfile(err)
+                raise  # six.raise_from(err, None)
+            else:
+                if sent == 0:
+                    break  # EOF
+                offset += sent
+                total_sent += sent
+        return total_sent
+    finally:
+        if total_sent > 0 and hasattr(file, 'seek'):
+            file.seek(offset)
+
+
+def _sendfile_use_send(sock, file, offset=0, count=None):
+    if offset:
+        file.seek(offset)
+    sockno = sock.fileno()
+    timeout = sock.gettimeout() or None
+    blocksize = min(count, 65536) if count else 65536
+    total_sent = 0
+    # localize variable access to minimize overhead
+    file_read = file.read
+    sock_send = sock.send
+    try:
+        while True:
+            if count:
+                blocksize = min(count - total_sent, blocksize)
+                if blocksize <= 0:
+                    break
+            data = memoryview(file_read(blocksize))
+            if not data:
+                break  # EOF
+            while True:
+                try:
+                    sent = sock_send(data)
+                except socket.error as err:
+                    if err.errno in _RETRY_ERRNOS:
+                        _wait_writable(sockno, timeout)
+                        continue
+                    if err.errno == errno.EINTR:
+                        continue
+                    raise
+                else:
+                    total_sent += sent
+                    if sent < len(data):
+                        data = data[sent:]
+                    else:
+                        break
+        return total_sent
+    finally:
+        if total_sent > 0 and hasattr(file, 'seek'):
+            file.seek(offset + total_sent)
+
+
+def sendfile(sock, file, offset=0, count=None):
+    """Send a file over a socket until EOF is reached by using
+    high-performance sendfile() syscall and return the total number
+    of bytes which were sent.
+
+    file must be a regular file object opened in binary mode; if
+    it's not (or sendfile() is not available, e.g. on Windows, or
+    sock is an ssl.SSLSocket) plain sock.send() is used instead.
+    offset tells from where to start reading the file. If specified,
+    count is the total number of bytes to transmit as opposed to
+    sending the file until EOF is reached.
+    File position is updated on return or also in case of error in
+    which case file.tell() can be used to figure out the number of
+    bytes which were sent.
+
+    The socket must be of SOCK_STREAM type. Non-blocking sockets are
+    supported: the function waits for them to become writable,
+    hence it returns only after all data has been sent. If the
+    socket has a timeout, socket.timeout is raised if it can't be
+    written within that time.
+    """
+    _check_sendfile_params(sock, file, offset, count)
+    try:
+        return _sendfile_use_sendfile(sock, file, offset, count)
+    except _GiveupOnSendfile:
+        return _sendfile_use_send(sock, file, offset, count)
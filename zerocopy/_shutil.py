@@ -0,0 +1,52 @@
+import contextlib
+import shutil
+
+from zerocopy._copyfile import copyfile
+
+
+_saved = {}
+
+
+def _shutil_copyfile(src, dst, follow_symlinks=True):
+    return copyfile(src, dst, follow_symlinks=follow_symlinks)
+
+
+_shutil_copyfile.__doc__ = shutil.copyfile.__doc__
+
+
+def patch_shutil():
+    """Monkey patch shutil module so that copyfile() uses the zero-copy
+    implementation of this module. Since shutil.copy(), copy2(),
+    copytree() and move() (across filesystems) all go through
+    shutil.copyfile(), they will benefit from it as well.
+    Exceptions (SameFileError, SpecialFileError) and return values
+    are the same as shutil's.
+    Calling this function more than once has no effect.
+    """
+    if "copyfile" in _saved:
+        return
+    _saved["copyfile"] = shutil.copyfile
+    shutil.copyfile = _shutil_copyfile
+
+
+def unpatch_shutil():
+    """Undo patch_shutil(). No-op if shutil is not patched."""
+    try:
+        shutil.copyfile = _saved.pop("copyfile")
+    except KeyError:
+        pass
+
+
+@contextlib.contextmanager
+def patched_shutil():
+    """A context manager which patches shutil module on enter (see
+    patch_shutil()) and restores it on exit, unless it was already
+    patched.
+    """
+    already_patched = "copyfile" in _saved
+    patch_shutil()
+    try:
+        yield
+    finally:
+        if not already_patched:
+            unpatch_shutil()
@@ -0,0 +1,608 @@
+import errno
+import io
+import os
+import socket
+import stat
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+if os.name == 'posix':
+    import _zerocopy
+else:
+    _zerocopy = None
+
+from zerocopy._copyfile import _samefile
+from zerocopy._copyfile import SameFileError
+from zerocopy._copyfile import SpecialFileError
+from zerocopy._sendfile import _check_params
+from zerocopy._sendfile import _check_stream_socket
+from zerocopy._sendfile import _is_ssl_socket
+from zerocopy._sendfile import _RETRY_ERRNOS
+from zerocopy._sendfile import _wait_readable
+from zerocopy._sendfile import _wait_writable
+
+
+HAS_SPLICE = hasattr(_zerocopy, "splice")
+HAS_TEE = hasattr(_zerocopy, "tee")
+# Linux >= 2.6.35; Python >= 3.10 exposes them in fcntl module.
+_F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+_F_GETPIPE_SZ = getattr(fcntl, "F_GETPIPE_SZ", 1032)
+# the pipe buffer size we ask for (the default one is 64K)
+PIPE_SIZE = 2 ** 20  # 1MB
+_SPLICE_FLAGS = getattr(_zerocopy, "SPLICE_F_MOVE", 0) | \
+    getattr(_zerocopy, "SPLICE_F_MORE", 0)
+# No SPLICE_F_MORE for relay(): it would delay interactive traffic.
+_RELAY_FLAGS = getattr(_zerocopy, "SPLICE_F_MOVE", 0)
+
+
+class _GiveupOnSplice(Exception):
+    """Raised as a signal to fallback on using recv() / write() when
+    splice() can't be used. transferred is the number of bytes which
+    were moved anyway.
+    """
+
+    def __init__(self, err, transferred=0):
+        Exception.__init__(self, err)
+        self.transferred = transferred
+
+
+class _PipePool(object):
+    """A thread-safe pool of reusable pipes used as in-kernel buffers
+    by splice(), so that a pipe is not created and destroyed on every
+    call. Each pipe is a (read fd, write fd, capacity) tuple.
+    """
+
+    def __init__(self, maxsize=16, pipesize=PIPE_SIZE):
+        self.maxsize = maxsize
+        self.pipesize = pipesize
+        self._pipes = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        # After fork() the pooled pipes are shared with the parent
+        # process, and using them from both sides would mix up data:
+        # the child discards them and starts over. The lock may have
+        # been held by another thread at fork() time, hence it's
+        # replaced as well.
+        if self._pid == os.getpid():
+            return
+        self._lock = threading.Lock()
+        pipes, self._pipes = self._pipes, []
+        self._pid = os.getpid()
+        for r, w, _ in pipes:
+            os.close(r)
+            os.close(w)
+
+    def acquire(self):
+        self._check_fork()
+        with self._lock:
+            if self._pipes:
+                return self._pipes.pop()
+        r, w = os.pipe()
+        try:
+            fcntl.fcntl(w, _F_SETPIPE_SZ, self.pipesize)
+        except (OSError, IOError):
+            pass  # EPERM if > /proc/sys/fs/pipe-max-size
+        try:
+            size = fcntl.fcntl(w, _F_GETPIPE_SZ)
+        except (OSError, IOError):
+            size = 65536
+        return (r, w, size)
+
+    def release(self, pipe, clean=True):
+        """Give a pipe back to the pool. If clean is False (there may be
+        data left in it) the pipe is closed instead.
+        """
+        self._check_fork()
+        if clean:
+            with self._lock:
+                if len(self._pipes) < self.maxsize:
+                    self._pipes.append(pipe)
+                    return
+        os.close(pipe[0])
+        os.close(pipe[1])
+
+    def close(self):
+        with self._lock:
+            pipes, self._pipes = self._pipes, []
+        for r, w, _ in pipes:
+            os.close(r)
+            os.close(w)
+
+
+_pipe_pool = _PipePool()
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _copy_pipe(r, fd, nbytes):
+    """Move nbytes from pipe r into fd by using read() / write()."""
+    while nbytes:
+        chunk = os.read(r, nbytes)
+        _write_all(fd, chunk)
+        nbytes -= len(chunk)
+
+
+def _drain_pipe(r, fd, nbytes):
+    """Move nbytes from pipe r into fd by using splice(); if fd does
+    not support it, fall back on read() / write() and raise
+    _GiveupOnSplice.
+    """
+    left = nbytes
+    while left:
+        try:
+            left -= _zerocopy.splice(r, fd, left, flags=_SPLICE_FLAGS)
+        except OSError as err:
+            if err.errno == errno.EINTR:
+                continue
+            if err.errno != errno.EINVAL:
+                raise
+            # fd is opened in append mode or its filesystem does not
+            # support splice(); data is in the pipe already.
+            _copy_pipe(r, fd, left)
+            raise _GiveupOnSplice(err)
+
+
+def _recvfile_use_splice(sock, file, count=None):
+    if not HAS_SPLICE:
+        raise _GiveupOnSplice("splice() not available")
+    if _is_ssl_socket(sock):
+        raise _GiveupOnSplice("SSL socket")
+    try:
+        fileno = file.fileno()
+    except (AttributeError, io.UnsupportedOperation) as err:
+        raise _GiveupOnSplice(err)  # not a regular file
+    sockno = sock.fileno()
+    # Non-blocking sockets (timeout == 0) are waited for as well.
+    timeout = sock.gettimeout() or None
+
+    pipe = _pipe_pool.acquire()
+    r, w, pipesize = pipe
+    clean = True
+    total = 0
+    # localize variable access to minimize overhead
+    splice = _zerocopy.splice
+    try:
+        while True:
+            nbytes = pipesize
+            if count:
+                nbytes = min(count - total, pipesize)
+                if nbytes <= 0:
+                    break
+            try:
+                received = splice(sockno, w, nbytes, flags=_SPLICE_FLAGS)
+            except OSError as err:
+                if err.errno in _RETRY_ERRNOS:
+                    _wait_readable(sockno, timeout)
+                    continue
+                if err.errno == errno.EINTR:
+                    continue
+                if total == 0:
+                    raise _GiveupOnSplice(err)
+                raise  # six.raise_from(err, None)
+            if received == 0:
+                break  # EOF
+            clean = False
+            try:
+                _drain_pipe(r, fileno, received)
+            except _GiveupOnSplice as exc:
+                clean = True
+                exc.transferred = total + received
+                raise
+            clean = True
+            total += received
+        return total
+    finally:
+        _pipe_pool.release(pipe, clean)
+
+
+def _recvfile_use_recv(sock, file, count=None):
+    sockno = sock.fileno()
+    timeout = sock.gettimeout() or None
+    bufsize = 65536
+    buf = bytearray(bufsize)
+    view = memoryview(buf)
+    total = 0
+    # localize variable access to minimize overhead
+    sock_recv_into = sock.recv_into
+    file_write = file.write
+    while True:
+        nbytes = bufsize
+        if count:
+            nbytes = min(count - total, bufsize)
+            if nbytes <= 0:
+                break
+        try:
+            received = sock_recv_into(view, nbytes)
+        except socket.error as err:
+            if err.errno in _RETRY_ERRNOS:
+                _wait_readable(sockno, timeout)
+                continue
+            if err.errno == errno.EINTR:
+                continue
+            raise
+        if received == 0:
+            break  # EOF
+        file_write(view[:received])
+        total += received
+    return total
+
+
+def recvfile(sock, file, count=None):
+    """Receive data from a socket and write it into a file until EOF
+    is reached (or count bytes are received) by moving it
+    socket -> pipe -> file with splice() syscall, entirely in kernel
+    space. Return the total number of bytes which were received.
+
+    Data is written at the current file position, which is updated.
+    file must be opened in binary mode; if it's not a regular file,
+    splice() is not available (non Linux platforms) or sock is an
+    ssl.SSLSocket plain sock.recv_into() and file.write() are used
+    instead.
+    Non-blocking sockets and sockets with a timeout are supported as
+    in sendfile().
+    """
+    _check_params(sock, file, count)
+    if hasattr(file, 'flush'):
+        file.flush()
+    try:
+        return _recvfile_use_splice(sock, file, count)
+    except _GiveupOnSplice as exc:
+        done = exc.transferred
+        if count:
+            if count - done <= 0:
+                return done
+            count -= done
+        return done + _recvfile_use_recv(sock, file, count)
+    finally:
+        if hasattr(file, 'flush'):
+            file.flush()
+
+
+# =====================================================================
+# --- fan-out copy
+# =====================================================================
+
+
+def _copy_to_many_use_tee(fsrc, fdsts):
+    """Read fsrc once into a pipe and duplicate each chunk to the
+    pipes of fdsts[1:] with tee(); fdsts[0] consumes the source pipe
+    itself. Return the number of bytes read from fsrc.
+    """
+    if not HAS_TEE:
+        raise _GiveupOnSplice("tee() not available")
+    srcfd = fsrc.fileno()
+    try:
+        fds = [f.fileno() for f in fdsts]
+    except (AttributeError, io.UnsupportedOperation) as err:
+        raise _GiveupOnSplice(err)  # e.g. BytesIO
+    pipes = []
+    try:
+        for _ in fds:
+            pipes.append(_pipe_pool.acquire())
+    except OSError as err:  # EMFILE
+        for pipe in pipes:
+            _pipe_pool.release(pipe)
+        raise _GiveupOnSplice(err)
+    # Every pipe must be able to take a whole chunk.
+    chunksize = min(pipe[2] for pipe in pipes)
+    r0, w0, _ = pipes[0]
+    nosplice = set()  # fds which only support write()
+    clean = True
+    total = 0
+    # localize variable access to minimize overhead
+    splice = _zerocopy.splice
+    tee = _zerocopy.tee
+
+    def drain(r, i, nbytes):
+        if i in nosplice:
+            _copy_pipe(r, fds[i], nbytes)
+        else:
+            try:
+                _drain_pipe(r, fds[i], nbytes)
+            except _GiveupOnSplice:
+                nosplice.add(i)
+
+    try:
+        while True:
+            try:
+                received = splice(srcfd, w0, chunksize, flags=_SPLICE_FLAGS)
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                if total == 0:
+                    raise _GiveupOnSplice(err)
+                raise  # six.raise_from(err, None)
+            if received == 0:
+                break  # EOF
+            clean = False
+            short = []
+            for i in range(1, len(fds)):
+                r, w, _ = pipes[i]
+                while True:
+                    try:
+                        teed = tee(r0, w, received)
+                    except OSError as err:
+                        if err.errno == errno.EINTR:
+                            continue
+                        raise
+                    break
+                if teed < received:
+                    short.append((i, teed))
+                drain(r, i, teed)
+            if short:
+                # tee() could not duplicate the whole chunk and it
+                # always starts from the head of the pipe: consume the
+                # chunk in user space to serve the missing bytes.
+                data = os.read(r0, received)
+                while len(data) < received:
+                    data += os.read(r0, received - len(data))
+                for i, teed in short:
+                    _write_all(fds[i], data[teed:])
+                _write_all(fds[0], data)
+            else:
+                drain(r0, 0, received)
+            clean = True
+            total += received
+        return total
+    finally:
+        for pipe in pipes:
+            _pipe_pool.release(pipe, clean)
+
+
+def _copy_to_many_use_read(fsrc, fdsts):
+    bufsize = PIPE_SIZE
+    view = memoryview(bytearray(bufsize))
+    writers = [getattr(f, 'sendall', None) or f.write for f in fdsts]
+    total = 0
+    while True:
+        n = fsrc.readinto(view)
+        if not n:
+            break  # EOF
+        for write in writers:
+            write(view[:n])
+        total += n
+    return total
+
+
+def copy_to_many(src, dsts):
+    """Copy the content of src file to many destinations by reading
+    it only once: data is moved into a pipe with splice() and
+    duplicated for each destination with tee(), without copying it
+    in user space (Linux). Return dsts.
+
+    dsts is a sequence of paths, which are created or truncated, or
+    of blocking sockets / file objects opened in binary mode, which
+    are written at their current position. On platforms without tee()
+    or if src does not support splice() data is read once into a
+    buffer and written to every destination.
+    If writing to any of the destinations fails the copy is aborted
+    and the exception is raised.
+    """
+    dsts = list(dsts)
+    if not dsts:
+        raise ValueError("dsts must not be empty")
+    paths = [dst for dst in dsts if not hasattr(dst, 'fileno')]
+    for dst in paths:
+        if _samefile(src, dst):
+            raise SameFileError("%r and %r are the same file" % (src, dst))
+    for fn in [src] + paths:
+        try:
+            st = os.stat(fn)
+        except OSError:
+            # File most likely does not exist
+            pass
+        else:
+            if stat.S_ISFIFO(st.st_mode):
+                raise SpecialFileError("`%s` is a named pipe" % fn)
+
+    opened = []
+    try:
+        fsrc = open(src, 'rb')
+        opened.append(fsrc)
+        fdsts = []
+        for dst in dsts:
+            if hasattr(dst, 'fileno'):
+                if hasattr(dst, 'flush'):
+                    dst.flush()
+                fdsts.append(dst)
+            else:
+                fdst = open(dst, 'wb')
+                opened.append(fdst)
+                fdsts.append(fdst)
+        try:
+            _copy_to_many_use_tee(fsrc, fdsts)
+        except _GiveupOnSplice:
+            _copy_to_many_use_read(fsrc, fdsts)
+        finally:
+            for fdst in fdsts:
+                if hasattr(fdst, 'flush'):
+                    fdst.flush()
+    finally:
+        for f in opened:
+            f.close()
+    return dsts
+
+
+# =====================================================================
+# --- socket to socket relay
+# =====================================================================
+
+
+def _resize_pipe(pipe, size):
+    r, w, cursize = pipe
+    if size is None or size == cursize:
+        return pipe
+    try:
+        fcntl.fcntl(w, _F_SETPIPE_SZ, size)
+        cursize = fcntl.fcntl(w, _F_GETPIPE_SZ)
+    except (OSError, IOError):
+        pass
+    return (r, w, cursize)
+
+
+def _shutdown(sock, how):
+    try:
+        if _is_ssl_socket(sock):
+            # SSLSocket.shutdown() also drops the SSL layer, which is
+            # still needed by the other direction.
+            socket.socket.shutdown(sock, how)
+        else:
+            sock.shutdown(how)
+    except socket.error:
+        pass  # ENOTCONN: the peer is gone already
+
+
+def _pump_use_splice(src, dst, bufsize):
+    """Move data from src to dst socket through a pipe 'till EOF."""
+    srcno = src.fileno()
+    dstno = dst.fileno()
+    src_timeout = src.gettimeout() or None
+    dst_timeout = dst.gettimeout() or None
+    acquired = _pipe_pool.acquire()
+    pipe = _resize_pipe(acquired, bufsize)
+    r, w, pipesize = pipe
+    clean = True
+    total = 0
+    # localize variable access to minimize overhead
+    splice = _zerocopy.splice
+    try:
+        while True:
+            try:
+                received = splice(srcno, w, pipesize, flags=_RELAY_FLAGS)
+            except OSError as err:
+                if err.errno in _RETRY_ERRNOS:
+                    _wait_readable(srcno, src_timeout)
+                    continue
+                if err.errno == errno.EINTR:
+                    continue
+                raise
+            if received == 0:
+                break  # EOF
+            clean = False
+            pending = received
+            while pending:
+                try:
+                    pending -= splice(r, dstno, pending,
+                                      flags=_RELAY_FLAGS)
+                except OSError as err:
+                    if err.errno in _RETRY_ERRNOS:
+                        _wait_writable(dstno, dst_timeout)
+                        continue
+                    if err.errno == errno.EINTR:
+                        continue
+                    raise
+            clean = True
+            total += received
+        return total
+    finally:
+        # Resized pipes are not pooled, so that the other users of the
+        # pool keep getting pipes of the default size.
+        _pipe_pool.release(pipe, clean and pipesize == acquired[2])
+
+
+def _pump_use_recv(src, dst, bufsize):
+    """Same as above but using a user space buffer."""
+    srcno = src.fileno()
+    src_timeout = src.gettimeout() or None
+    bufsize = bufsize or 65536
+    view = memoryview(bytearray(bufsize))
+    total = 0
+    while True:
+        try:
+            received = src.recv_into(view, bufsize)
+        except socket.error as err:
+            if err.errno in _RETRY_ERRNOS:
+                _wait_readable(srcno, src_timeout)
+                continue
+            if err.errno == errno.EINTR:
+                continue
+            raise
+        if received == 0:
+            break  # EOF
+        _sendall(dst, view[:received])
+        total += received
+    return total
+
+
+def _sendall(sock, data):
+    # Same as sock.sendall() but also working for non-blocking sockets.
+    sockno = sock.fileno()
+    timeout = sock.gettimeout() or None
+    while data:
+        try:
+            data = data[sock.send(data):]
+        except socket.error as err:
+            if err.errno in _RETRY_ERRNOS:
+                _wait_writable(sockno, timeout)
+                continue
+            if err.errno == errno.EINTR:
+                continue
+            raise
+
+
+def _pump(src, dst, bufsize):
+    """Move data from src to dst 'till EOF, then half-close dst."""
+    if HAS_SPLICE and not _is_ssl_socket(src) and \
+            not _is_ssl_socket(dst):
+        total = _pump_use_splice(src, dst, bufsize)
+    else:
+        total = _pump_use_recv(src, dst, bufsize)
+    # Propagate EOF (half-close): the other direction keeps going.
+    _shutdown(dst, socket.SHUT_WR)
+    return total
+
+
+def relay(sock_a, sock_b, bufsize=None):
+    """Forward data between 2 connected SOCK_STREAM sockets in both
+    directions, by moving it through kernel pipes with splice()
+    (Linux), so that it's never copied in user space. Meant for TCP
+    proxies.
+
+    Each direction runs until EOF, which is propagated to the other
+    socket via shutdown(SHUT_WR) (half-close), and the function
+    returns when both directions are done. The b -> a direction is
+    served by a separate thread.
+    Return a (bytes a -> b, bytes b -> a) tuple.
+
+    bufsize is the size of the pipes used as in-kernel buffers
+    (default 1MB, see PIPE_SIZE), or of the user space buffer on
+    platforms without splice() and for ssl.SSLSocket sockets (which
+    are served via recv_into() / send()).
+    In case of error both sockets are shut down and the exception is
+    raised; closing the sockets is up to the caller.
+    """
+    for sock in (sock_a, sock_b):
+        _check_stream_socket(sock)
+    result = {}
+
+    def run(src, dst, key):
+        try:
+            result[key] = _pump(src, dst, bufsize)
+        except BaseException as err:
+            result[key] = err
+            # Unblock the other direction.
+            _shutdown(sock_a, socket.SHUT_RDWR)
+            _shutdown(sock_b, socket.SHUT_RDWR)
+
+    t = threading.Thread(target=run, args=(sock_b, sock_a, "b2a"),
+                         name="zerocopy-relay")
+    t.daemon = True
+    t.start()
+    try:
+        run(sock_a, sock_b, "a2b")
+    finally:
+        t.join()
+    for key in ("a2b", "b2a"):
+        if isinstance(result[key], BaseException):
+            raise result[key]
+    return (result["a2b"], result["b2a"])
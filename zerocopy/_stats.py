@@ -0,0 +1,185 @@
+import threading
+import time
+
+
+# upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0, 10.0, float("inf"))
+
+_timer = getattr(time, "perf_counter", time.time)  # Python 2
+_local = threading.local()
+_lock = threading.Lock()
+_metrics = {}
+_enabled = False
+_hook = None
+
+
+class CopyStats(object):
+    """Statistics about a single copy, filled by copyfile(stats=...).
+
+    - src, dst: the copyfile() arguments
+    - strategy: the strategy which copied the data ("reflink",
+      "sparse", "delta", "direct", "parallel", "copy_file_range",
+      "sendfile", "fcopyfile", "CopyFileW", "mmap", "readinto" or
+      "symlink"); in case of error the one which failed
+    - fallbacks: a list of (strategy, reason) tuples of the strategies
+      which gave up before, in order
+    - bytes: the number of bytes written to dst (with
+      copyfile(delta=True) only the ones which differed)
+    - syscalls: the number of copy syscalls issued from Python (a loop
+      running in C, such as the one of copyfd(), counts as one)
+    - elapsed: wall time in seconds
+    - error: the exception raised, if any
+    """
+
+    __slots__ = ("src", "dst", "strategy", "fallbacks", "bytes",
+                 "syscalls", "elapsed", "error", "_started")
+
+    def __init__(self):
+        self.src = None
+        self.dst = None
+        self.strategy = None
+        self.fallbacks = []
+        self.bytes = 0
+        self.syscalls = 0
+        self.elapsed = 0.0
+        self.error = None
+        self._started = None
+
+    def __repr__(self):
+        return "<%s strategy=%r bytes=%r syscalls=%r elapsed=%.6f " \
+            "fallbacks=%r>" % (self.__class__.__name__, self.strategy,
+                               self.bytes, self.syscalls, self.elapsed,
+                               self.fallbacks)
+
+
+# =====================================================================
+# --- used by the copy functions
+# =====================================================================
+
+
+def current():
+    """Return the CopyStats of the copy running in this thread, or None
+    if nobody is interested in it.
+    """
+    return getattr(_local, "stats", None)
+
+
+def start(stats, src, dst):
+    """Called at the beginning of a copy. Return the CopyStats to fill
+    or None (fast path) if neither stats were asked for nor process
+    wide metrics are enabled.
+    """
+    if stats is None:
+        if not _enabled and _hook is None:
+            return None
+        stats = CopyStats()
+    stats.src = src
+    stats.dst = dst
+    stats._started = _timer()
+    _local.stats = stats
+    return stats
+
+
+def finish(stats):
+    """Called at the end of a copy started with start()."""
+    stats.elapsed = _timer() - stats._started
+    _local.stats = None
+    if _enabled:
+        _update_metrics(stats)
+    hook = _hook
+    if hook is not None:
+        hook(stats)
+
+
+def attempt(strategy):
+    stats = current()
+    if stats is not None:
+        stats.strategy = strategy
+
+
+def giveup(strategy, reason):
+    stats = current()
+    if stats is not None:
+        stats.fallbacks.append((strategy, str(reason)))
+        stats.strategy = None
+
+
+def add_syscalls(n=1):
+    stats = current()
+    if stats is not None:
+        stats.syscalls += n
+
+
+def _update_metrics(stats):
+    strategy = stats.strategy or "unknown"
+    with _lock:
+        for name, _ in stats.fallbacks:
+            _get_entry(name)["fallbacks"] += 1
+        entry = _get_entry(strategy)
+        entry["calls"] += 1
+        entry["bytes"] += stats.bytes
+        entry["syscalls"] += stats.syscalls
+        if stats.error is not None:
+            entry["errors"] += 1
+        for bound in LATENCY_BUCKETS:
+            if stats.elapsed <= bound:
+                entry["latency"][bound] += 1
+                break
+
+
+def _get_entry(strategy):
+    try:
+        return _metrics[strategy]
+    except KeyError:
+        entry = _metrics[strategy] = dict(
+            calls=0, bytes=0, syscalls=0, errors=0, fallbacks=0,
+            latency=dict((bound, 0) for bound in LATENCY_BUCKETS))
+        return entry
+
+
+# =====================================================================
+# --- public API
+# =====================================================================
+
+
+def enable_metrics(enabled=True):
+    """Enable (or disable) process-wide copy metrics, see metrics().
+    They are disabled by default, in which case the overhead for each
+    copy is a couple of global variable lookups.
+    """
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def metrics():
+    """Return process-wide copy metrics collected since
+    enable_metrics() was called, as a {strategy: dict} dict. Each
+    dict has "calls", "bytes", "syscalls", "errors" and "fallbacks"
+    (number of times the strategy gave up) counters and a "latency"
+    histogram as a {upper bound in seconds: count} dict (see
+    LATENCY_BUCKETS).
+    """
+    with _lock:
+        ret = {}
+        for strategy, entry in _metrics.items():
+            entry = dict(entry)
+            entry["latency"] = dict(entry["latency"])
+            ret[strategy] = entry
+        return ret
+
+
+def reset_metrics():
+    """Reset process-wide copy metrics."""
+    with _lock:
+        _metrics.clear()
+
+
+def set_metrics_hook(hook):
+    """Set a function which is called with the CopyStats of every copy
+    once it's done (also in case of error), e.g. to export them to a
+    metrics system. It runs in the thread which did the copy and must
+    be fast. Pass None to remove it. Return the previous hook.
+    """
+    global _hook
+    old, _hook = _hook, hook
+    return old
@@ -22,8 +22,10 @@
  *  THE SOFTWARE.
  */
 
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
 #include <stdlib.h>
+#include <string.h>
 
 
 /*
@@ -161,7 +163,7 @@ method_sendfile(PyObject *self, PyObject *args)
     off_t offset;
     size_t nbytes;
     char *hdr=NULL, *trail=NULL;
-    int hdrsize, trailsize;
+    Py_ssize_t hdrsize, trailsize;
     ssize_t sts=0;
     struct sf_parms sf_iobuf;
     int rc;
@@ -219,29 +221,152 @@ method_sendfile(PyObject *self, PyObject *args)
 #elif defined (__linux__)
 #include <sys/sendfile.h>
 
+#include <sys/socket.h>
+#include <netinet/in.h>
+#include <netinet/tcp.h>
+
+
+/*
+ * Send a whole buffer over a socket; return the number of bytes sent
+ * (less than len on EAGAIN / error, -1 if nothing was sent).
+ */
+static Py_ssize_t
+_send_all(int sock, const char *buf, Py_ssize_t len, int flags)
+{
+    Py_ssize_t total = 0;
+    Py_ssize_t n;
+
+    while (total < len) {
+        n = send(sock, buf + total, len - total, flags);
+        if (n == -1) {
+            if (errno == EINTR)
+                continue;
+            return total == 0 ? -1 : total;
+        }
+        total += n;
+    }
+    return total;
+}
+
+
+/*
+ * sendfile() with header and trailer: the socket is corked (TCP_CORK)
+ * so that header, file data and trailer are coalesced in the fewest
+ * possible TCP segments; the header is also sent with MSG_MORE in
+ * case out_fd is not a TCP socket. If the caller corked the socket
+ * already it's left corked. As on FreeBSD, the return value
+ * includes header and trailer bytes; in case of partial write
+ * (e.g. EAGAIN on a non-blocking socket) the bytes sent so far are
+ * returned and the caller is supposed to send the rest.
+ */
+static Py_ssize_t
+_sendfile_hdtr(int out_fd, int in_fd, off_t *offset, Py_ssize_t nbytes,
+               const char *head, Py_ssize_t head_len,
+               const char *tail, Py_ssize_t tail_len)
+{
+    int on = 1;
+    int off = 0;
+    int corked = 0;
+    int was_corked = 0;
+    socklen_t optlen = sizeof(was_corked);
+    int saved_errno = 0;
+    Py_ssize_t total = 0;
+    Py_ssize_t file_sent = 0;
+    Py_ssize_t n;
+
+    // Not a TCP socket if getsockopt() fails.
+    if (getsockopt(out_fd, IPPROTO_TCP, TCP_CORK, &was_corked,
+                   &optlen) == 0 && !was_corked) {
+        corked = setsockopt(out_fd, IPPROTO_TCP, TCP_CORK, &on,
+                            sizeof(on)) == 0;
+    }
+
+    if (head_len > 0) {
+        n = _send_all(out_fd, head, head_len, MSG_MORE);
+        if (n == -1) {
+            saved_errno = errno;
+            goto done;
+        }
+        total += n;
+        if (n < head_len)
+            goto done;
+    }
+
+    // The trailer goes only after the whole file range (or EOF).
+    while (file_sent < nbytes) {
+        n = sendfile(out_fd, in_fd, offset, nbytes - file_sent);
+        if (n == -1) {
+            if (errno == EINTR)
+                continue;
+            saved_errno = errno;
+            goto done;
+        }
+        if (n == 0)
+            break;  // EOF
+        file_sent += n;
+        total += n;
+    }
+
+    if (tail_len > 0) {
+        n = _send_all(out_fd, tail, tail_len, 0);
+        if (n == -1) {
+            saved_errno = errno;
+            goto done;
+        }
+        total += n;
+    }
+
+done:
+    if (corked)
+        setsockopt(out_fd, IPPROTO_TCP, TCP_CORK, &off, sizeof(off));
+    if (total == 0 && saved_errno != 0) {
+        errno = saved_errno;
+        return -1;
+    }
+    return total;
+}
+
+
 static PyObject *
 method_sendfile(PyObject *self, PyObject *args, PyObject *kwdict)
 {
     int out_fd, in_fd;
+    int flags = 0;
     off_t offset;
+    off_t *p_offset = NULL;
     Py_ssize_t nbytes;
     Py_ssize_t sent;
+    char *head = NULL;
+    char *tail = NULL;
+    Py_ssize_t head_len = 0;
+    Py_ssize_t tail_len = 0;
     PyObject *offobj;
+    static char *keywords[] = {"out", "in", "offset", "nbytes", "header",
+                               "trailer", "flags", NULL};
 
-    if (!PyArg_ParseTuple(args, "iiOn", &out_fd, &in_fd, &offobj, &nbytes)) {
+    if (!PyArg_ParseTupleAndKeywords(args, kwdict,
+                                     "iiOn|s#s#i:sendfile",
+                                     keywords, &out_fd, &in_fd, &offobj,
+                                     &nbytes, &head, &head_len, &tail,
+                                     &tail_len, &flags)) {
         return NULL;
     }
 
-    if (offobj == Py_None) {
+    if (offobj != Py_None) {
+        if (!_parse_off_t(offobj, &offset))
+            return NULL;
+        p_offset = &offset;
+    }
+
+    if (head_len != 0 || tail_len != 0) {
         Py_BEGIN_ALLOW_THREADS;
-        sent = sendfile(out_fd, in_fd, NULL, nbytes);
+        sent = _sendfile_hdtr(out_fd, in_fd, p_offset, nbytes,
+                              head, head_len, tail, tail_len);
         Py_END_ALLOW_THREADS;
     }
     else {
-        if (!_parse_off_t(offobj, &offset))
-            return NULL;
         Py_BEGIN_ALLOW_THREADS;
-        sent = sendfile(out_fd, in_fd, &offset, nbytes);
+        sent = sendfile(out_fd, in_fd, p_offset, nbytes);
         Py_END_ALLOW_THREADS;
     }
 
@@ -250,6 +375,67 @@ method_sendfile(PyObject *self, PyObject *args, PyObject *kwdict)
 
     return Py_BuildValue("n", sent);
 }
+
+/*
+ * Copy the whole content of in_fd into out_fd (both regular files)
+ * starting at offset by calling sendfile() in a loop 'till EOF. The
+ * GIL is released only once for the whole loop, instead of once per
+ * sendfile() call. On error, if no data was copied the position of
+ * out_fd is left untouched.
+ */
+static PyObject *
+method_copyfd(PyObject *self, PyObject *args, PyObject *kwdict)
+{
+    int out_fd, in_fd;
+    int saved_errno = 0;
+    off_t offset = 0;
+    off_t total = 0;
+    Py_ssize_t blocksize;
+    Py_ssize_t sent;
+    PyObject *offobj = NULL;
+    static char *keywords[] = {"infd", "outfd", "blocksize", "offset",
+                               NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwdict, "iin|O:copyfd",
+                                     keywords, &in_fd, &out_fd,
+                                     &blocksize, &offobj)) {
+        return NULL;
+    }
+    if (offobj != NULL) {
+        if (!_parse_off_t(offobj, &offset))
+            return NULL;
+    }
+
+    while (1) {
+        Py_BEGIN_ALLOW_THREADS
+        while (1) {
+            sent = sendfile(out_fd, in_fd, &offset, blocksize);
+            if (sent <= 0)
+                break;
+            total += sent;
+        }
+        saved_errno = errno;
+        Py_END_ALLOW_THREADS
+
+        if (sent == 0)
+            break;  // EOF
+        if (saved_errno == EINTR) {
+            // give signal handlers a chance to run (and raise)
+            if (PyErr_CheckSignals() != 0)
+                return NULL;
+            continue;
+        }
+        errno = saved_errno;
+        return PyErr_SetFromErrno(PyExc_OSError);
+    }
+
+#if defined(HAVE_LARGEFILE_SUPPORT)
+    return Py_BuildValue("L", (PY_LONG_LONG)total);
+#else
+    return Py_BuildValue("l", (long)total);
+#endif
+}
+#define HAVE_COPYFD 1
 /* --- end Linux --- */
 
 /* --- begin SUN OS --- */
@@ -280,6 +466,592 @@ method_sendfile(PyObject *self, PyObject *args, PyObject *kwdict)
 #else
 #endif
 
+/*
+ * ====================================================================
+ * Linux copy_file_range(2)
+ * ====================================================================
+ */
+
+#if defined(__linux__)
+#include <sys/syscall.h>
+#include <unistd.h>
+
+// The syscall is invoked directly as the glibc wrapper is only
+// available since glibc 2.27.
+#if defined(__NR_copy_file_range)
+#define HAVE_COPY_FILE_RANGE 1
+
+static PyObject *
+method_copy_file_range(PyObject *self, PyObject *args, PyObject *kwdict)
+{
+    int src;
+    int dst;
+    unsigned int flags = 0;
+    off_t offset_src;
+    off_t offset_dst;
+    off_t *p_offset_src = NULL;
+    off_t *p_offset_dst = NULL;
+    Py_ssize_t count;
+    Py_ssize_t ret;
+    PyObject *offsrcobj = Py_None;
+    PyObject *offdstobj = Py_None;
+    static char *keywords[] = {"src", "dst", "count", "offset_src",
+                               "offset_dst", "flags", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwdict,
+                                     "iin|OOI:copy_file_range",
+                                     keywords, &src, &dst, &count,
+                                     &offsrcobj, &offdstobj, &flags)) {
+        return NULL;
+    }
+
+    if (offsrcobj != Py_None) {
+        if (!_parse_off_t(offsrcobj, &offset_src))
+            return NULL;
+        p_offset_src = &offset_src;
+    }
+    if (offdstobj != Py_None) {
+        if (!_parse_off_t(offdstobj, &offset_dst))
+            return NULL;
+        p_offset_dst = &offset_dst;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    ret = syscall(__NR_copy_file_range, src, p_offset_src, dst,
+                  p_offset_dst, (size_t)count, flags);
+    Py_END_ALLOW_THREADS
+
+    if (ret == -1)
+        return PyErr_SetFromErrno(PyExc_OSError);
+
+    return Py_BuildValue("n", ret);
+}
+#endif  // __NR_copy_file_range
+#endif  // __linux__
+
+/*
+ * ====================================================================
+ * Linux splice(2)
+ * ====================================================================
+ */
+
+#if defined(__linux__)
+#include <fcntl.h>
+
+#if defined(SPLICE_F_MOVE)
+#define HAVE_SPLICE 1
+
+static PyObject *
+method_splice(PyObject *self, PyObject *args, PyObject *kwdict)
+{
+    int src;
+    int dst;
+    unsigned int flags = 0;
+    loff_t offset_src;
+    loff_t offset_dst;
+    loff_t *p_offset_src = NULL;
+    loff_t *p_offset_dst = NULL;
+    Py_ssize_t count;
+    Py_ssize_t ret;
+    PyObject *offsrcobj = Py_None;
+    PyObject *offdstobj = Py_None;
+    static char *keywords[] = {"src", "dst", "count", "offset_src",
+                               "offset_dst", "flags", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwdict,
+                                     "iin|OOI:splice",
+                                     keywords, &src, &dst, &count,
+                                     &offsrcobj, &offdstobj, &flags)) {
+        return NULL;
+    }
+
+    if (offsrcobj != Py_None) {
+        if (!_parse_off_t(offsrcobj, &offset_src))
+            return NULL;
+        p_offset_src = &offset_src;
+    }
+    if (offdstobj != Py_None) {
+        if (!_parse_off_t(offdstobj, &offset_dst))
+            return NULL;
+        p_offset_dst = &offset_dst;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    ret = splice(src, p_offset_src, dst, p_offset_dst, (size_t)count,
+                 flags);
+    Py_END_ALLOW_THREADS
+
+    if (ret == -1)
+        return PyErr_SetFromErrno(PyExc_OSError);
+
+    return Py_BuildValue("n", ret);
+}
+
+static PyObject *
+method_tee(PyObject *self, PyObject *args, PyObject *kwdict)
+{
+    int src;
+    int dst;
+    unsigned int flags = 0;
+    Py_ssize_t count;
+    Py_ssize_t ret;
+    static char *keywords[] = {"src", "dst", "count", "flags", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwdict, "iin|I:tee",
+                                     keywords, &src, &dst, &count, &flags)) {
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    ret = tee(src, dst, (size_t)count, flags);
+    Py_END_ALLOW_THREADS
+
+    if (ret == -1)
+        return PyErr_SetFromErrno(PyExc_OSError);
+
+    return Py_BuildValue("n", ret);
+}
+#endif  // SPLICE_F_MOVE
+#endif  // __linux__
+
+/*
+ * ====================================================================
+ * Linux FICLONE / FICLONERANGE ioctl(2) (reflink)
+ * ====================================================================
+ */
+
+#if defined(__linux__)
+#include <sys/ioctl.h>
+#include <linux/fs.h>
+
+#if defined(FICLONE) && defined(FICLONERANGE)
+#define HAVE_FICLONE 1
+
+static PyObject *
+method_ficlone(PyObject *self, PyObject *args)
+{
+    int src;
+    int dst;
+    int ret;
+
+    if (!PyArg_ParseTuple(args, "ii:ficlone", &src, &dst))
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    ret = ioctl(dst, FICLONE, src);
+    Py_END_ALLOW_THREADS
+    if (ret == -1)
+        return PyErr_SetFromErrno(PyExc_OSError);
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+method_ficlonerange(PyObject *self, PyObject *args)
+{
+    int src;
+    int dst;
+    int ret;
+    off_t src_offset;
+    off_t src_length;
+    off_t dest_offset;
+    PyObject *srcoffobj;
+    PyObject *srclenobj;
+    PyObject *dstoffobj;
+    struct file_clone_range range;
+
+    if (!PyArg_ParseTuple(args, "iiOOO:ficlonerange", &src, &dst,
+                          &srcoffobj, &srclenobj, &dstoffobj))
+        return NULL;
+    if (!_parse_off_t(srcoffobj, &src_offset))
+        return NULL;
+    if (!_parse_off_t(srclenobj, &src_length))
+        return NULL;
+    if (!_parse_off_t(dstoffobj, &dest_offset))
+        return NULL;
+
+    range.src_fd = src;
+    range.src_offset = src_offset;
+    range.src_length = src_length;
+    range.dest_offset = dest_offset;
+
+    Py_BEGIN_ALLOW_THREADS
+    ret = ioctl(dst, FICLONERANGE, &range);
+    Py_END_ALLOW_THREADS
+    if (ret == -1)
+        return PyErr_SetFromErrno(PyExc_OSError);
+    Py_RETURN_NONE;
+}
+#endif  // FICLONE
+#endif  // __linux__
+
+/*
+ * ====================================================================
+ * Linux sync_file_range(2)
+ * ====================================================================
+ */
+
+#if defined(__linux__)
+#include <fcntl.h>
+
+#if defined(SYNC_FILE_RANGE_WRITE)
+#define HAVE_SYNC_FILE_RANGE 1
+
+static PyObject *
+method_sync_file_range(PyObject *self, PyObject *args)
+{
+    int fd;
+    int ret;
+    unsigned int flags;
+    off_t offset;
+    off_t nbytes;
+    PyObject *offobj;
+    PyObject *nbytesobj;
+
+    if (!PyArg_ParseTuple(args, "iOOI:sync_file_range", &fd, &offobj,
+                          &nbytesobj, &flags))
+        return NULL;
+    if (!_parse_off_t(offobj, &offset))
+        return NULL;
+    if (!_parse_off_t(nbytesobj, &nbytes))
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    ret = sync_file_range(fd, offset, nbytes, flags);
+    Py_END_ALLOW_THREADS
+    if (ret == -1)
+        return PyErr_SetFromErrno(PyExc_OSError);
+    Py_RETURN_NONE;
+}
+#endif  // SYNC_FILE_RANGE_WRITE
+#endif  // __linux__
+
+/*
+ * ====================================================================
+ * Linux fallocate(2)
+ * ====================================================================
+ */
+
+#if defined(__linux__)
+#include <fcntl.h>
+#include <linux/falloc.h>
+
+#if defined(FALLOC_FL_KEEP_SIZE)
+#define HAVE_FALLOCATE 1
+
+static PyObject *
+method_fallocate(PyObject *self, PyObject *args)
+{
+    int fd;
+    int mode;
+    int ret;
+    off_t offset;
+    off_t len;
+    PyObject *offobj;
+    PyObject *lenobj;
+
+    if (!PyArg_ParseTuple(args, "iiOO:fallocate", &fd, &mode, &offobj,
+                          &lenobj))
+        return NULL;
+    if (!_parse_off_t(offobj, &offset))
+        return NULL;
+    if (!_parse_off_t(lenobj, &len))
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    ret = fallocate(fd, mode, offset, len);
+    Py_END_ALLOW_THREADS
+    if (ret == -1)
+        return PyErr_SetFromErrno(PyExc_OSError);
+    Py_RETURN_NONE;
+}
+#endif  // FALLOC_FL_KEEP_SIZE
+#endif  // __linux__
+
+/*
+ * ====================================================================
+ * Linux linkat(2), used to give a name to O_TMPFILE files
+ * ====================================================================
+ */
+
+#if defined(__linux__)
+#include <fcntl.h>
+#include <unistd.h>
+
+#if defined(AT_SYMLINK_FOLLOW) && defined(O_TMPFILE)
+#define HAVE_LINKAT 1
+
+static PyObject *
+method_linkat(PyObject *self, PyObject *args)
+{
+    int olddirfd;
+    int newdirfd;
+    int flags;
+    int ret;
+    char *oldpath = NULL;
+    char *newpath = NULL;
+
+    if (!PyArg_ParseTuple(args, "ietieti:linkat", &olddirfd,
+                          Py_FileSystemDefaultEncoding, &oldpath, &newdirfd,
+                          Py_FileSystemDefaultEncoding, &newpath, &flags))
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    ret = linkat(olddirfd, oldpath, newdirfd, newpath, flags);
+    Py_END_ALLOW_THREADS
+    PyMem_Free(oldpath);
+    PyMem_Free(newpath);
+    if (ret == -1)
+        return PyErr_SetFromErrno(PyExc_OSError);
+    Py_RETURN_NONE;
+}
+#endif  // AT_SYMLINK_FOLLOW && O_TMPFILE
+#endif  // __linux__
+
+/*
+ * ====================================================================
+ * Linux batch copy of many (src, dst) file pairs
+ * ====================================================================
+ */
+
+#if defined(__linux__) && defined(HAVE_COPY_FILE_RANGE) && \
+        defined(HAVE_COPYFD)
+#include <fcntl.h>
+#include <sys/stat.h>
+#define HAVE_COPY_MANY 1
+
+// error codes other than errno
+#define COPY_MANY_SAMEFILE -1
+#define COPY_MANY_SPECIALFILE -2
+// which path the error refers to
+#define COPY_MANY_SRC 0
+#define COPY_MANY_DST 1
+#define COPY_MANY_NONE 2
+
+#define COPY_MANY_BUFSIZE (128 * 1024)
+
+struct copy_many_result {
+    off_t copied;
+    int err;
+    int which;
+};
+
+
+/*
+ * Copy infd into outfd 'till EOF by using copy_file_range(), then
+ * sendfile(), then read() / write(), switching to the next strategy
+ * only if the previous one fails before copying any data.
+ * Return the number of bytes copied; on error set *err to errno.
+ */
+static off_t
+_copy_many_fds(int infd, int outfd, char *buf, int *err)
+{
+    off_t total = 0;
+    ssize_t n;
+    ssize_t w;
+    int method = 0;  // 0: copy_file_range(), 1: sendfile(), 2: read()
+
+    while (1) {
+        if (method == 0) {
+            n = syscall(__NR_copy_file_range, infd, NULL, outfd, NULL,
+                        (size_t)0x40000000, 0);
+            // procfs & co. may silently return 0 on first call
+            if (total == 0 && (n == 0 || (n == -1 && (
+                    errno == ENOSYS || errno == EXDEV || errno == EINVAL ||
+                    errno == EOPNOTSUPP || errno == ENOTSUP)))) {
+                method = 1;
+                continue;
+            }
+        }
+        else if (method == 1) {
+            n = sendfile(outfd, infd, NULL, (size_t)0x40000000);
+            if (n == -1 && total == 0 && (
+                    errno == ENOTSOCK || errno == EINVAL || errno == ENOSYS)) {
+                method = 2;
+                continue;
+            }
+        }
+        else {
+            n = read(infd, buf, COPY_MANY_BUFSIZE);
+            if (n > 0) {
+                w = 0;
+                while (w < n) {
+                    ssize_t ret = write(outfd, buf + w, n - w);
+                    if (ret == -1) {
+                        if (errno == EINTR)
+                            continue;
+                        *err = errno;
+                        return total + w;
+                    }
+                    w += ret;
+                }
+            }
+        }
+
+        if (n == -1) {
+            if (errno == EINTR)
+                continue;
+            *err = errno;
+            return total;
+        }
+        if (n == 0)
+            return total;  // EOF
+        total += n;
+    }
+}
+
+
+static void
+_copy_many_pair(const char *src, const char *dst, char *buf,
+                struct copy_many_result *res)
+{
+    int infd = -1;
+    int outfd = -1;
+    int dst_exists;
+    struct stat st_src;
+    struct stat st_dst;
+
+    res->copied = 0;
+    res->err = 0;
+    res->which = COPY_MANY_NONE;
+
+    // Never open() FIFOs as that would block, hence stat() first.
+    if (stat(src, &st_src) != 0) {
+        res->err = errno;
+        res->which = COPY_MANY_SRC;
+        return;
+    }
+    dst_exists = stat(dst, &st_dst) == 0;
+    if (dst_exists && st_src.st_dev == st_dst.st_dev &&
+            st_src.st_ino == st_dst.st_ino) {
+        res->err = COPY_MANY_SAMEFILE;
+        return;
+    }
+    if (S_ISFIFO(st_src.st_mode)) {
+        res->err = COPY_MANY_SPECIALFILE;
+        res->which = COPY_MANY_SRC;
+        return;
+    }
+    if (dst_exists && S_ISFIFO(st_dst.st_mode)) {
+        res->err = COPY_MANY_SPECIALFILE;
+        res->which = COPY_MANY_DST;
+        return;
+    }
+    if (S_ISDIR(st_src.st_mode)) {
+        res->err = EISDIR;
+        res->which = COPY_MANY_SRC;
+        return;
+    }
+
+    infd = open(src, O_RDONLY | O_CLOEXEC);
+    if (infd == -1) {
+        res->err = errno;
+        res->which = COPY_MANY_SRC;
+        return;
+    }
+    outfd = open(dst, O_WRONLY | O_CREAT | O_TRUNC | O_CLOEXEC, 0666);
+    if (outfd == -1) {
+        res->err = errno;
+        res->which = COPY_MANY_DST;
+        close(infd);
+        return;
+    }
+
+    res->copied = _copy_many_fds(infd, outfd, buf, &res->err);
+    close(infd);
+    if (close(outfd) != 0 && res->err == 0) {
+        res->err = errno;
+        res->which = COPY_MANY_DST;
+    }
+}
+
+
+static PyObject *
+method_copy_many(PyObject *self, PyObject *args)
+{
+    PyObject *pairs;
+    PyObject *seq = NULL;
+    PyObject **paths = NULL;
+    PyObject *ret = NULL;
+    PyObject *item;
+    struct copy_many_result *results = NULL;
+    char *buf = NULL;
+    Py_ssize_t count;
+    Py_ssize_t i;
+
+    if (!PyArg_ParseTuple(args, "O:copy_many", &pairs))
+        return NULL;
+    seq = PySequence_Fast(pairs, "pairs must be a sequence");
+    if (seq == NULL)
+        return NULL;
+    count = PySequence_Fast_GET_SIZE(seq);
+
+    paths = (PyObject **)PyMem_Malloc((count * 2 + 1) * sizeof(PyObject *));
+    if (paths != NULL)
+        memset(paths, 0, (count * 2 + 1) * sizeof(PyObject *));
+    results = (struct copy_many_result *)PyMem_Malloc(
+        (count + 1) * sizeof(struct copy_many_result));
+    buf = (char *)PyMem_Malloc(COPY_MANY_BUFSIZE);
+    if (paths == NULL || results == NULL || buf == NULL) {
+        PyErr_NoMemory();
+        goto error;
+    }
+
+    // Convert all paths to bytes upfront, while holding the GIL.
+    for (i = 0; i < count; i++) {
+        item = PySequence_Fast_GET_ITEM(seq, i);
+#if PY_MAJOR_VERSION >= 3
+        if (!PyArg_ParseTuple(item, "O&O&:copy_many",
+                              PyUnicode_FSConverter, &paths[i * 2],
+                              PyUnicode_FSConverter, &paths[i * 2 + 1]))
+            goto error;
+#else
+        if (!PyArg_ParseTuple(item, "SS:copy_many",
+                              &paths[i * 2], &paths[i * 2 + 1]))
+            goto error;
+        Py_INCREF(paths[i * 2]);
+        Py_INCREF(paths[i * 2 + 1]);
+#endif
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < count; i++) {
+        _copy_many_pair(PyBytes_AS_STRING(paths[i * 2]),
+                        PyBytes_AS_STRING(paths[i * 2 + 1]),
+                        buf, &results[i]);
+    }
+    Py_END_ALLOW_THREADS
+
+    ret = PyList_New(count);
+    if (ret == NULL)
+        goto error;
+    for (i = 0; i < count; i++) {
+        item = Py_BuildValue(
+#if defined(HAVE_LARGEFILE_SUPPORT)
+            "(Lii)", (PY_LONG_LONG)results[i].copied,
+#else
+            "(lii)", (long)results[i].copied,
+#endif
+            results[i].err, results[i].which);
+        if (item == NULL) {
+            Py_CLEAR(ret);
+            goto error;
+        }
+        PyList_SET_ITEM(ret, i, item);
+    }
+
+error:
+    if (paths != NULL) {
+        for (i = 0; i < count * 2; i++)
+            Py_XDECREF(paths[i]);
+        PyMem_Free(paths);
+    }
+    PyMem_Free(results);
+    PyMem_Free(buf);
+    Py_DECREF(seq);
+    return ret;
+}
+#endif  // HAVE_COPY_MANY
+
 /*
  * ====================================================================
  * OSX fcopyfile(2)
@@ -331,14 +1103,115 @@ static PyMethodDef zerocopy_methods[] = {
      "On Linux, if offset is given as None, the bytes are read from\n"
      "the current position of in and the position of in is updated.\n"
      "headers and trailers are strings that are written before and\n"
-     "after the data from in is written. In cross platform applications\n"
-     "their usage is discouraged (socket.send() or socket.sendall()\n"
-     "can be used instead).\n"
+     "after the data from in is written, in which case the return\n"
+     "value includes them. On Linux the socket is corked (TCP_CORK)\n"
+     "so that they're coalesced with file data in the fewest possible\n"
+     "TCP segments. In cross platform applications their usage is\n"
+     "discouraged (socket.send() or socket.sendall() can be used\n"
+     "instead).\n"
      "On Solaris, out may be the file descriptor of a regular file\n"
      "or the file descriptor of a socket. On all other platforms,\n"
      "out must be the file descriptor of an open socket.\n"
      "flags argument is only supported on FreeBSD.\n"
     },
+#if defined(HAVE_COPYFD)
+    {"copyfd", (PyCFunction)method_copyfd, METH_VARARGS | METH_KEYWORDS,
+     "copyfd(infd, outfd, blocksize, offset=0)\n\n"
+     "Copy the content of file descriptor infd starting at offset\n"
+     "into outfd by calling sendfile() in a loop 'till EOF, with the\n"
+     "GIL released only once for the whole loop.\n"
+     "Return the total number of bytes copied. In case of error, if\n"
+     "no data was copied the position of outfd is left untouched\n"
+     "(Linux only).\n"
+    },
+#endif
+#if defined(HAVE_COPY_MANY)
+    {"copy_many", (PyCFunction)method_copy_many, METH_VARARGS,
+     "copy_many(pairs)\n\n"
+     "Copy the content of many files given as a sequence of\n"
+     "(src, dst) paths. For each pair src and dst are opened, copied\n"
+     "and closed in C, with the GIL released once for the whole\n"
+     "batch. Return a list of (copied, err, which) tuples where err\n"
+     "is 0 on success, an errno code or COPY_MANY_SAMEFILE /\n"
+     "COPY_MANY_SPECIALFILE, and which tells whether the error\n"
+     "refers to src (0), dst (1) or none of them (2) (Linux only).\n"
+    },
+#endif
+#if defined(HAVE_COPY_FILE_RANGE)
+    {"copy_file_range", (PyCFunction)method_copy_file_range,
+     METH_VARARGS | METH_KEYWORDS,
+     "copy_file_range(src, dst, count, offset_src=None, offset_dst=None, "
+     "flags=0)\n\n"
+     "Copy count bytes from file descriptor src, starting from offset\n"
+     "offset_src, to file descriptor dst, starting from offset\n"
+     "offset_dst. If an offset is None the current file position of\n"
+     "the respective fd is used and updated.\n"
+     "Return the number of bytes copied, 0 on EOF (Linux >= 4.5).\n"
+    },
+#endif
+#if defined(HAVE_SPLICE)
+    {"splice", (PyCFunction)method_splice, METH_VARARGS | METH_KEYWORDS,
+     "splice(src, dst, count, offset_src=None, offset_dst=None, "
+     "flags=0)\n\n"
+     "Move count bytes from file descriptor src to file descriptor\n"
+     "dst without copying them in user space. One of the two fds\n"
+     "must refer to a pipe. If an offset is None the current file\n"
+     "position of the respective fd is used and updated (offsets\n"
+     "must be None for pipes). flags is a bitmask of SPLICE_F_*\n"
+     "constants. Return the number of bytes spliced, 0 on EOF\n"
+     "(Linux only).\n"
+    },
+    {"tee", (PyCFunction)method_tee, METH_VARARGS | METH_KEYWORDS,
+     "tee(src, dst, count, flags=0)\n\n"
+     "Duplicate up to count bytes from pipe src to pipe dst without\n"
+     "consuming them, so that they can still be read from src.\n"
+     "flags is a bitmask of SPLICE_F_* constants. Return the number\n"
+     "of bytes duplicated, 0 if src is empty and its write end is\n"
+     "closed (Linux only).\n"
+    },
+#endif
+#if defined(HAVE_FICLONE)
+    {"ficlone", (PyCFunction)method_ficlone, METH_VARARGS,
+     "ficlone(src, dst)\n\n"
+     "Make dst file descriptor share the same data extents of src\n"
+     "(reflink / copy-on-write clone). Requires a filesystem\n"
+     "supporting it (Btrfs, XFS, OCFS2...) and both fds living on the\n"
+     "same mount (Linux >= 4.5).\n"
+    },
+    {"ficlonerange", (PyCFunction)method_ficlonerange, METH_VARARGS,
+     "ficlonerange(src, dst, src_offset, src_length, dest_offset)\n\n"
+     "Same as ficlone() but only clones src_length bytes starting\n"
+     "from src_offset into dst at dest_offset. A src_length of 0\n"
+     "means 'till EOF'. Offsets must be block aligned (Linux >= 4.5).\n"
+    },
+#endif
+#if defined(HAVE_FALLOCATE)
+    {"fallocate", (PyCFunction)method_fallocate, METH_VARARGS,
+     "fallocate(fd, mode, offset, len)\n\n"
+     "Allocate disk space for len bytes of fd starting at offset.\n"
+     "Differently from posix_fallocate() this fails with EOPNOTSUPP\n"
+     "instead of writing zeros if the filesystem does not support it.\n"
+     "mode is a bitmask of FALLOC_FL_* constants (Linux only).\n"
+    },
+#endif
+#if defined(HAVE_LINKAT)
+    {"linkat", (PyCFunction)method_linkat, METH_VARARGS,
+     "linkat(olddirfd, oldpath, newdirfd, newpath, flags)\n\n"
+     "Create a hard link newpath pointing to oldpath. Differently from\n"
+     "os.link() flags are passed as is, so that an O_TMPFILE file can\n"
+     "be linked via /proc/self/fd/N and AT_SYMLINK_FOLLOW. Paths are\n"
+     "relative to *dirfd, which can be AT_FDCWD (Linux only).\n"
+    },
+#endif
+#if defined(HAVE_SYNC_FILE_RANGE)
+    {"sync_file_range", (PyCFunction)method_sync_file_range, METH_VARARGS,
+     "sync_file_range(fd, offset, nbytes, flags)\n\n"
+     "Start and / or wait for the writeback of the dirty pages of fd\n"
+     "in the given range to disk. An nbytes of 0 means 'till EOF'.\n"
+     "flags is a bitmask of SYNC_FILE_RANGE_* constants. Does not\n"
+     "flush metadata nor the disk write cache (Linux only).\n"
+    },
+#endif
 #if defined(__APPLE__)
     {"fcopyfile", (PyCFunction)method_fcopyfile, METH_VARARGS | METH_KEYWORDS,
      "Efficiently copy data between 2 fds (OSX)"},
@@ -395,6 +1268,33 @@ init_zerocopy(void)
 #endif
 #ifdef SF_SYNC
     PyModule_AddIntConstant(module, "SF_SYNC", SF_SYNC);
+#endif
+#ifdef HAVE_SPLICE
+    PyModule_AddIntConstant(module, "SPLICE_F_MOVE", SPLICE_F_MOVE);
+    PyModule_AddIntConstant(module, "SPLICE_F_NONBLOCK", SPLICE_F_NONBLOCK);
+    PyModule_AddIntConstant(module, "SPLICE_F_MORE", SPLICE_F_MORE);
+#endif
+#ifdef HAVE_FALLOCATE
+    PyModule_AddIntConstant(module, "FALLOC_FL_KEEP_SIZE",
+                            FALLOC_FL_KEEP_SIZE);
+#endif
+#ifdef HAVE_LINKAT
+    PyModule_AddIntConstant(module, "AT_FDCWD", AT_FDCWD);
+    PyModule_AddIntConstant(module, "AT_SYMLINK_FOLLOW", AT_SYMLINK_FOLLOW);
+#endif
+#ifdef HAVE_SYNC_FILE_RANGE
+    PyModule_AddIntConstant(module, "SYNC_FILE_RANGE_WAIT_BEFORE",
+                            SYNC_FILE_RANGE_WAIT_BEFORE);
+    PyModule_AddIntConstant(module, "SYNC_FILE_RANGE_WRITE",
+                            SYNC_FILE_RANGE_WRITE);
+    PyModule_AddIntConstant(module, "SYNC_FILE_RANGE_WAIT_AFTER",
+                            SYNC_FILE_RANGE_WAIT_AFTER);
+#endif
+#ifdef HAVE_COPY_MANY
+    PyModule_AddIntConstant(module, "COPY_MANY_SAMEFILE",
+                            COPY_MANY_SAMEFILE);
+    PyModule_AddIntConstant(module, "COPY_MANY_SPECIALFILE",
+                            COPY_MANY_SPECIALFILE);
 #endif
     if (module == NULL)
         INITERROR;
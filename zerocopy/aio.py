@@ -0,0 +1,273 @@
+"""asyncio integration (Python >= 3.5 only).
+
+>>> import zerocopy.aio
+>>> await zerocopy.aio.sendfile(loop, sock, file)
+>>> await zerocopy.aio.copyfile('src', 'dst')
+>>> await zerocopy.aio.relay(loop, sock_a, sock_b)
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import os
+import socket
+
+from zerocopy._copyfile import copyfile as _copyfile
+from zerocopy._sendfile import _check_sendfile_params
+from zerocopy._sendfile import _check_stream_socket
+from zerocopy._sendfile import _GiveupOnSendfile
+from zerocopy._sendfile import _is_ssl_socket
+from zerocopy._sendfile import HAS_SENDFILE
+from zerocopy._splice import _RELAY_FLAGS
+from zerocopy._splice import _pipe_pool
+from zerocopy._splice import _resize_pipe
+from zerocopy._splice import _shutdown
+from zerocopy._splice import HAS_SPLICE
+
+if os.name == 'posix':
+    import _zerocopy
+else:
+    _zerocopy = None
+
+
+__all__ = ["copyfile", "relay", "sendfile"]
+
+# the max number of threads used by copyfile() if no executor is passed
+MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # Note: thread_name_prefix requires Python >= 3.6.
+        _executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=MAX_WORKERS)
+    return _executor
+
+
+def _create_future(loop):
+    # loop.create_future() requires Python >= 3.5.2
+    if hasattr(loop, "create_future"):
+        return loop.create_future()
+    return asyncio.Future(loop=loop)
+
+
+async def _sendfile_native(loop, sock, file, offset, count):
+    if not HAS_SENDFILE:
+        raise _GiveupOnSendfile("sendfile() not available")
+    try:
+        fileno = file.fileno()
+        fsize = os.fstat(fileno).st_size
+    except Exception as err:
+        raise _GiveupOnSendfile(err)  # not a regular file
+    if not fsize:
+        return 0  # empty file
+    # Truncate to 1GiB to avoid OverflowError.
+    blocksize = min(count or fsize, 2 ** 30)
+    sockno = sock.fileno()
+    fut = _create_future(loop)
+    total_sent = 0
+
+    def on_writable():
+        # Called by the loop every time the socket is writable; each
+        # call sends as much data as the socket buffer can take.
+        nonlocal offset, total_sent
+        if fut.done():
+            return
+        nbytes = blocksize
+        if count:
+            nbytes = min(count - total_sent, blocksize)
+            if nbytes <= 0:
+                fut.set_result(total_sent)
+                return
+        try:
+            sent = _zerocopy.sendfile(sockno, fileno, offset, nbytes)
+        except (BlockingIOError, InterruptedError):
+            return  # wait for the next writable event
+        except OSError as err:
+            if total_sent == 0:
+                # Most likely 'file' is not a regular mmap(2)-like file;
+                # fall back on using plain send().
+                fut.set_exception(_GiveupOnSendfile(err))
+            else:
+                fut.set_exception(err)
+        except BaseException as exc:
+            fut.set_exception(exc)
+        else:
+            if sent == 0:
+                fut.set_result(total_sent)  # EOF
+            else:
+                offset += sent
+                total_sent += sent
+
+    loop.add_writer(sockno, on_writable)
+    try:
+        return await fut
+    finally:
+        loop.remove_writer(sockno)
+        if total_sent > 0 and hasattr(file, 'seek'):
+            file.seek(offset)
+
+
+async def _sendfile_fallback(loop, sock, file, offset, count):
+    if offset:
+        file.seek(offset)
+    blocksize = min(count, 65536) if count else 65536
+    total_sent = 0
+    try:
+        while True:
+            if count:
+                blocksize = min(count - total_sent, blocksize)
+                if blocksize <= 0:
+                    break
+            data = file.read(blocksize)
+            if not data:
+                break  # EOF
+            await loop.sock_sendall(sock, data)
+            total_sent += len(data)
+        return total_sent
+    finally:
+        if total_sent > 0 and hasattr(file, 'seek'):
+            file.seek(offset + total_sent)
+
+
+async def sendfile(loop, sock, file, offset=0, count=None):
+    """Send a file over a non-blocking socket from within the event
+    loop thread by using sendfile() syscall: every time the socket is
+    writable (see loop.add_writer()) as much data as possible is
+    sent, without copying it in user space nor blocking the loop.
+    Return the total number of bytes which were sent.
+
+    Arguments and behavior are the same as zerocopy.sendfile(). If
+    file is not a regular file (or sendfile() is not available) data
+    is read from the file and sent via loop.sock_sendall() instead.
+    The coroutine can be cancelled, in which case the file position
+    reflects the bytes which were sent.
+    ssl.SSLSocket sockets are not supported (use asyncio streams or
+    loop.sendfile() with an SSL transport instead).
+    """
+    _check_sendfile_params(sock, file, offset, count)
+    if sock.gettimeout() != 0:
+        raise ValueError("the socket must be non-blocking")
+    if _is_ssl_socket(sock):
+        raise ValueError("SSL sockets are not supported")
+    try:
+        return await _sendfile_native(loop, sock, file, offset, count)
+    except _GiveupOnSendfile:
+        return await _sendfile_fallback(loop, sock, file, offset, count)
+
+
+async def copyfile(src, dst, loop=None, executor=None, **kwargs):
+    """Run zerocopy.copyfile() in a thread pool so that the event loop
+    is not blocked and return dst. Extra keyword arguments are passed
+    to copyfile().
+
+    executor defaults to a module-wide ThreadPoolExecutor which runs
+    at most MAX_WORKERS copies concurrently; the extra copies are
+    queued.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    if executor is None:
+        executor = _get_executor()
+    return await loop.run_in_executor(
+        executor, functools.partial(_copyfile, src, dst, **kwargs))
+
+
+async def _wait_fd(loop, fd, readable):
+    fut = _create_future(loop)
+    add, remove = ((loop.add_reader, loop.remove_reader) if readable else
+                   (loop.add_writer, loop.remove_writer))
+    add(fd, lambda: fut.done() or fut.set_result(None))
+    try:
+        await fut
+    finally:
+        remove(fd)
+
+
+async def _pump_native(loop, src, dst, bufsize):
+    srcno = src.fileno()
+    dstno = dst.fileno()
+    acquired = _pipe_pool.acquire()
+    pipe = _resize_pipe(acquired, bufsize)
+    r, w, pipesize = pipe
+    flags = _RELAY_FLAGS | _zerocopy.SPLICE_F_NONBLOCK
+    clean = True
+    total = 0
+    try:
+        while True:
+            try:
+                received = _zerocopy.splice(srcno, w, pipesize, flags=flags)
+            except (BlockingIOError, InterruptedError):
+                await _wait_fd(loop, srcno, readable=True)
+                continue
+            if received == 0:
+                break  # EOF
+            clean = False
+            pending = received
+            while pending:
+                try:
+                    pending -= _zerocopy.splice(r, dstno, pending,
+                                                flags=flags)
+                except (BlockingIOError, InterruptedError):
+                    await _wait_fd(loop, dstno, readable=False)
+            clean = True
+            total += received
+        return total
+    finally:
+        # see _splice._pump_use_splice()
+        _pipe_pool.release(pipe, clean and pipesize == acquired[2])
+
+
+async def _pump_fallback(loop, src, dst, bufsize):
+    bufsize = bufsize or 65536
+    total = 0
+    while True:
+        data = await loop.sock_recv(src, bufsize)
+        if not data:
+            break  # EOF
+        await loop.sock_sendall(dst, data)
+        total += len(data)
+    return total
+
+
+async def _pump(loop, src, dst, bufsize):
+    if HAS_SPLICE:
+        total = await _pump_native(loop, src, dst, bufsize)
+    else:
+        total = await _pump_fallback(loop, src, dst, bufsize)
+    _shutdown(dst, socket.SHUT_WR)  # half-close
+    return total
+
+
+async def relay(loop, sock_a, sock_b, bufsize=None):
+    """Forward data between 2 connected non-blocking sockets in both
+    directions from within the event loop thread by using splice():
+    data is moved through kernel pipes every time a socket is
+    readable / writable, without copying it in user space.
+    Return a (bytes a -> b, bytes b -> a) tuple.
+
+    Arguments and behavior are the same as zerocopy.relay(). If
+    splice() is not available loop.sock_recv() and
+    loop.sock_sendall() are used instead. If the coroutine is
+    cancelled or one direction fails the other one is cancelled as
+    well; closing the sockets is up to the caller.
+    ssl.SSLSocket sockets are not supported.
+    """
+    for sock in (sock_a, sock_b):
+        _check_stream_socket(sock)
+        if sock.gettimeout() != 0:
+            raise ValueError("the sockets must be non-blocking")
+        if _is_ssl_socket(sock):
+            raise ValueError("SSL sockets are not supported")
+    a2b = asyncio.ensure_future(_pump(loop, sock_a, sock_b, bufsize),
+                                loop=loop)
+    b2a = asyncio.ensure_future(_pump(loop, sock_b, sock_a, bufsize),
+                                loop=loop)
+    try:
+        await asyncio.gather(a2b, b2a)
+    finally:
+        for task in (a2b, b2a):
+            task.cancel()
+    return (a2b.result(), b2a.result())
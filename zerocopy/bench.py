@@ -0,0 +1,355 @@
+"""Benchmark every copy strategy across file sizes, file layouts
+(dense / sparse), page cache state (warm / cold), concurrency and
+filesystems.
+
+    $ python -m zerocopy.bench --sizes 0,1M,1G --dir /dev/shm --dir /mnt
+    $ python -m zerocopy.bench --json results.json
+    $ python -m zerocopy.bench --baseline results.json  # regressions?
+
+Results can be saved as JSON (--json) and compared against a previous
+run (--baseline): the exit code is 1 if any benchmark got slower than
+--tolerance.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import zerocopy
+from zerocopy import _copyfile
+from zerocopy._copyfile import _GiveupOnZeroCopy
+
+
+_timer = getattr(time, "perf_counter", time.time)  # Python 2
+_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+# data block written into dense src files
+_BLOCK = os.urandom(2 ** 20)
+
+DEFAULT_SIZES = "0,4K,64K,1M,16M,256M"
+DEFAULT_TOLERANCE = 0.1  # 10%
+
+
+# =====================================================================
+# --- strategies
+# =====================================================================
+
+
+def _engine(fun, *args):
+    def run(src, dst):
+        with open(src, 'rb') as fsrc:
+            with open(dst, 'wb') as fdst:
+                fun(fsrc, fdst, *args)
+    return run
+
+
+def get_strategies():
+    """Return a {name: fun(src, dst)} dict of the strategies which are
+    available on this platform. Low level engines are called directly
+    so that there's no fallback; they raise _GiveupOnZeroCopy if they
+    can't be used (e.g. reflink on ext4).
+    """
+    ret = {
+        "copyfile": zerocopy.copyfile,
+        "shutil": shutil.copyfile,
+        "readinto": _engine(_copyfile._copyfileobj_readinto),
+    }
+    if _copyfile.PY3:
+        ret["mmap"] = _engine(
+            lambda fsrc, fdst: _copyfile._copyfileobj_mmap(
+                fsrc, fdst, os.fstat(fsrc.fileno()).st_size))
+    if _copyfile.HAS_COPY_FILE_RANGE:
+        ret["copy_file_range"] = _engine(
+            _copyfile._zerocopy_copy_file_range)
+        if _copyfile.ThreadPoolExecutor is not None:
+            ret["parallel"] = _engine(_copyfile._zerocopy_parallel, 4)
+    if _copyfile.HAS_SENDFILE:
+        ret["sendfile"] = _engine(_copyfile._zerocopy_sendfile)
+    if _copyfile.HAS_COPYFD:
+        ret["copyfd"] = _engine(_copyfile._zerocopy_copyfd)
+    if _copyfile.HAS_FCOPYFILE:
+        ret["fcopyfile"] = _engine(_copyfile._zerocopy_osx)
+    if _copyfile.HAS_FICLONE:
+        ret["reflink"] = _engine(_copyfile._zerocopy_reflink)
+    if _copyfile.HAS_SEEK_HOLE:
+        ret["sparse"] = _engine(_copyfile._zerocopy_sparse)
+    if _copyfile._O_DIRECT:
+        ret["direct"] = _engine(_copyfile._copyfileobj_direct)
+    return ret
+
+
+# =====================================================================
+# --- utils
+# =====================================================================
+
+
+def parse_size(s):
+    """Parse a size such as "4K", "1M" or "2G" (powers of 1024)."""
+    s = s.strip().upper().rstrip("B")
+    unit = s[-1:] if s[-1:] in _UNITS else ""
+    return int(float(s[:len(s) - len(unit)]) * _UNITS[unit])
+
+
+def format_size(n):
+    for unit in ("G", "M", "K"):
+        if n >= _UNITS[unit] and n % _UNITS[unit] == 0:
+            return "%d%s" % (n // _UNITS[unit], unit)
+    return str(n)
+
+
+def get_fstype(path):
+    """Return the type of the filesystem path lives on (Linux only)."""
+    path = os.path.realpath(path)
+    best = ("", "?")
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                mountpoint, fstype = fields[1], fields[2]
+                if (path == mountpoint or
+                        path.startswith(mountpoint.rstrip("/") + "/")) and \
+                        len(mountpoint) > len(best[0]):
+                    best = (mountpoint, fstype)
+    except (IOError, OSError):
+        pass
+    return best[1]
+
+
+def make_file(path, size, sparse=False):
+    """Create a src file of the given size. Sparse files only have 2
+    data blocks, at the beginning and at the end.
+    """
+    with open(path, "wb") as f:
+        if sparse:
+            f.truncate(size)
+            block = _BLOCK[:min(size // 2, 65536)]
+            f.write(block)
+            f.seek(size - len(block))
+            f.write(block)
+        else:
+            left = size
+            while left > 0:
+                f.write(_BLOCK[:left])
+                left -= len(_BLOCK)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def drop_cache(path):
+    """Evict a file from the page cache, so that the next read hits
+    the disk (POSIX only, no root needed).
+    """
+    if hasattr(os, "posix_fadvise"):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def timeit(fun, src, dsts, cold):
+    """Copy src to all dsts concurrently (1 thread each) and return the
+    elapsed time.
+    """
+    for dst in dsts:
+        if os.path.exists(dst):
+            os.remove(dst)
+    if cold:
+        drop_cache(src)
+    errors = []
+
+    def target(dst):
+        try:
+            fun(src, dst)
+        except BaseException as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=target, args=(dst, ))
+               for dst in dsts[1:]]
+    started = _timer()
+    for t in threads:
+        t.start()
+    target(dsts[0])
+    for t in threads:
+        t.join()
+    elapsed = _timer() - started
+    if errors:
+        raise errors[0]
+    return elapsed
+
+
+def result_key(res):
+    return (res["strategy"], res["size"], res["layout"], res["cache"],
+            res["threads"], res["fstype"])
+
+
+# =====================================================================
+# --- main
+# =====================================================================
+
+
+def run(sizes, dirs, strategies, layouts=("dense", ),
+        caches=("warm", ), threads=(1, ), repeat=5, out=None):
+    """Run all the combinations of the given parameters and return a
+    list of results (dicts). Progress is printed to out, if any.
+    """
+    available = get_strategies()
+    results = []
+    for dirname in dirs:
+        fstype = get_fstype(dirname)
+        tmpdir = tempfile.mkdtemp(prefix="zerocopy-bench-", dir=dirname)
+        try:
+            src = os.path.join(tmpdir, "src")
+            for size in sizes:
+                for layout in layouts:
+                    if layout == "sparse" and size == 0:
+                        continue
+                    make_file(src, size, sparse=layout == "sparse")
+                    for nthreads in threads:
+                        dsts = [os.path.join(tmpdir, "dst%s" % i)
+                                for i in range(nthreads)]
+                        for cache in caches:
+                            for name in strategies:
+                                res = dict(
+                                    strategy=name, size=size, layout=layout,
+                                    cache=cache, threads=nthreads,
+                                    fstype=fstype, dir=dirname)
+                                try:
+                                    times = [timeit(available[name], src,
+                                                    dsts, cache == "cold")
+                                             for _ in range(repeat)]
+                                except _GiveupOnZeroCopy as err:
+                                    res["skipped"] = str(err)
+                                else:
+                                    times.sort()
+                                    res["times"] = times
+                                    res["min"] = times[0]
+                                    res["median"] = times[len(times) // 2]
+                                    res["mb_per_sec"] = (
+                                        size * nthreads / res["min"] /
+                                        1024 ** 2) if res["min"] else 0
+                                results.append(res)
+                                if out is not None:
+                                    print(format_result(res), file=out)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    return results
+
+
+def format_result(res):
+    line = "%-16s %7s %-6s %-4s %2sT %-8s" % (
+        res["strategy"], format_size(res["size"]), res["layout"],
+        res["cache"], res["threads"], res["fstype"])
+    if "skipped" in res:
+        return line + "  skipped (%s)" % res["skipped"]
+    return line + "  %10.6fs %10.1f MB/s" % (
+        res["median"], res["mb_per_sec"])
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE,
+            min_delta=0.001):
+    """Compare results against the ones of a previous run and return
+    a list of (result, baseline result, ratio) tuples of the
+    benchmarks whose median time grew by more than tolerance (and
+    min_delta seconds, to ignore noise on small files).
+    """
+    base = dict((result_key(res), res) for res in baseline
+                if "median" in res)
+    regressions = []
+    for res in results:
+        old = base.get(result_key(res))
+        if old is None or "median" not in res or not old["median"]:
+            continue
+        ratio = res["median"] / old["median"]
+        if ratio > 1 + tolerance and \
+                res["median"] - old["median"] > min_delta:
+            regressions.append((res, old, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m zerocopy.bench",
+        description="Benchmark zerocopy copy strategies.")
+    parser.add_argument(
+        "--sizes", default=DEFAULT_SIZES,
+        help="comma separated file sizes (default %s)" % DEFAULT_SIZES)
+    parser.add_argument(
+        "--dir", action="append", dest="dirs",
+        help="directory where files are created; can be repeated to "
+             "compare filesystems, e.g. tmpfs vs disk (default: %s)" %
+             tempfile.gettempdir())
+    parser.add_argument(
+        "--strategies", default=None,
+        help="comma separated strategies (default: all of %s)" %
+             ",".join(sorted(get_strategies())))
+    parser.add_argument("--sparse", action="store_true",
+                        help="also benchmark sparse files")
+    parser.add_argument("--cold", action="store_true",
+                        help="also benchmark with a cold page cache")
+    parser.add_argument("--threads", default="1",
+                        help="comma separated number of concurrent copies "
+                             "(default 1)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="runs per benchmark (default 5)")
+    parser.add_argument("--json", metavar="FILE",
+                        help="save results to FILE")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare results against a previous --json "
+                             "FILE; exit code is 1 on regressions")
+    parser.add_argument("--tolerance", type=float,
+                        default=DEFAULT_TOLERANCE,
+                        help="max allowed slowdown vs the baseline "
+                             "(default %s)" % DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    available = get_strategies()
+    if args.strategies:
+        strategies = args.strategies.split(",")
+        for name in strategies:
+            if name not in available:
+                parser.error("strategy %r not available" % name)
+    else:
+        strategies = sorted(available)
+    results = run(
+        sizes=[parse_size(x) for x in args.sizes.split(",")],
+        dirs=args.dirs or [tempfile.gettempdir()],
+        strategies=strategies,
+        layouts=("dense", "sparse") if args.sparse else ("dense", ),
+        caches=("warm", "cold") if args.cold else ("warm", ),
+        threads=[int(x) for x in args.threads.split(",")],
+        repeat=args.repeat,
+        out=sys.stdout)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(
+                version=zerocopy.__version__,
+                python=platform.python_version(),
+                platform=platform.platform(),
+                results=results), f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for res, old, ratio in regressions:
+            print("REGRESSION: %s  was %.6fs (%+.1f%%)" % (
+                format_result(res), old["median"], (ratio - 1) * 100))
+        if regressions:
+            return 1
+        print("no regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,8 @@
 import errno
 import os
 import random
+import socket
+import ssl
 import string
 import sys
 import warnings
@@ -22,6 +24,20 @@ LINUX = sys.platform.startswith("linux")
 PY3 = sys.version_info[0] == 3
 
 
+def _find_certfile():
+    # The self-signed certificate of CPython's own test suite, which
+    # some distros don't install.
+    testdir = os.path.join(os.path.dirname(os.__file__), "test")
+    for name in ("keycert.pem", os.path.join("certdata", "keycert.pem")):
+        path = os.path.join(testdir, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+CERTFILE = _find_certfile()
+
+
 # =====================================================================
 # --- fs utils
 # =====================================================================
@@ -85,3 +101,39 @@ def assert_files_equal(src, dst):
         with open(dst, "rb") as b:
             if a.read() != b.read():
                 raise AssertionError("%s and %s files are not equal")
+
+
+# =====================================================================
+# --- net utils
+# =====================================================================
+
+
+def socketpair():
+    """Same as socket.socketpair() but on Python 2 as well return
+    socket.socket instances (which can be wrapped by ssl).
+    """
+    a, b = socket.socketpair()
+    if not PY3:
+        a, b = socket.socket(_sock=a), socket.socket(_sock=b)
+    return (a, b)
+
+
+def get_ssl_contexts():
+    """Return a (server, client) tuple of SSL contexts using CERTFILE
+    (the client does not verify it).
+    """
+    server = ssl.SSLContext(getattr(ssl, "PROTOCOL_TLS_SERVER",
+                                    ssl.PROTOCOL_SSLv23))
+    server.load_cert_chain(CERTFILE)
+    # TLS 1.3 servers send session tickets after the handshake: if the
+    # client never reads them closing its socket sends a RST, and the
+    # data not received by the server yet is lost.
+    if hasattr(ssl, "TLSVersion"):  # Python >= 3.7
+        server.maximum_version = ssl.TLSVersion.TLSv1_2
+    else:
+        server.options |= getattr(ssl, "OP_NO_TLSv1_3", 0)
+    client = ssl.SSLContext(getattr(ssl, "PROTOCOL_TLS_CLIENT",
+                                    ssl.PROTOCOL_SSLv23))
+    client.check_hostname = False
+    client.verify_mode = ssl.CERT_NONE
+    return (server, client)
@@ -0,0 +1,223 @@
+import io
+import socket
+import threading
+import time
+import unittest
+
+from zerocopy._splice import _PipePool
+from zerocopy.test import CERTFILE
+from zerocopy.test import get_ssl_contexts
+from zerocopy.test import mock
+from zerocopy.test import read_file
+from zerocopy.test import safe_remove
+from zerocopy.test import TESTFN
+from zerocopy.test import TESTFN2
+from zerocopy.test import write_test_file
+from zerocopy.test.test_splice import _Peer
+
+try:
+    import asyncio
+    import zerocopy.aio
+except (ImportError, SyntaxError):  # Python < 3.5
+    asyncio = None
+
+
+@unittest.skipIf(asyncio is None, "asyncio not supported")
+class TestAio(unittest.TestCase):
+    FILESIZE = (10 * 1024 * 1024)  # 10 MiB
+
+    @classmethod
+    def setUpClass(cls):
+        write_test_file(TESTFN, cls.FILESIZE)
+        cls.FILEDATA = read_file(TESTFN, binary=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def tearDown(self):
+        safe_remove(TESTFN2)
+
+    def sendfile(self, file, offset=0, count=None, delay=0):
+        def recv():
+            if delay:
+                time.sleep(delay)
+            while True:
+                chunk = b.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+
+        chunks = []
+        a, b = socket.socketpair()
+        self.addCleanup(b.close)
+        with a:
+            a.setblocking(False)
+            t = threading.Thread(target=recv)
+            t.start()
+            try:
+                ret = self.loop.run_until_complete(
+                    zerocopy.aio.sendfile(self.loop, a, file, offset, count))
+            finally:
+                a.close()
+                t.join(5)
+        return ret, b"".join(chunks)
+
+    def test_sendfile(self):
+        with open(TESTFN, "rb") as f:
+            ret, data = self.sendfile(f, delay=0.1)
+            self.assertEqual(f.tell(), self.FILESIZE)
+        self.assertEqual(ret, self.FILESIZE)
+        self.assertEqual(data, self.FILEDATA)
+
+    def test_sendfile_offset_and_count(self):
+        with open(TESTFN, "rb") as f:
+            ret, data = self.sendfile(f, offset=1000, count=3000000)
+            self.assertEqual(f.tell(), 3001000)
+        self.assertEqual(ret, 3000000)
+        self.assertEqual(data, self.FILEDATA[1000:3001000])
+
+    def test_sendfile_fallback(self):
+        with io.BytesIO(self.FILEDATA) as f:
+            ret, data = self.sendfile(f, offset=10, count=200000)
+            self.assertEqual(f.tell(), 200010)
+        self.assertEqual(ret, 200000)
+        self.assertEqual(data, self.FILEDATA[10:200010])
+
+    def test_sendfile_error_on_first_call(self):
+        with mock.patch("_zerocopy.sendfile",
+                        side_effect=OSError(22, "yo")) as m:
+            with open(TESTFN, "rb") as f:
+                ret, data = self.sendfile(f)
+            assert m.called
+        self.assertEqual(data, self.FILEDATA)
+
+    def test_sendfile_cancel(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        a.setblocking(False)
+        with open(TESTFN, "rb") as f:
+            task = self.loop.create_task(
+                zerocopy.aio.sendfile(self.loop, a, f))
+            self.loop.run_until_complete(asyncio.sleep(0.05))
+            task.cancel()
+            self.assertRaises(asyncio.CancelledError,
+                              self.loop.run_until_complete, task)
+            self.assertLess(f.tell(), self.FILESIZE)
+        # the writer callback is gone
+        self.assertFalse(self.loop.remove_writer(a.fileno()))
+
+    def test_sendfile_blocking_sock(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        with open(TESTFN, "rb") as f:
+            with self.assertRaises(ValueError):
+                self.loop.run_until_complete(
+                    zerocopy.aio.sendfile(self.loop, a, f))
+
+    @unittest.skipIf(CERTFILE is None, "no certificate to test SSL with")
+    def test_sendfile_ssl_sock(self):
+        a, b = socket.socketpair()
+        self.addCleanup(b.close)
+        a = get_ssl_contexts()[1].wrap_socket(
+            a, do_handshake_on_connect=False)
+        self.addCleanup(a.close)
+        a.setblocking(False)
+        with open(TESTFN, "rb") as f:
+            with self.assertRaises(ValueError):
+                self.loop.run_until_complete(
+                    zerocopy.aio.sendfile(self.loop, a, f))
+
+    def test_copyfile(self):
+        ret = self.loop.run_until_complete(
+            zerocopy.aio.copyfile(TESTFN, TESTFN2, loop=self.loop))
+        self.assertEqual(ret, TESTFN2)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    def test_copyfile_kwargs(self):
+        with mock.patch("zerocopy.aio._copyfile") as m:
+            self.loop.run_until_complete(
+                zerocopy.aio.copyfile(TESTFN, TESTFN2, loop=self.loop,
+                                      reflink="auto"))
+        m.assert_called_once_with(TESTFN, TESTFN2, reflink="auto")
+
+    def relay(self, bufsize=65536):
+        # client <-> a <- relay -> b <-> server
+        client, a = socket.socketpair()
+        b, server = socket.socketpair()
+        for sock in (a, b):
+            self.addCleanup(sock.close)
+            sock.setblocking(False)
+        peers = [_Peer(client, self.FILEDATA), _Peer(server, b"reply")]
+        for peer in peers:
+            peer.start()
+        ret = self.loop.run_until_complete(
+            zerocopy.aio.relay(self.loop, a, b, bufsize=bufsize))
+        for peer in peers:
+            peer.join(5)
+        self.assertEqual(ret, (self.FILESIZE, 5))
+        self.assertEqual(peers[1].received, self.FILEDATA)
+        self.assertEqual(peers[0].received, b"reply")
+
+    def test_relay(self):
+        self.relay()
+
+    def test_relay_bufsize_not_pooled(self):
+        # resized pipes are not given back to the pool
+        pool = _PipePool()
+        self.addCleanup(pool.close)
+        with mock.patch("zerocopy.aio._pipe_pool", pool):
+            self.relay(bufsize=131072)
+            self.assertEqual(pool._pipes, [])
+            self.relay(bufsize=None)
+        self.assertTrue(pool._pipes)
+
+    def test_relay_fallback(self):
+        with mock.patch("zerocopy.aio.HAS_SPLICE", False):
+            self.relay()
+
+    def test_relay_cancel(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        a.setblocking(False)
+        b.setblocking(False)
+        task = self.loop.create_task(zerocopy.aio.relay(self.loop, a, b))
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        task.cancel()
+        self.assertRaises(asyncio.CancelledError,
+                          self.loop.run_until_complete, task)
+        self.loop.run_until_complete(asyncio.sleep(0))
+        # the reader callbacks are gone
+        self.assertFalse(self.loop.remove_reader(a.fileno()))
+        self.assertFalse(self.loop.remove_reader(b.fileno()))
+
+    def test_relay_blocking_sock(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        a.setblocking(False)
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(zerocopy.aio.relay(self.loop, a, b))
+
+    @unittest.skipIf(CERTFILE is None, "no certificate to test SSL with")
+    def test_relay_ssl_sock(self):
+        a, b = socket.socketpair()
+        self.addCleanup(b.close)
+        a = get_ssl_contexts()[1].wrap_socket(
+            a, do_handshake_on_connect=False)
+        self.addCleanup(a.close)
+        for sock in (a, b):
+            sock.setblocking(False)
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(zerocopy.aio.relay(self.loop, a, b))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,98 @@
+import json
+import shutil
+import tempfile
+import unittest
+
+from zerocopy.test import mock
+from zerocopy.test import safe_remove
+from zerocopy.test import TESTFN
+
+from zerocopy import bench
+
+
+class TestBench(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def tearDown(self):
+        safe_remove(TESTFN)
+
+    def test_parse_size(self):
+        self.assertEqual(bench.parse_size("0"), 0)
+        self.assertEqual(bench.parse_size("100"), 100)
+        self.assertEqual(bench.parse_size("4K"), 4096)
+        self.assertEqual(bench.parse_size("1mb"), 1024 ** 2)
+        self.assertEqual(bench.parse_size("1.5G"), 3 * 1024 ** 3 // 2)
+        self.assertEqual(bench.format_size(4096), "4K")
+        self.assertEqual(bench.format_size(1000), "1000")
+
+    def test_run(self):
+        results = bench.run(
+            sizes=[0, 65536], dirs=[self.tmpdir],
+            strategies=["copyfile", "readinto"], layouts=("dense", "sparse"),
+            caches=("warm", "cold"), threads=(1, 2), repeat=2)
+        # no sparse empty files
+        self.assertEqual(len(results), 2 * 2 * 2 * 2 + 2 * 2 * 2)
+        for res in results:
+            self.assertEqual(len(res["times"]), 2)
+            self.assertLessEqual(res["min"], res["median"])
+            bench.format_result(res)
+
+    def test_skipped(self):
+        def giveup(src, dst):
+            raise bench._GiveupOnZeroCopy("nope")
+
+        with mock.patch("zerocopy.bench.get_strategies",
+                        return_value={"foo": giveup}):
+            res, = bench.run(sizes=[10], dirs=[self.tmpdir],
+                             strategies=["foo"], repeat=1)
+        self.assertEqual(res["skipped"], "nope")
+        self.assertNotIn("median", res)
+        self.assertIn("skipped", bench.format_result(res))
+
+    def test_compare(self):
+        old = dict(strategy="copyfile", size=1, layout="dense",
+                   cache="warm", threads=1, fstype="ext4", median=1.0)
+        self.assertEqual(bench.compare([dict(old, median=1.05)], [old]), [])
+        # noise
+        self.assertEqual(bench.compare([dict(old, median=0.0009)],
+                                       [dict(old, median=0.0001)]), [])
+        new = dict(old, median=1.5)
+        self.assertEqual(bench.compare([new], [old]), [(new, old, 1.5)])
+        self.assertEqual(bench.compare([new], [old], tolerance=0.6), [])
+        # different fs: not comparable
+        self.assertEqual(bench.compare([dict(new, fstype="tmpfs")], [old]),
+                         [])
+
+    def test_main(self):
+        args = ["--sizes", "4K", "--dir", self.tmpdir, "--strategies",
+                "copyfile", "--repeat", "1", "--json", TESTFN]
+        with mock.patch("sys.stdout"):
+            self.assertEqual(bench.main(args), 0)
+            with open(TESTFN) as f:
+                data = json.load(f)
+            self.assertEqual(len(data["results"]), 1)
+            # compare against itself, made 10 times faster
+            for res in data["results"]:
+                res["median"] /= 10
+            with open(TESTFN, "w") as f:
+                json.dump(data, f)
+            with mock.patch("zerocopy.bench.compare", return_value=[]):
+                self.assertEqual(
+                    bench.main(args[:-2] + ["--baseline", TESTFN]), 0)
+            with mock.patch("zerocopy.bench.compare",
+                            return_value=[(data["results"][0],
+                                           data["results"][0], 10.0)]):
+                self.assertEqual(
+                    bench.main(args[:-2] + ["--baseline", TESTFN]), 1)
+
+    def test_invalid_strategy(self):
+        with mock.patch("sys.stderr"):
+            self.assertRaises(SystemExit, bench.main,
+                              ["--strategies", "nope"])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -4,6 +4,7 @@ import io
 import os
 import shutil
 import tempfile
+import threading
 import unittest
 
 from zerocopy.test import mock
@@ -18,15 +19,28 @@ from zerocopy.test import write_file
 from zerocopy.test import write_test_file
 
 import zerocopy
+from zerocopy._copyfile import _copyfileobj_direct
+from zerocopy._copyfile import _get_bufsize
+from zerocopy._copyfile import _open_dst
+from zerocopy._copyfile import _open_src
 from zerocopy._copyfile import _GiveupOnZeroCopy
+from zerocopy._copyfile import _preallocate
+from zerocopy._copyfile import _zerocopy_copy_file_range
+from zerocopy._copyfile import _zerocopy_copyfd
+from zerocopy._copyfile import _zerocopy_reflink
 from zerocopy._copyfile import _zerocopy_osx
+from zerocopy._copyfile import _zerocopy_parallel
 from zerocopy._copyfile import _zerocopy_sendfile
+from zerocopy._copyfile import _zerocopy_sparse
 from zerocopy._copyfile import _zerocopy_win
+from zerocopy._copytree import scandir
 
 if os.name == 'posix':
     import _zerocopy
+    import fcntl
 else:
     _zerocopy = None
+    fcntl = None
 
 
 def supports_file2file_sendfile():
@@ -59,6 +73,15 @@ def supports_file2file_sendfile():
 
 
 SUPPORTS_SENDFILE = supports_file2file_sendfile()
+HAS_COPY_FILE_RANGE = hasattr(_zerocopy, "copy_file_range")
+HAS_COPYFD = hasattr(_zerocopy, "copyfd")
+HAS_FICLONE = hasattr(_zerocopy, "ficlone")
+HAS_SEEK_HOLE = hasattr(os, "SEEK_DATA")
+HAS_FADVISE = hasattr(os, "posix_fadvise")
+HAS_FALLOCATE = hasattr(_zerocopy, "fallocate")
+HAS_O_DIRECT = hasattr(os, "O_DIRECT") and hasattr(os, "readv")
+HAS_PREAD = hasattr(os, "pread")
+HAS_O_TMPFILE = zerocopy._copyfile.HAS_O_TMPFILE
 
 
 # =====================================================================
@@ -85,6 +108,7 @@ class _ZeroCopyFileTest(object):
 
     def tearDown(self):
         safe_remove(TESTFN2)
+        zerocopy.reset_fs_capabilities()
 
     @contextlib.contextmanager
     def get_files(self):
@@ -170,10 +194,114 @@ class _ZeroCopyFileTest(object):
                 self.assertRaises(OSError, self.zerocopy_fun, src, dst)
 
 
+@unittest.skipIf(not HAS_COPY_FILE_RANGE, 'copy_file_range() not supported')
+class TestZeroCopyCopyFileRange(_ZeroCopyFileTest, unittest.TestCase):
+    PATCHPOINT = "_zerocopy.copy_file_range"
+
+    def zerocopy_fun(self, *args, **kwargs):
+        return _zerocopy_copy_file_range(*args, **kwargs)
+
+    def test_empty_file(self):
+        # copy_file_range() returning 0 on first call is ambiguous
+        # (see procfs) so we're supposed to give up and let the next
+        # strategy do the job.
+        srcname = TESTFN + 'src'
+        dstname = TESTFN + 'dst'
+        self.addCleanup(lambda: safe_remove(srcname))
+        self.addCleanup(lambda: safe_remove(dstname))
+        with open(srcname, "wb"):
+            pass
+
+        with open(srcname, "rb") as src:
+            with open(dstname, "wb") as dst:
+                self.assertRaises(_GiveupOnZeroCopy, self.zerocopy_fun,
+                                  src, dst)
+
+        zerocopy.copyfile(srcname, dstname)
+        self.assertEqual(read_file(dstname, binary=True), b"")
+
+    def test_exception_on_second_call(self):
+        def copy_file_range(*args, **kwargs):
+            if not flag:
+                flag.append(None)
+                return orig_copy_file_range(*args, **kwargs)
+            else:
+                raise OSError(errno.EXDEV, "yo")
+
+        flag = []
+        orig_copy_file_range = _zerocopy.copy_file_range
+        mock_ = mock.Mock()
+        mock_.st_size = 65536 + 1
+        with mock.patch('os.fstat', return_value=mock_):
+            with mock.patch('_zerocopy.copy_file_range', create=True,
+                            side_effect=copy_file_range):
+                with self.get_files() as (src, dst):
+                    with self.assertRaises(OSError) as cm:
+                        _zerocopy_copy_file_range(src, dst)
+        assert flag
+        self.assertEqual(cm.exception.errno, errno.EXDEV)
+
+    def test_enosys(self):
+        with mock.patch(self.PATCHPOINT,
+                        side_effect=OSError(errno.ENOSYS, "yo")) as m:
+            zerocopy.copyfile(TESTFN, TESTFN2)
+            self.assertEqual(m.call_count, 1)
+            # known to not work for this fs pair: not tried again
+            zerocopy.copyfile(TESTFN, TESTFN2)
+            self.assertEqual(m.call_count, 1)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+        caps = list(zerocopy.fs_capabilities().values())
+        self.assertEqual(len(caps), 1)
+        self.assertIs(caps[0]["copy_file_range"], False)
+
+    def test_fallback_on_first_call(self):
+        with mock.patch(self.PATCHPOINT,
+                        side_effect=OSError(errno.EXDEV, "yo")) as m:
+            zerocopy.copyfile(TESTFN, TESTFN2)
+            assert m.called
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    def test_transient_error_not_cached(self):
+        with mock.patch(self.PATCHPOINT,
+                        side_effect=OSError(errno.EIO, "yo")) as m:
+            zerocopy.copyfile(TESTFN, TESTFN2)
+            self.assertEqual(m.call_count, 1)
+            # it may work next time: tried again
+            zerocopy.copyfile(TESTFN, TESTFN2)
+            self.assertEqual(m.call_count, 2)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+        caps = list(zerocopy.fs_capabilities().values())
+        self.assertNotIn("copy_file_range", caps[0])
+
+    def test_eintr(self):
+        def copy_file_range(*args, **kwargs):
+            if not flag:
+                flag.append(None)
+                raise OSError(errno.EINTR, "yo")
+            return orig_copy_file_range(*args, **kwargs)
+
+        flag = []
+        orig_copy_file_range = _zerocopy.copy_file_range
+        with mock.patch(self.PATCHPOINT, side_effect=copy_file_range):
+            zerocopy.copyfile(TESTFN, TESTFN2)
+        assert flag
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+        caps = list(zerocopy.fs_capabilities().values())
+        self.assertEqual(caps, [{"copy_file_range": True}])
+
+
 @unittest.skipIf(not SUPPORTS_SENDFILE, 'sendfile() not supported')
 class TestZeroCopySendfile(_ZeroCopyFileTest, unittest.TestCase):
     PATCHPOINT = "_zerocopy.sendfile"
 
+    def setUp(self):
+        # copy_file_range() and copyfd() are tried first by
+        # copyfile(); disable them.
+        for name in ("HAS_COPY_FILE_RANGE", "HAS_COPYFD"):
+            patcher = mock.patch("zerocopy._copyfile." + name, False)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
     def zerocopy_fun(self, *args, **kwargs):
         return _zerocopy_sendfile(*args, **kwargs)
 
@@ -250,6 +378,1158 @@ class TestZeroCopySendfile(_ZeroCopyFileTest, unittest.TestCase):
             self.assertEqual(blocksize, 2 ** 23)
 
 
+@unittest.skipIf(not (HAS_COPYFD and SUPPORTS_SENDFILE),
+                 'copyfd() not supported')
+class TestZeroCopyCopyfd(_ZeroCopyFileTest, unittest.TestCase):
+    PATCHPOINT = "_zerocopy.copyfd"
+
+    def setUp(self):
+        patcher = mock.patch("zerocopy._copyfile.HAS_COPY_FILE_RANGE", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def zerocopy_fun(self, *args, **kwargs):
+        return _zerocopy_copyfd(*args, **kwargs)
+
+    def test_small_blocksize(self):
+        # the whole loop is in C; make sure it keeps going 'till EOF
+        with self.get_files() as (src, dst):
+            ret = _zerocopy.copyfd(src.fileno(), dst.fileno(), 65536 + 1)
+        self.assertEqual(ret, self.FILESIZE)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    def test_offset(self):
+        with self.get_files() as (src, dst):
+            ret = _zerocopy.copyfd(src.fileno(), dst.fileno(), 8192,
+                                   offset=100)
+        self.assertEqual(ret, self.FILESIZE - 100)
+        self.assertEqual(read_file(TESTFN2, binary=True),
+                         self.FILEDATA[100:])
+
+    def test_exception_leaves_dst_untouched(self):
+        with open(TESTFN, "rb") as src:
+            with self.assertRaises(OSError) as cm:
+                _zerocopy.copyfd(src.fileno(), src.fileno(), 8192)
+            self.assertEqual(src.tell(), 0)
+        self.assertEqual(cm.exception.errno, errno.EBADF)
+
+    def test_enotsock(self):
+        with mock.patch(self.PATCHPOINT,
+                        side_effect=OSError(errno.ENOTSOCK, "yo")) as m:
+            zerocopy.copyfile(TESTFN, TESTFN2)
+            zerocopy.copyfile(TESTFN, TESTFN2)
+            self.assertEqual(m.call_count, 1)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+        caps = list(zerocopy.fs_capabilities().values())
+        self.assertEqual(caps, [{"sendfile": False}])
+
+
+@unittest.skipIf(not HAS_FICLONE, 'FICLONE not supported')
+class TestReflink(unittest.TestCase):
+    PATCHPOINT = "_zerocopy.ficlone"
+
+    @classmethod
+    def setUpClass(cls):
+        write_test_file(TESTFN, 1024 * 1024)
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def tearDown(self):
+        safe_remove(TESTFN2)
+        zerocopy.reset_fs_capabilities()
+
+    def test_unsupported(self):
+        with mock.patch(self.PATCHPOINT,
+                        side_effect=OSError(errno.EOPNOTSUPP, "yo")):
+            with open(TESTFN, "rb") as src:
+                with open(TESTFN2, "wb") as dst:
+                    self.assertRaises(_GiveupOnZeroCopy,
+                                      _zerocopy_reflink, src, dst)
+
+    def test_unhandled_exception(self):
+        with mock.patch(self.PATCHPOINT,
+                        side_effect=OSError(errno.EIO, "yo")):
+            with open(TESTFN, "rb") as src:
+                with open(TESTFN2, "wb") as dst:
+                    with self.assertRaises(OSError) as cm:
+                        _zerocopy_reflink(src, dst)
+        self.assertEqual(cm.exception.errno, errno.EIO)
+
+    def test_copyfile_auto_fallback(self):
+        with mock.patch(self.PATCHPOINT,
+                        side_effect=OSError(errno.EXDEV, "yo")) as m:
+            zerocopy.copyfile(TESTFN, TESTFN2, reflink="auto")
+            assert m.called
+        self.assertEqual(read_file(TESTFN2, binary=True),
+                         read_file(TESTFN, binary=True))
+
+    def test_copyfile_auto_cached(self):
+        with mock.patch(self.PATCHPOINT,
+                        side_effect=OSError(errno.EXDEV, "yo")) as m:
+            zerocopy.copyfile(TESTFN, TESTFN2, reflink="auto")
+            zerocopy.copyfile(TESTFN, TESTFN2, reflink="auto")
+            self.assertEqual(m.call_count, 1)
+            # reflink=True does not rely on the cache
+            self.assertRaises(OSError, zerocopy.cowcopy, TESTFN, TESTFN2)
+            self.assertEqual(m.call_count, 2)
+
+    def test_copyfile_auto(self):
+        with mock.patch(self.PATCHPOINT) as m:
+            zerocopy.copyfile(TESTFN, TESTFN2, reflink="auto")
+            assert m.called
+        with mock.patch(self.PATCHPOINT) as m:
+            zerocopy.copyfile(TESTFN, TESTFN2)
+            assert not m.called
+
+    def test_cowcopy_unsupported(self):
+        with mock.patch(self.PATCHPOINT,
+                        side_effect=OSError(errno.EOPNOTSUPP, "yo")):
+            with self.assertRaises(OSError) as cm:
+                zerocopy.cowcopy(TESTFN, TESTFN2)
+        self.assertEqual(cm.exception.errno, errno.EOPNOTSUPP)
+        self.assertFalse(os.path.exists(TESTFN2))
+        # an existing dst is left untouched
+        write_file(TESTFN2, b"hello", binary=True)
+        with mock.patch(self.PATCHPOINT,
+                        side_effect=OSError(errno.EOPNOTSUPP, "yo")):
+            self.assertRaises(OSError, zerocopy.cowcopy, TESTFN, TESTFN2)
+        self.assertEqual(read_file(TESTFN2, binary=True), b"hello")
+
+    def test_offset(self):
+        # dst offset is left at EOF, as with the other strategies
+        def ficlone(infd, outfd):
+            os.write(outfd, os.read(infd, 1024 * 1024))
+            os.lseek(outfd, 0, os.SEEK_SET)
+
+        with mock.patch(self.PATCHPOINT, side_effect=ficlone):
+            with open(TESTFN, "rb") as src:
+                with open(TESTFN2, "wb") as dst:
+                    _zerocopy_reflink(src, dst)
+                    self.assertEqual(dst.tell(), 1024 * 1024)
+
+    def test_cowcopy(self):
+        try:
+            zerocopy.cowcopy(TESTFN, TESTFN2)
+        except OSError as err:
+            if err.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                             errno.EINVAL):
+                raise unittest.SkipTest("reflink not supported by fs")
+            raise
+        self.assertEqual(read_file(TESTFN2, binary=True),
+                         read_file(TESTFN, binary=True))
+
+    def test_invalid_arg(self):
+        self.assertRaises(ValueError, zerocopy.copyfile, TESTFN, TESTFN2,
+                          reflink="foo")
+
+
+class TestReflinkNotSupported(unittest.TestCase):
+
+    def setUp(self):
+        write_file(TESTFN, b"hello", binary=True)
+
+    def tearDown(self):
+        safe_remove(TESTFN)
+        safe_remove(TESTFN2)
+
+    def test_auto(self):
+        # e.g. OSX: fallback on a regular copy
+        with mock.patch("zerocopy._copyfile.HAS_FICLONE", False):
+            zerocopy.copyfile(TESTFN, TESTFN2, reflink="auto")
+        self.assertEqual(read_file(TESTFN2, binary=True), b"hello")
+
+    def test_cowcopy(self):
+        with mock.patch("zerocopy._copyfile.HAS_FICLONE", False):
+            with self.assertRaises(OSError) as cm:
+                zerocopy.cowcopy(TESTFN, TESTFN2)
+        self.assertEqual(cm.exception.errno, errno.ENOTSUP)
+        self.assertFalse(os.path.exists(TESTFN2))
+
+
+@unittest.skipIf(not HAS_SEEK_HOLE, 'SEEK_DATA / SEEK_HOLE not supported')
+class TestSparse(unittest.TestCase):
+    FILESIZE = 64 * 1024 * 1024
+    # (offset, data) tuples; everything else is a hole
+    EXTENTS = [(1024 * 1024, b"x" * 65536),
+               (32 * 1024 * 1024, b"y" * 65536 * 2)]
+
+    @classmethod
+    def setUpClass(cls):
+        with open(TESTFN, "wb") as f:
+            for offset, data in cls.EXTENTS:
+                f.seek(offset)
+                f.write(data)
+            f.truncate(cls.FILESIZE)
+        with open(TESTFN, "rb") as f:
+            cls.FILEDATA = f.read()
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def tearDown(self):
+        safe_remove(TESTFN2)
+
+    def assert_sparse_copy(self):
+        zerocopy.copyfile(TESTFN, TESTFN2, sparse=True)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+        st = os.stat(TESTFN2)
+        self.assertEqual(st.st_size, self.FILESIZE)
+        if os.stat(TESTFN).st_blocks * 512 < self.FILESIZE:
+            # src is actually sparse on this fs; so should be dst
+            self.assertLess(st.st_blocks * 512, self.FILESIZE // 2)
+
+    def test_copy(self):
+        self.assert_sparse_copy()
+
+    def test_copy_sendfile(self):
+        with mock.patch("zerocopy._copyfile.HAS_COPY_FILE_RANGE", False):
+            self.assert_sparse_copy()
+
+    def test_copy_pread_pwrite(self):
+        with mock.patch("zerocopy._copyfile.HAS_COPY_FILE_RANGE", False):
+            with mock.patch("zerocopy._copyfile.HAS_SENDFILE", False):
+                self.assert_sparse_copy()
+
+    def test_trailing_data(self):
+        with open(TESTFN2 + "src", "wb") as f:
+            f.seek(4096 * 10)
+            f.write(b"z" * 100)
+        self.addCleanup(safe_remove, TESTFN2 + "src")
+        zerocopy.copyfile(TESTFN2 + "src", TESTFN2, sparse=True)
+        self.assertEqual(read_file(TESTFN2, binary=True),
+                         read_file(TESTFN2 + "src", binary=True))
+
+    def test_empty_file(self):
+        with open(TESTFN2 + "src", "wb"):
+            pass
+        self.addCleanup(safe_remove, TESTFN2 + "src")
+        zerocopy.copyfile(TESTFN2 + "src", TESTFN2, sparse=True)
+        self.assertEqual(read_file(TESTFN2, binary=True), b"")
+
+    def test_seek_data_unsupported(self):
+        orig_lseek = os.lseek
+
+        def lseek(fd, pos, how):
+            if how == os.SEEK_DATA:
+                raise OSError(errno.EINVAL, "yo")
+            return orig_lseek(fd, pos, how)
+
+        with mock.patch("os.lseek", side_effect=lseek):
+            with open(TESTFN, "rb") as src:
+                with open(TESTFN2, "wb") as dst:
+                    self.assertRaises(_GiveupOnZeroCopy,
+                                      _zerocopy_sparse, src, dst)
+            zerocopy.copyfile(TESTFN, TESTFN2, sparse=True)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+
+@unittest.skipIf(not HAS_COPY_FILE_RANGE, 'copy_file_range() not supported')
+class TestParallel(unittest.TestCase):
+    FILESIZE = (10 * 1024 * 1024) + (8192 * 3)
+
+    @classmethod
+    def setUpClass(cls):
+        write_test_file(TESTFN, cls.FILESIZE)
+        cls.FILEDATA = read_file(TESTFN, binary=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def setUp(self):
+        patcher = mock.patch("zerocopy._copyfile._PARALLEL_MIN_CHUNKSIZE",
+                             65536)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        safe_remove(TESTFN2)
+        zerocopy.reset_fs_capabilities()
+
+    def test_copy(self):
+        for workers in (2, 3, 8):
+            zerocopy.copyfile(TESTFN, TESTFN2, workers=workers)
+            self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    def test_ranges(self):
+        with mock.patch("zerocopy._copyfile._copy_file_range_at",
+                        wraps=zerocopy._copyfile._copy_file_range_at) as m:
+            zerocopy.copyfile(TESTFN, TESTFN2, workers=4)
+        # 1 probe + 4 ranges
+        self.assertEqual(m.call_count, 5)
+        offsets = sorted(c[0][2] for c in m.call_args_list)
+        self.assertEqual(offsets[0], 0)
+        self.assertEqual(sum(c[0][3] for c in m.call_args_list[1:]),
+                         self.FILESIZE - 65536)
+
+    @unittest.skipIf(not HAS_FALLOCATE, 'fallocate() not supported')
+    def test_preallocate(self):
+        # dst is only sized, unless preallocate=True
+        with mock.patch("_zerocopy.fallocate") as m1:
+            with mock.patch("os.ftruncate", side_effect=os.ftruncate) as m2:
+                zerocopy.copyfile(TESTFN, TESTFN2, workers=4)
+        self.assertFalse(m1.called)
+        self.assertIn(mock.call(mock.ANY, self.FILESIZE), m2.call_args_list)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+        with mock.patch("_zerocopy.fallocate",
+                        side_effect=_zerocopy.fallocate) as m:
+            zerocopy.copyfile(TESTFN, TESTFN2, workers=4, preallocate=True)
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    def test_small_file(self):
+        with open(TESTFN, "rb") as src:
+            with open(TESTFN2, "wb") as dst:
+                with mock.patch("zerocopy._copyfile._PARALLEL_MIN_CHUNKSIZE",
+                                self.FILESIZE):
+                    self.assertRaises(_GiveupOnZeroCopy,
+                                      _zerocopy_parallel, src, dst, 4)
+
+    def test_fallback_on_first_call(self):
+        with mock.patch("_zerocopy.copy_file_range",
+                        side_effect=OSError(errno.EXDEV, "yo")):
+            with open(TESTFN, "rb") as src:
+                with open(TESTFN2, "wb") as dst:
+                    self.assertRaises(_GiveupOnZeroCopy,
+                                      _zerocopy_parallel, src, dst, 4)
+            zerocopy.copyfile(TESTFN, TESTFN2, workers=4)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    def test_exception_in_worker(self):
+        def copy_file_range(*args, **kwargs):
+            if kwargs["offset_src"] == 0:
+                return orig_copy_file_range(*args, **kwargs)
+            raise OSError(errno.EIO, "yo")
+
+        orig_copy_file_range = _zerocopy.copy_file_range
+        with mock.patch("_zerocopy.copy_file_range",
+                        side_effect=copy_file_range):
+            with self.assertRaises(OSError) as cm:
+                zerocopy.copyfile(TESTFN, TESTFN2, workers=4)
+        self.assertEqual(cm.exception.errno, errno.EIO)
+
+    def test_invalid_arg(self):
+        self.assertRaises(ValueError, zerocopy.copyfile, TESTFN, TESTFN2,
+                          workers=0)
+
+
+class TestCopyMany(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def test_copy(self):
+        pairs = []
+        for i in range(50):
+            src = self.path("src%s" % i)
+            write_file(src, b"x" * i * 1000, binary=True)
+            pairs.append((src, self.path("dst%s" % i)))
+        ret = zerocopy.copy_many(iter(pairs))
+        self.assertEqual(ret, [dst for src, dst in pairs])
+        for src, dst in pairs:
+            self.assertEqual(read_file(src, binary=True),
+                             read_file(dst, binary=True))
+
+    def test_errors(self):
+        src = self.path("src")
+        write_file(src, b"hello", binary=True)
+        pairs = [
+            (self.path("nope"), self.path("dst1")),
+            (src, self.path("nodir/dst2")),
+            (src, src),
+            (src, self.path("dst3")),
+        ]
+        ret = zerocopy.copy_many(pairs)
+        self.assertEqual(len(ret), 4)
+        self.assertIsInstance(ret[0], EnvironmentError)
+        self.assertEqual(ret[0].errno, errno.ENOENT)
+        self.assertEqual(ret[0].filename, self.path("nope"))
+        self.assertIsInstance(ret[1], EnvironmentError)
+        self.assertEqual(ret[1].errno, errno.ENOENT)
+        self.assertEqual(ret[1].filename, self.path("nodir/dst2"))
+        self.assertIsInstance(ret[2], zerocopy.SameFileError)
+        # errors do not interrupt the batch
+        self.assertEqual(ret[3], self.path("dst3"))
+        self.assertEqual(read_file(self.path("dst3"), binary=True),
+                         b"hello")
+
+    @unittest.skipIf(not hasattr(os, "mkfifo"), "mkfifo() not supported")
+    def test_fifo(self):
+        fifo = self.path("fifo")
+        os.mkfifo(fifo)
+        src = self.path("src")
+        write_file(src, b"hello", binary=True)
+        ret = zerocopy.copy_many([(fifo, self.path("dst")), (src, fifo)])
+        self.assertIsInstance(ret[0], zerocopy.SpecialFileError)
+        self.assertIn(fifo, str(ret[0]))
+        self.assertIsInstance(ret[1], zerocopy.SpecialFileError)
+
+    def test_empty_file(self):
+        src = self.path("src")
+        write_file(src, b"", binary=True)
+        ret = zerocopy.copy_many([(src, self.path("dst"))])
+        self.assertEqual(ret, [self.path("dst")])
+        self.assertEqual(read_file(self.path("dst"), binary=True), b"")
+
+
+class TestCopyManyFallback(TestCopyMany):
+    """Same as above, but using the pure-python copyfile() loop."""
+
+    def setUp(self):
+        TestCopyMany.setUp(self)
+        patcher = mock.patch("zerocopy._copyfile.HAS_COPY_MANY", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+@unittest.skipIf(WINDOWS, 'POSIX only')
+class TestReadWriteFallback(unittest.TestCase):
+    FILESIZE = (10 * 1024 * 1024) + (8192 * 3)
+
+    @classmethod
+    def setUpClass(cls):
+        write_test_file(TESTFN, cls.FILESIZE)
+        cls.FILEDATA = read_file(TESTFN, binary=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def setUp(self):
+        # disable zero-copy syscalls
+        for name in ("HAS_COPY_FILE_RANGE", "HAS_COPYFD", "HAS_SENDFILE",
+                     "HAS_FCOPYFILE"):
+            patcher = mock.patch("zerocopy._copyfile." + name, False)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        safe_remove(TESTFN2)
+
+    def test_readinto(self):
+        with mock.patch("shutil.copyfileobj") as m:
+            zerocopy.copyfile(TESTFN, TESTFN2)
+        self.assertFalse(m.called)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    def test_small_file(self):
+        write_file(TESTFN2, b"hello", binary=True)
+        zerocopy.copyfile(TESTFN2, TESTFN2 + "3")
+        self.addCleanup(safe_remove, TESTFN2 + "3")
+        self.assertEqual(read_file(TESTFN2 + "3", binary=True), b"hello")
+
+    def test_buffer_reused(self):
+        zerocopy.copyfile(TESTFN, TESTFN2)
+        buf = zerocopy._copyfile._tls.buf
+        zerocopy.copyfile(TESTFN, TESTFN2)
+        self.assertIs(zerocopy._copyfile._tls.buf, buf)
+        # each thread has its own buffer
+        bufs = []
+        t = threading.Thread(target=lambda: (
+            zerocopy.copyfile(TESTFN, TESTFN2),
+            bufs.append(zerocopy._copyfile._tls.buf)))
+        t.start()
+        t.join()
+        self.assertIsNot(bufs[0], buf)
+
+    def test_bufsize(self):
+        self.assertEqual(_get_bufsize(), 2 ** 20)
+        self.assertEqual(_get_bufsize(None, 4096), 2 ** 20)
+        self.assertEqual(_get_bufsize(10 * 2 ** 20, 4096), 2 ** 20)
+        self.assertEqual(_get_bufsize(100, 4096), 4096)
+        self.assertEqual(_get_bufsize(4096, 4096), 8192)
+        # rounded to a multiple of block size
+        self.assertEqual(_get_bufsize(None, 3 * 2 ** 16), 5 * 3 * 2 ** 16)
+        self.assertEqual(_get_bufsize(None, 2 ** 22), 2 ** 22)
+
+    @unittest.skipIf(not PY3, "Python 3 only")
+    def test_mmap(self):
+        with mock.patch("zerocopy._copyfile._copyfileobj_mmap",
+                        wraps=zerocopy._copyfile._copyfileobj_mmap) as m:
+            zerocopy.copyfile(TESTFN, TESTFN2, use_mmap=True)
+        self.assertTrue(m.called)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    def test_mmap_small_file(self):
+        write_file(TESTFN2, b"hello", binary=True)
+        self.addCleanup(safe_remove, TESTFN2 + "3")
+        with mock.patch("mmap.mmap") as m:
+            zerocopy.copyfile(TESTFN2, TESTFN2 + "3", use_mmap=True)
+        self.assertFalse(m.called)
+        self.assertEqual(read_file(TESTFN2 + "3", binary=True), b"hello")
+
+
+@unittest.skipIf(WINDOWS, 'POSIX only')
+class TestCopyfileChecks(unittest.TestCase):
+
+    def setUp(self):
+        write_file(TESTFN, b"hello", binary=True)
+
+    def tearDown(self):
+        safe_remove(TESTFN)
+        safe_remove(TESTFN2)
+
+    def count_stat_calls(self, **kwargs):
+        with mock.patch("os.stat", wraps=os.stat) as m1:
+            with mock.patch("os.fstat", wraps=os.fstat) as m2:
+                with mock.patch("os.path.samefile") as m3:
+                    zerocopy.copyfile(TESTFN, TESTFN2, **kwargs)
+        self.assertFalse(m3.called)
+        self.assertEqual(read_file(TESTFN2, binary=True), b"hello")
+        return m1.call_count + m2.call_count
+
+    def test_stat_calls(self):
+        # 1 fstat() for src and 1 for dst
+        self.assertEqual(self.count_stat_calls(), 2)
+
+    def test_src_stat(self):
+        self.assertEqual(self.count_stat_calls(src_stat=os.stat(TESTFN)), 1)
+
+    def test_src_stat_direntry(self):
+        entry = [x for x in scandir(".") if x.name == TESTFN][0]
+        entry.stat()  # cached
+        self.assertEqual(self.count_stat_calls(src_stat=entry), 1)
+
+    def test_src_stat_symlink(self):
+        os.symlink(TESTFN, TESTFN + "link")
+        self.addCleanup(safe_remove, TESTFN + "link")
+        entry = [x for x in scandir(".") if x.name == TESTFN + "link"][0]
+        zerocopy.copyfile(TESTFN + "link", TESTFN2, follow_symlinks=False,
+                          src_stat=entry)
+        self.assertTrue(os.path.islink(TESTFN2))
+
+    def test_same_file(self):
+        os.link(TESTFN, TESTFN2)
+        self.assertRaises(zerocopy.SameFileError, zerocopy.copyfile,
+                          TESTFN, TESTFN2)
+        self.assertRaises(zerocopy.SameFileError, zerocopy.copyfile,
+                          TESTFN, TESTFN)
+        # dst was not truncated
+        self.assertEqual(read_file(TESTFN, binary=True), b"hello")
+
+    def test_truncate_dst(self):
+        write_file(TESTFN2, b"x" * 100, binary=True)
+        zerocopy.copyfile(TESTFN, TESTFN2)
+        self.assertEqual(read_file(TESTFN2, binary=True), b"hello")
+
+    def test_regular_files_are_blocking(self):
+        import fcntl
+
+        def assert_blocking(f):
+            with f:
+                flags = fcntl.fcntl(f.fileno(), fcntl.F_GETFL)
+                self.assertFalse(flags & os.O_NONBLOCK)
+
+        fsrc, st = _open_src(TESTFN)
+        assert_blocking(fsrc)
+        assert_blocking(_open_dst(TESTFN, TESTFN2, st)[0])  # new
+        assert_blocking(_open_dst(TESTFN, TESTFN2, st)[0])  # existing
+
+    def test_lease(self):
+        # A non-blocking open() of a file leased by another process
+        # fails with EWOULDBLOCK: it's re-opened in blocking mode.
+        def open_(path, flags, *args):
+            if flags & os.O_NONBLOCK:
+                raise OSError(errno.EWOULDBLOCK, "yo")
+            return orig_open(path, flags, *args)
+
+        orig_open = os.open
+        write_file(TESTFN2, b"x" * 100, binary=True)
+        with mock.patch("os.open", side_effect=open_) as m:
+            zerocopy.copyfile(TESTFN, TESTFN2)
+        self.assertEqual(m.call_count, 4)
+        self.assertEqual(read_file(TESTFN2, binary=True), b"hello")
+
+    def test_fifo(self):
+        os.mkfifo(TESTFN2)
+        self.assertRaises(zerocopy.SpecialFileError, zerocopy.copyfile,
+                          TESTFN2, TESTFN + "dst")
+        # no reader
+        self.assertRaises(zerocopy.SpecialFileError, zerocopy.copyfile,
+                          TESTFN, TESTFN2)
+        # with a reader
+        fd = os.open(TESTFN2, os.O_RDONLY | os.O_NONBLOCK)
+        self.addCleanup(os.close, fd)
+        self.assertRaises(zerocopy.SpecialFileError, zerocopy.copyfile,
+                          TESTFN, TESTFN2)
+        self.assertFalse(os.path.exists(TESTFN + "dst"))
+
+
+class TestFsCapabilities(unittest.TestCase):
+
+    def setUp(self):
+        write_test_file(TESTFN, 65536)
+        zerocopy.reset_fs_capabilities()
+
+    def tearDown(self):
+        safe_remove(TESTFN)
+        safe_remove(TESTFN2)
+        zerocopy.reset_fs_capabilities()
+
+    @unittest.skipIf(not HAS_COPY_FILE_RANGE,
+                     'copy_file_range() not supported')
+    def test_working_strategy(self):
+        zerocopy.copyfile(TESTFN, TESTFN2)
+        dev = os.stat(TESTFN).st_dev
+        self.assertEqual(zerocopy.fs_capabilities(),
+                         {(dev, dev): {"copy_file_range": True}})
+
+    def test_empty_file(self):
+        # copying an empty file tells nothing about the filesystem
+        safe_remove(TESTFN)
+        write_file(TESTFN, b"", binary=True)
+        zerocopy.copyfile(TESTFN, TESTFN2)
+        self.assertEqual(zerocopy.fs_capabilities(), {})
+
+    def test_reset(self):
+        with mock.patch("zerocopy._copyfile._fs_caps", {(1, 2): {}}):
+            self.assertEqual(zerocopy.fs_capabilities(), {(1, 2): {}})
+            zerocopy.reset_fs_capabilities()
+            self.assertEqual(zerocopy.fs_capabilities(), {})
+
+
+class TestProgress(unittest.TestCase):
+    FILESIZE = (10 * 1024 * 1024) + (8192 * 3)
+    CHUNKSIZE = 1024 * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        write_test_file(TESTFN, cls.FILESIZE)
+        cls.FILEDATA = read_file(TESTFN, binary=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def tearDown(self):
+        safe_remove(TESTFN2)
+        zerocopy.reset_fs_capabilities()
+
+    def copy(self, **kwargs):
+        calls = []
+        zerocopy.copyfile(TESTFN, TESTFN2, chunksize=self.CHUNKSIZE,
+                          progress=lambda *args: calls.append(args),
+                          **kwargs)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+        self.assertGreaterEqual(len(calls), self.FILESIZE // self.CHUNKSIZE)
+        self.assertEqual(calls[-1], (self.FILESIZE, self.FILESIZE))
+        copied = [x[0] for x in calls]
+        self.assertEqual(copied, sorted(set(copied)))
+        return calls
+
+    def test_progress(self):
+        self.copy()
+
+    def test_progress_reflink(self):
+        # a clone engine leaving file offsets untouched: reported once
+        # done
+        def clone(fsrc, fdst):
+            os.write(fdst.fileno(), os.read(fsrc.fileno(), self.FILESIZE))
+            os.lseek(fdst.fileno(), 0, os.SEEK_SET)
+
+        calls = []
+        with mock.patch("zerocopy._copyfile.HAS_FICLONE", True):
+            with mock.patch("zerocopy._copyfile._zerocopy_reflink",
+                            side_effect=clone):
+                zerocopy.copyfile(TESTFN, TESTFN2, reflink="auto",
+                                  progress=lambda *args: calls.append(args))
+        self.assertEqual(calls, [(self.FILESIZE, self.FILESIZE)])
+
+    @unittest.skipIf(not SUPPORTS_SENDFILE, 'sendfile() not supported')
+    def test_progress_sendfile(self):
+        # copyfd() copies the whole file in one call: not used
+        with mock.patch("zerocopy._copyfile.HAS_COPY_FILE_RANGE", False):
+            with mock.patch("zerocopy._copyfile._zerocopy_copyfd") as m:
+                self.copy()
+        self.assertFalse(m.called)
+
+    @unittest.skipIf(WINDOWS, 'POSIX only')
+    def test_progress_readinto(self):
+        with mock.patch("zerocopy._copyfile.HAS_COPY_FILE_RANGE", False):
+            with mock.patch("zerocopy._copyfile.HAS_SENDFILE", False):
+                self.copy()
+                if PY3:
+                    self.copy(use_mmap=True)
+
+    @unittest.skipIf(not HAS_SEEK_HOLE, 'SEEK_DATA / SEEK_HOLE not supported')
+    def test_progress_sparse(self):
+        self.copy(sparse=True)
+
+    @unittest.skipIf(not HAS_COPY_FILE_RANGE,
+                     'copy_file_range() not supported')
+    def test_progress_parallel(self):
+        with mock.patch("zerocopy._copyfile._PARALLEL_MIN_CHUNKSIZE",
+                        self.CHUNKSIZE):
+            self.copy(workers=4)
+
+    def test_empty_file(self):
+        calls = []
+        with open(TESTFN2 + "src", "wb"):
+            pass
+        self.addCleanup(safe_remove, TESTFN2 + "src")
+        zerocopy.copyfile(TESTFN2 + "src", TESTFN2,
+                          progress=lambda *args: calls.append(args))
+        self.assertEqual(calls, [(0, 0)])
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        calls = []
+
+        def progress(copied, total):
+            calls.append(copied)
+            cancel.set()
+
+        self.assertRaises(zerocopy.CopyCancelledError, zerocopy.copyfile,
+                          TESTFN, TESTFN2, chunksize=self.CHUNKSIZE,
+                          progress=progress, cancel=cancel)
+        self.assertEqual(len(calls), 1)
+        self.assertLess(calls[0], self.FILESIZE)
+        self.assertFalse(os.path.exists(TESTFN2))
+
+    def test_cancel_before_start(self):
+        cancel = threading.Event()
+        cancel.set()
+        self.assertRaises(zerocopy.CopyCancelledError, zerocopy.copyfile,
+                          TESTFN, TESTFN2, cancel=cancel)
+        self.assertFalse(os.path.exists(TESTFN2))
+
+    def test_cancel_not_set(self):
+        zerocopy.copyfile(TESTFN, TESTFN2, cancel=threading.Event(),
+                          chunksize=self.CHUNKSIZE)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    def test_cancel_stats(self):
+        cancel = threading.Event()
+        cancel.set()
+        stats = zerocopy.CopyStats()
+        self.assertRaises(zerocopy.CopyCancelledError, zerocopy.copyfile,
+                          TESTFN, TESTFN2, cancel=cancel, stats=stats)
+        self.assertIsInstance(stats.error, zerocopy.CopyCancelledError)
+
+    def test_invalid_args(self):
+        self.assertRaises(ValueError, zerocopy.copyfile, TESTFN, TESTFN2,
+                          chunksize=0)
+
+
+@unittest.skipIf(not HAS_FADVISE, 'posix_fadvise() not supported')
+class TestCacheBypass(unittest.TestCase):
+    FILESIZE = (10 * 1024 * 1024) + (8192 * 3) + 123
+    CHUNKSIZE = 1024 * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        # unaligned size: O_DIRECT can't be used for the last chunk
+        write_test_file(TESTFN, cls.FILESIZE - 123)
+        with open(TESTFN, "ab") as f:
+            f.write(b"x" * 123)
+        cls.FILEDATA = read_file(TESTFN, binary=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def tearDown(self):
+        safe_remove(TESTFN2)
+        zerocopy.reset_fs_capabilities()
+
+    def copy(self, cache):
+        stats = zerocopy.CopyStats()
+        zerocopy.copyfile(TESTFN, TESTFN2, cache=cache, stats=stats,
+                          chunksize=self.CHUNKSIZE)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+        return stats
+
+    def test_bypass(self):
+        with mock.patch("os.posix_fadvise",
+                        side_effect=os.posix_fadvise) as m:
+            self.copy("bypass")
+        fds = set(x[0][0] for x in m.call_args_list)
+        self.assertEqual(len(fds), 2)  # src and dst
+        self.assertGreaterEqual(m.call_count,
+                                self.FILESIZE // self.CHUNKSIZE)
+        for args, _ in m.call_args_list:
+            self.assertEqual(args[3], os.POSIX_FADV_DONTNEED)
+
+    def test_bypass_no_sync_file_range(self):
+        with mock.patch("zerocopy._copyfile.HAS_SYNC_FILE_RANGE", False):
+            with mock.patch("os.fdatasync", side_effect=os.fdatasync) as m:
+                self.copy("bypass")
+        self.assertTrue(m.called)
+
+    def test_bypass_progress(self):
+        calls = []
+        zerocopy.copyfile(TESTFN, TESTFN2, cache="bypass",
+                          chunksize=self.CHUNKSIZE,
+                          progress=lambda *args: calls.append(args))
+        self.assertEqual(calls[-1], (self.FILESIZE, self.FILESIZE))
+
+    @unittest.skipIf(not HAS_O_DIRECT, 'O_DIRECT not supported')
+    def test_direct(self):
+        stats = self.copy("direct")
+        if stats.fallbacks:
+            # the filesystem does not support O_DIRECT
+            self.assertEqual(stats.fallbacks[0][0], "direct")
+        else:
+            self.assertEqual(stats.strategy, "direct")
+
+    @unittest.skipIf(not HAS_O_DIRECT, 'O_DIRECT not supported')
+    def test_direct_fallback(self):
+        with mock.patch("os.readv",
+                        side_effect=OSError(errno.EINVAL, "yo")):
+            stats = self.copy("direct")
+        self.assertEqual(stats.fallbacks[0][0], "direct")
+        self.assertNotEqual(stats.strategy, "direct")
+
+    @unittest.skipIf(not HAS_O_DIRECT, 'O_DIRECT not supported')
+    def test_direct_flags_restored(self):
+        with open(TESTFN, "rb") as src:
+            with open(TESTFN2, "wb") as dst:
+                flags = [fcntl.fcntl(f.fileno(), fcntl.F_GETFL)
+                         for f in (src, dst)]
+                try:
+                    _copyfileobj_direct(src, dst)
+                except _GiveupOnZeroCopy:
+                    pass
+                self.assertEqual(
+                    [fcntl.fcntl(f.fileno(), fcntl.F_GETFL)
+                     for f in (src, dst)], flags)
+
+    def test_invalid_args(self):
+        self.assertRaises(ValueError, zerocopy.copyfile, TESTFN, TESTFN2,
+                          cache="foo")
+
+
+@unittest.skipIf(WINDOWS, 'POSIX only')
+class TestPreallocate(unittest.TestCase):
+    FILESIZE = (1024 * 1024) + (8192 * 3)
+
+    @classmethod
+    def setUpClass(cls):
+        write_test_file(TESTFN, cls.FILESIZE)
+        cls.FILEDATA = read_file(TESTFN, binary=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def tearDown(self):
+        safe_remove(TESTFN2)
+        zerocopy.reset_fs_capabilities()
+
+    def copy(self, **kwargs):
+        zerocopy.copyfile(TESTFN, TESTFN2, preallocate=True, **kwargs)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    @unittest.skipIf(not HAS_FALLOCATE, 'fallocate() not supported')
+    def test_fallocate(self):
+        with mock.patch("_zerocopy.fallocate",
+                        side_effect=_zerocopy.fallocate) as m:
+            self.copy()
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(m.call_args[0][1:],
+                         (_zerocopy.FALLOC_FL_KEEP_SIZE, 0, self.FILESIZE))
+
+    @unittest.skipIf(not hasattr(os, "posix_fallocate"),
+                     'posix_fallocate() not supported')
+    def test_posix_fallocate(self):
+        with mock.patch("zerocopy._copyfile.HAS_FALLOCATE", False):
+            with mock.patch("zerocopy._copyfile.HAS_POSIX_FALLOCATE", True):
+                with mock.patch("os.posix_fallocate",
+                                side_effect=os.posix_fallocate) as m:
+                    self.copy()
+        self.assertEqual(m.call_count, 1)
+
+    @unittest.skipIf(not HAS_FALLOCATE, 'fallocate() not supported')
+    def test_enospc(self):
+        with mock.patch("_zerocopy.fallocate",
+                        side_effect=OSError(errno.ENOSPC, "yo")):
+            with self.assertRaises(OSError) as cm:
+                zerocopy.copyfile(TESTFN, TESTFN2, preallocate=True)
+        self.assertEqual(cm.exception.errno, errno.ENOSPC)
+        # failed before copying any data
+        self.assertEqual(os.path.getsize(TESTFN2), 0)
+
+    @unittest.skipIf(not HAS_FALLOCATE, 'fallocate() not supported')
+    def test_unsupported(self):
+        # fallback on checking free space
+        with mock.patch("_zerocopy.fallocate",
+                        side_effect=OSError(errno.EOPNOTSUPP, "yo")):
+            self.copy()
+            with mock.patch("os.fstatvfs",
+                            return_value=mock.Mock(f_bavail=1, f_frsize=512)):
+                with self.assertRaises(OSError) as cm:
+                    zerocopy.copyfile(TESTFN, TESTFN2, preallocate=True)
+        self.assertEqual(cm.exception.errno, errno.ENOSPC)
+        self.assertEqual(os.path.getsize(TESTFN2), 0)
+
+    @unittest.skipIf(not HAS_FALLOCATE, 'fallocate() not supported')
+    def test_not_by_default(self):
+        with mock.patch("_zerocopy.fallocate") as m:
+            zerocopy.copyfile(TESTFN, TESTFN2)
+        self.assertFalse(m.called)
+
+    @unittest.skipIf(not HAS_FALLOCATE, 'fallocate() not supported')
+    @unittest.skipIf(not HAS_SEEK_HOLE,
+                     'SEEK_DATA / SEEK_HOLE not supported')
+    def test_not_with_sparse(self):
+        with mock.patch("_zerocopy.fallocate") as m:
+            zerocopy.copyfile(TESTFN, TESTFN2, preallocate=True,
+                              sparse=True)
+        self.assertFalse(m.called)
+
+    @unittest.skipIf(not hasattr(os, "posix_fallocate"),
+                     'posix_fallocate() not supported')
+    def test_src_shrinks(self):
+        # dst is as big as what was actually copied
+        def copy(fsrc, fdst, **kwargs):
+            _preallocate(fdst, self.FILESIZE)
+            self.assertEqual(os.fstat(fdst.fileno()).st_size, self.FILESIZE)
+            fdst.write(fsrc.read(1000))
+
+        with mock.patch("zerocopy._copyfile.HAS_FALLOCATE", False):
+            with mock.patch("zerocopy._copyfile.HAS_POSIX_FALLOCATE", True):
+                with mock.patch("zerocopy._copyfile._copyfileobj2",
+                                side_effect=copy):
+                    zerocopy.copyfile(TESTFN, TESTFN2, preallocate=True)
+        self.assertEqual(read_file(TESTFN2, binary=True),
+                         self.FILEDATA[:1000])
+
+    def test_reflink(self):
+        # a clone engine leaving file offsets untouched: dst is not
+        # truncated
+        def clone(fsrc, fdst):
+            os.write(fdst.fileno(), os.read(fsrc.fileno(), self.FILESIZE))
+            os.lseek(fdst.fileno(), 0, os.SEEK_SET)
+
+        with mock.patch("zerocopy._copyfile.HAS_FICLONE", True):
+            with mock.patch("zerocopy._copyfile._zerocopy_reflink",
+                            side_effect=clone) as m:
+                zerocopy.copyfile(TESTFN, TESTFN2, reflink="auto",
+                                  preallocate=True)
+        self.assertTrue(m.called)
+        self.assertEqual(os.path.getsize(TESTFN2), self.FILESIZE)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+
+@unittest.skipIf(WINDOWS or not HAS_PREAD, 'POSIX + Python 3 only')
+class TestDelta(unittest.TestCase):
+    FILESIZE = (1024 * 1024) + (8192 * 3)
+    BLOCKSIZE = 65536
+
+    @classmethod
+    def setUpClass(cls):
+        write_test_file(TESTFN, cls.FILESIZE)
+        cls.FILEDATA = read_file(TESTFN, binary=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def tearDown(self):
+        safe_remove(TESTFN2)
+
+    def copy(self, dstdata, **kwargs):
+        if dstdata is not None:
+            write_file(TESTFN2, dstdata, binary=True)
+        stats = zerocopy.CopyStats()
+        zerocopy.copyfile(TESTFN, TESTFN2, delta=True, stats=stats,
+                          **kwargs)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+        return stats
+
+    def modify(self, data, offset, n=1):
+        # test files are made of letters only
+        return data[:offset] + b"#" * n + data[offset + n:]
+
+    def test_unchanged(self):
+        stats = self.copy(self.FILEDATA)
+        self.assertEqual(stats.strategy, "delta")
+        self.assertEqual(stats.bytes, 0)
+
+    def test_changed_blocks(self):
+        # 1 byte in block 3 + 2 adjacent blocks + the last (short) block
+        bs = self.BLOCKSIZE
+        data = self.modify(self.FILEDATA, bs * 3 + 10)
+        data = self.modify(data, bs * 7 + bs - 1, 2)
+        data = self.modify(data, self.FILESIZE - 1)
+        with mock.patch("zerocopy._copyfile._copy_range",
+                        wraps=zerocopy._copyfile._copy_range) as m:
+            stats = self.copy(data)
+        self.assertEqual(stats.bytes, bs * 3 + (self.FILESIZE % bs))
+        self.assertEqual([x[0][2:] for x in m.call_args_list], [
+            (bs * 3, bs), (bs * 7, bs * 2),
+            (self.FILESIZE - self.FILESIZE % bs, self.FILESIZE % bs)])
+
+    def test_src_bigger(self):
+        stats = self.copy(self.FILEDATA[:self.BLOCKSIZE * 4])
+        self.assertEqual(stats.bytes, self.FILESIZE - self.BLOCKSIZE * 4)
+
+    def test_src_smaller(self):
+        stats = self.copy(self.FILEDATA + b"x" * 100000)
+        self.assertEqual(stats.bytes, 0)
+        self.assertEqual(os.path.getsize(TESTFN2), self.FILESIZE)
+
+    def test_no_dst(self):
+        # fallback on a regular copy
+        stats = self.copy(None)
+        self.assertNotEqual(stats.strategy, "delta")
+        self.assertEqual(stats.bytes, self.FILESIZE)
+        stats = self.copy(b"")
+        self.assertNotEqual(stats.strategy, "delta")
+
+    def test_progress(self):
+        calls = []
+        data = self.modify(self.FILEDATA, 0)
+        self.copy(data, progress=lambda *args: calls.append(args))
+        self.assertEqual(calls[-1], (self.FILESIZE, self.FILESIZE))
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        cancel.set()
+        write_file(TESTFN2, self.FILEDATA, binary=True)
+        self.assertRaises(zerocopy.CopyCancelledError, zerocopy.copyfile,
+                          TESTFN, TESTFN2, delta=True, cancel=cancel,
+                          chunksize=1024 * 1024)
+
+    def test_not_by_default(self):
+        write_file(TESTFN2, self.FILEDATA, binary=True)
+        stats = zerocopy.CopyStats()
+        zerocopy.copyfile(TESTFN, TESTFN2, stats=stats)
+        self.assertEqual(stats.bytes, self.FILESIZE)
+
+
+class TestAtomic(unittest.TestCase):
+    FILEDATA = b"x" * 100000
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.src = os.path.join(self.tmpdir, "src")
+        self.dst = os.path.join(self.tmpdir, "dst")
+        write_file(self.src, self.FILEDATA, binary=True)
+
+    def copy(self, **kwargs):
+        zerocopy.copyfile(self.src, self.dst, atomic=True, **kwargs)
+        self.assertEqual(read_file(self.dst, binary=True), self.FILEDATA)
+        self.assertNoLeftovers()
+
+    def assertNoLeftovers(self):
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ["dst", "src"])
+
+    def test_new_dst(self):
+        self.copy()
+
+    def test_replace_dst(self):
+        write_file(self.dst, b"old", binary=True)
+        os.chmod(self.dst, 0o640)
+        ino = os.stat(self.dst).st_ino
+        self.copy()
+        self.assertNotEqual(os.stat(self.dst).st_ino, ino)
+        self.assertEqual(os.stat(self.dst).st_mode & 0o777, 0o640)
+
+    def test_not_visible_while_copying(self):
+        def copy(fsrc, fdst, **kwargs):
+            fdst.write(fsrc.read())
+            fdst.flush()
+            self.assertEqual(read_file(self.dst, binary=True), b"old")
+
+        write_file(self.dst, b"old", binary=True)
+        with mock.patch("zerocopy._copyfile._copyfileobj2",
+                        side_effect=copy) as m:
+            self.copy()
+        self.assertTrue(m.called)
+
+    def test_error(self):
+        write_file(self.dst, b"old", binary=True)
+        with mock.patch("zerocopy._copyfile._copyfileobj2",
+                        side_effect=IOError(errno.EIO, "yo")):
+            self.assertRaises(IOError, zerocopy.copyfile, self.src,
+                              self.dst, atomic=True)
+        self.assertEqual(read_file(self.dst, binary=True), b"old")
+        self.assertNoLeftovers()
+
+    def test_cancel(self):
+        # dst is left untouched, not removed
+        cancel = threading.Event()
+        write_file(self.dst, b"old", binary=True)
+
+        def progress(copied, total):
+            cancel.set()
+
+        self.assertRaises(zerocopy.CopyCancelledError, zerocopy.copyfile,
+                          self.src, self.dst, atomic=True, progress=progress,
+                          cancel=cancel, chunksize=1000)
+        self.assertEqual(read_file(self.dst, binary=True), b"old")
+        self.assertNoLeftovers()
+
+    @unittest.skipIf(not HAS_O_TMPFILE, 'O_TMPFILE not supported')
+    def test_o_tmpfile(self):
+        with mock.patch("_zerocopy.linkat",
+                        side_effect=_zerocopy.linkat) as m1:
+            with mock.patch("zerocopy._copyfile._mkstemp") as m2:
+                self.copy()
+                # dst exists: linked to a temporary name, then renamed
+                self.copy()
+        self.assertEqual(m1.call_count, 3)
+        self.assertEqual(m1.call_args_list[0][0][3], self.dst)
+        self.assertFalse(m2.called)
+
+    def test_named_tmpfile(self):
+        with mock.patch("zerocopy._copyfile.HAS_O_TMPFILE", False):
+            with mock.patch("zerocopy._copyfile._replace",
+                            side_effect=zerocopy._copyfile._replace) as m:
+                self.copy()
+                self.copy()
+        self.assertEqual(m.call_count, 2)
+
+    @unittest.skipIf(not HAS_O_TMPFILE, 'O_TMPFILE not supported')
+    def test_o_tmpfile_unsupported(self):
+        # e.g. the filesystem does not support it
+        def open(path, flags, *args):
+            if flags & os.O_TMPFILE == os.O_TMPFILE:
+                raise OSError(errno.EOPNOTSUPP, "yo")
+            return os_open(path, flags, *args)
+
+        os_open = os.open
+        with mock.patch("os.open", side_effect=open):
+            with mock.patch("zerocopy._copyfile._mkstemp",
+                            side_effect=zerocopy._copyfile._mkstemp) as m:
+                self.copy()
+        self.assertTrue(m.called)
+
+    @unittest.skipIf(WINDOWS, 'POSIX only')
+    def test_symlink(self):
+        # the file pointed to is replaced, the symlink is kept
+        target = os.path.join(self.tmpdir, "target")
+        write_file(target, b"old", binary=True)
+        os.symlink("target", self.dst)
+        zerocopy.copyfile(self.src, self.dst, atomic=True)
+        self.assertEqual(os.readlink(self.dst), "target")
+        self.assertEqual(read_file(target, binary=True), self.FILEDATA)
+
+    def test_same_file(self):
+        self.assertRaises(zerocopy.SameFileError, zerocopy.copyfile,
+                          self.src, self.src, atomic=True)
+        self.assertEqual(read_file(self.src, binary=True), self.FILEDATA)
+
+    @unittest.skipIf(WINDOWS, 'POSIX only')
+    def test_not_regular_dst(self):
+        # written in place
+        zerocopy.copyfile(self.src, os.devnull, atomic=True)
+        self.assertTrue(os.path.exists(os.devnull))
+
+    def test_delta(self):
+        self.assertRaises(ValueError, zerocopy.copyfile, self.src, self.dst,
+                          atomic=True, delta=True)
+
+
 @unittest.skipIf(not OSX, 'OSX only')
 class TestZeroCopyOSX(_ZeroCopyFileTest, unittest.TestCase):
     PATCHPOINT = "_zerocopy.fcopyfile"
@@ -0,0 +1,289 @@
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+from zerocopy.test import mock
+from zerocopy.test import POSIX
+from zerocopy.test import read_file
+from zerocopy.test import write_file
+
+import zerocopy
+
+
+class _TreeTestCase(unittest.TestCase):
+    WORKERS = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.src = os.path.join(self.tmpdir, "src")
+        self.dst = os.path.join(self.tmpdir, "dst")
+        os.makedirs(os.path.join(self.src, "sub", "subsub"))
+        os.mkdir(os.path.join(self.src, "empty"))
+        write_file((self.src, "a"), b"a" * 1000, binary=True)
+        write_file((self.src, "b.pyc"), b"b", binary=True)
+        write_file((self.src, "sub", "c"), b"c" * 100000, binary=True)
+        write_file((self.src, "sub", "subsub", "d"), b"", binary=True)
+
+    def assert_trees_equal(self, src, dst, ignored=()):
+        for root, dirs, files in os.walk(src):
+            reldir = os.path.relpath(root, src)
+            for name in files:
+                if name in ignored:
+                    continue
+                dstname = os.path.join(dst, reldir, name)
+                self.assertEqual(
+                    read_file(os.path.join(root, name), binary=True),
+                    read_file(dstname, binary=True))
+            for name in dirs:
+                assert os.path.isdir(os.path.join(dst, reldir, name))
+
+
+class TestCopyTree(_TreeTestCase):
+
+    def copytree(self, *args, **kwargs):
+        kwargs.setdefault("workers", self.WORKERS)
+        return zerocopy.copytree(*args, **kwargs)
+
+    def test_copy(self):
+        ret = self.copytree(self.src, self.dst)
+        self.assertEqual(ret, self.dst)
+        self.assert_trees_equal(self.src, self.dst)
+        # Python 2 utime() has microsecond precision
+        self.assertAlmostEqual(
+            os.stat(os.path.join(self.src, "sub")).st_mtime,
+            os.stat(os.path.join(self.dst, "sub")).st_mtime, delta=1e-5)
+
+    def test_ignore(self):
+        self.copytree(self.src, self.dst,
+                      ignore=shutil.ignore_patterns("*.pyc"))
+        self.assert_trees_equal(self.src, self.dst, ignored=("b.pyc", ))
+        assert not os.path.exists(os.path.join(self.dst, "b.pyc"))
+
+    def test_dst_exists(self):
+        os.mkdir(self.dst)
+        self.assertRaises(OSError, self.copytree, self.src, self.dst)
+        self.copytree(self.src, self.dst, dirs_exist_ok=True)
+        self.assert_trees_equal(self.src, self.dst)
+
+    @unittest.skipIf(not POSIX, "POSIX only")
+    def test_symlinks(self):
+        os.symlink("a", os.path.join(self.src, "link"))
+        os.symlink("nope", os.path.join(self.src, "dangling"))
+        self.copytree(self.src, self.dst, symlinks=True)
+        self.assertEqual(os.readlink(os.path.join(self.dst, "link")), "a")
+        self.assertEqual(os.readlink(os.path.join(self.dst, "dangling")),
+                         "nope")
+        # follow symlinks
+        shutil.rmtree(self.dst)
+        self.copytree(self.src, self.dst, ignore_dangling_symlinks=True)
+        assert not os.path.islink(os.path.join(self.dst, "link"))
+        self.assertEqual(read_file((self.dst, "link"), binary=True),
+                         b"a" * 1000)
+        assert not os.path.lexists(os.path.join(self.dst, "dangling"))
+
+    def test_copy_function(self):
+        calls = []
+
+        def copy_function(src, dst):
+            calls.append(src)
+            return zerocopy.copy2(src, dst)
+
+        self.copytree(self.src, self.dst, copy_function=copy_function)
+        self.assertEqual(len(calls), 4)
+        self.assert_trees_equal(self.src, self.dst)
+
+    def test_errors(self):
+        def copy_function(src, dst):
+            if os.path.basename(src) in ("a", "c"):
+                raise OSError("yo %s" % os.path.basename(src))
+            return zerocopy.copy2(src, dst)
+
+        with self.assertRaises(shutil.Error) as cm:
+            self.copytree(self.src, self.dst, copy_function=copy_function)
+        errors = cm.exception.args[0]
+        # errors are sorted by traversal order
+        self.assertEqual(
+            [(src, dst) for src, dst, why in errors],
+            [(os.path.join(self.src, "a"), os.path.join(self.dst, "a")),
+             (os.path.join(self.src, "sub", "c"),
+              os.path.join(self.dst, "sub", "c"))])
+        self.assertIn("yo a", errors[0][2])
+        # the rest of the tree was copied anyway
+        self.assertEqual(read_file((self.dst, "sub", "subsub", "d")), "")
+
+    def test_uses_zerocopy(self):
+        with mock.patch("zerocopy._copytree.copyfile",
+                        wraps=zerocopy.copyfile) as m:
+            self.copytree(self.src, self.dst)
+        self.assertEqual(m.call_count, 4)
+
+    def test_src_stat(self):
+        # the DirEntry of each file is passed to copyfile()
+        with mock.patch("zerocopy._copytree.copyfile",
+                        wraps=zerocopy.copyfile) as m:
+            self.copytree(self.src, self.dst)
+        self.assertEqual(m.call_count, 4)
+        for call in m.call_args_list:
+            self.assertEqual(call[1]["src_stat"].path, call[0][0])
+
+    def test_preallocate(self):
+        with mock.patch("zerocopy._copytree.copyfile",
+                        wraps=zerocopy.copyfile) as m:
+            self.copytree(self.src, self.dst, preallocate=True)
+        self.assert_trees_equal(self.src, self.dst)
+        self.assertEqual(m.call_count, 4)
+        for call in m.call_args_list:
+            self.assertTrue(call[1]["preallocate"])
+
+    @unittest.skipIf(not hasattr(shutil, "disk_usage"), "Python >= 3.3")
+    def test_preallocate_enospc(self):
+        # fails before copying any file
+        with mock.patch("shutil.disk_usage",
+                        return_value=mock.Mock(free=1000)):
+            with self.assertRaises(OSError) as cm:
+                self.copytree(self.src, self.dst, preallocate=True)
+        self.assertEqual(cm.exception.errno, errno.ENOSPC)
+        self.assertFalse(os.path.exists(os.path.join(self.dst, "a")))
+
+    def test_invalid_workers(self):
+        self.assertRaises(ValueError, zerocopy.copytree, self.src, self.dst,
+                          workers=0)
+
+
+class TestCopyTreeParallel(TestCopyTree):
+    WORKERS = 4
+
+
+class TestSyncTree(_TreeTestCase):
+
+    def synctree(self, **kwargs):
+        kwargs.setdefault("workers", self.WORKERS)
+        return zerocopy.synctree(self.src, self.dst, **kwargs)
+
+    def dstpath(self, *names):
+        return os.path.join(self.dst, *names)
+
+    def test_sync(self):
+        copied, removed = self.synctree()
+        self.assertEqual(sorted(copied), sorted([
+            self.dstpath("a"), self.dstpath("b.pyc"),
+            self.dstpath("sub", "c"), self.dstpath("sub", "subsub", "d")]))
+        self.assertEqual(removed, [])
+        self.assert_trees_equal(self.src, self.dst)
+        # nothing changed
+        with mock.patch("zerocopy._copytree.copyfile") as m:
+            self.assertEqual(self.synctree(), ([], []))
+        self.assertFalse(m.called)
+        self.assertAlmostEqual(
+            os.stat(os.path.join(self.src, "sub")).st_mtime,
+            os.stat(self.dstpath("sub")).st_mtime, delta=1e-5)
+
+    def test_changed_and_new_files(self):
+        self.synctree()
+        write_file((self.src, "a"), b"x" * 10, binary=True)
+        write_file((self.src, "sub", "new"), b"new", binary=True)
+        os.mkdir(os.path.join(self.src, "newdir"))
+        write_file((self.src, "newdir", "e"), b"e", binary=True)
+        copied, _ = self.synctree()
+        self.assertEqual(sorted(copied), sorted([
+            self.dstpath("a"), self.dstpath("sub", "new"),
+            self.dstpath("newdir", "e")]))
+        self.assert_trees_equal(self.src, self.dst)
+
+    def test_compare(self):
+        self.synctree()
+        # same size and mtime, different content
+        path = os.path.join(self.src, "a")
+        st = os.stat(path)
+        write_file(path, b"b" * 1000, binary=True)
+        os.utime(path, (st.st_atime, st.st_mtime))
+        self.assertEqual(self.synctree(compare="mtime"), ([], []))
+        self.assertEqual(read_file(self.dstpath("a")), "a" * 1000)
+        # src inode changed after the last sync
+        self.assertEqual(self.synctree(compare="ctime"),
+                         ([self.dstpath("a")], []))
+        self.assertEqual(read_file(self.dstpath("a")), "b" * 1000)
+        self.assertEqual(self.synctree(compare="ctime"), ([], []))
+        write_file(path, b"c" * 1000, binary=True)
+        os.utime(path, (st.st_atime, st.st_mtime))
+        self.assertEqual(self.synctree(compare="content"),
+                         ([self.dstpath("a")], []))
+        self.assertEqual(read_file(self.dstpath("a")), "c" * 1000)
+        self.assertEqual(self.synctree(compare="content"), ([], []))
+
+    def test_delete(self):
+        self.synctree()
+        write_file((self.dst, "extra"), b"x", binary=True)
+        os.mkdir(self.dstpath("sub", "extradir"))
+        write_file((self.dst, "sub", "extradir", "f"), b"x", binary=True)
+        write_file((self.dst, "ignored.pyc"), b"x", binary=True)
+        self.assertEqual(self.synctree(), ([], []))
+        self.assertTrue(os.path.exists(self.dstpath("extra")))
+        copied, removed = self.synctree(
+            delete=True, ignore=shutil.ignore_patterns("*.pyc"))
+        self.assertEqual(copied, [])
+        self.assertEqual(sorted(removed), sorted([
+            self.dstpath("extra"), self.dstpath("sub", "extradir")]))
+        self.assertFalse(os.path.exists(self.dstpath("extra")))
+        self.assertFalse(os.path.exists(self.dstpath("sub", "extradir")))
+        self.assertTrue(os.path.exists(self.dstpath("ignored.pyc")))
+
+    def test_type_changes(self):
+        self.synctree()
+        # file -> dir
+        os.remove(os.path.join(self.src, "a"))
+        os.mkdir(os.path.join(self.src, "a"))
+        write_file((self.src, "a", "f"), b"f", binary=True)
+        # dir -> file
+        shutil.rmtree(os.path.join(self.src, "sub", "subsub"))
+        write_file((self.src, "sub", "subsub"), b"s", binary=True)
+        copied, _ = self.synctree()
+        self.assertEqual(sorted(copied), sorted([
+            self.dstpath("a", "f"), self.dstpath("sub", "subsub")]))
+        self.assert_trees_equal(self.src, self.dst)
+
+    @unittest.skipIf(not POSIX, "POSIX only")
+    def test_sync_symlinks(self):
+        os.symlink("a", os.path.join(self.src, "link"))
+        self.synctree(symlinks=True)
+        self.assertEqual(os.readlink(self.dstpath("link")), "a")
+        self.assertEqual(self.synctree(symlinks=True), ([], []))
+        os.remove(os.path.join(self.src, "link"))
+        os.symlink("b.pyc", os.path.join(self.src, "link"))
+        self.assertEqual(self.synctree(symlinks=True),
+                         ([self.dstpath("link")], []))
+        self.assertEqual(os.readlink(self.dstpath("link")), "b.pyc")
+        # dst symlink replaced by a regular file, not written through
+        copied, _ = self.synctree()
+        self.assertEqual(copied, [self.dstpath("link")])
+        self.assertFalse(os.path.islink(self.dstpath("link")))
+        self.assertEqual(read_file(self.dstpath("b.pyc")), "b")
+
+    def test_errors(self):
+        def copy_function(src, dst):
+            if os.path.basename(src) == "a":
+                raise OSError("yo")
+            return zerocopy.copy2(src, dst)
+
+        with self.assertRaises(shutil.Error) as cm:
+            self.synctree(copy_function=copy_function)
+        errors = cm.exception.args[0]
+        self.assertEqual([x[1] for x in errors], [self.dstpath("a")])
+        self.assertEqual(read_file(self.dstpath("sub", "c")), "c" * 100000)
+
+    def test_invalid_args(self):
+        self.assertRaises(ValueError, zerocopy.synctree, self.src, self.dst,
+                          compare="foo")
+        self.assertRaises(ValueError, zerocopy.synctree, self.src, self.dst,
+                          workers=0)
+
+
+class TestSyncTreeParallel(TestSyncTree):
+    WORKERS = 4
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,266 @@
+import contextlib
+import io
+import socket
+import threading
+import time
+import unittest
+
+from zerocopy.test import CERTFILE
+from zerocopy.test import get_ssl_contexts
+from zerocopy.test import LINUX
+from zerocopy.test import mock
+from zerocopy.test import read_file
+from zerocopy.test import safe_remove
+from zerocopy.test import TESTFN
+from zerocopy.test import write_test_file
+
+import zerocopy
+from zerocopy._sendfile import _zerocopy
+from zerocopy._sendfile import _GiveupOnSendfile
+from zerocopy._sendfile import _sendfile_use_sendfile
+
+
+class _Receiver(threading.Thread):
+    """Accept a connection and read all data until EOF."""
+
+    def __init__(self, listener, delay=0, ssl_context=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.listener = listener
+        self.delay = delay
+        self.ssl_context = ssl_context
+        self.chunks = []
+
+    def run(self):
+        conn, _ = self.listener.accept()
+        if self.ssl_context is not None:
+            conn = self.ssl_context.wrap_socket(conn, server_side=True)
+        with contextlib.closing(conn):
+            if self.delay:
+                time.sleep(self.delay)
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                self.chunks.append(chunk)
+
+    @property
+    def data(self):
+        return b"".join(self.chunks)
+
+
+class _SendfileTestCase(unittest.TestCase):
+    FILESIZE = (10 * 1024 * 1024)  # 10 MiB
+
+    @classmethod
+    def setUpClass(cls):
+        write_test_file(TESTFN, cls.FILESIZE)
+        cls.FILEDATA = read_file(TESTFN, binary=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(5)
+        self.addCleanup(self.listener.close)
+
+    def connect(self, delay=0, ssl_contexts=None):
+        server_ctx, client_ctx = ssl_contexts or (None, None)
+        receiver = _Receiver(self.listener, delay=delay,
+                             ssl_context=server_ctx)
+        receiver.start()
+        sock = socket.create_connection(self.listener.getsockname())
+        if client_ctx is not None:
+            sock = client_ctx.wrap_socket(sock)
+        self.addCleanup(sock.close)
+        return sock, receiver
+
+
+class TestSendfile(_SendfileTestCase):
+
+    def sendfile(self, file, offset=0, count=None, delay=0, timeout=None):
+        sock, receiver = self.connect(delay=delay)
+        sock.settimeout(timeout)
+        ret = zerocopy.sendfile(sock, file, offset, count)
+        sock.close()
+        receiver.join(5)
+        return ret, receiver.data
+
+    def test_send(self):
+        with open(TESTFN, "rb") as f:
+            ret, data = self.sendfile(f)
+            self.assertEqual(f.tell(), self.FILESIZE)
+        self.assertEqual(ret, self.FILESIZE)
+        self.assertEqual(data, self.FILEDATA)
+
+    def test_offset(self):
+        with open(TESTFN, "rb") as f:
+            ret, data = self.sendfile(f, offset=5000)
+            self.assertEqual(f.tell(), self.FILESIZE)
+        self.assertEqual(ret, self.FILESIZE - 5000)
+        self.assertEqual(data, self.FILEDATA[5000:])
+
+    def test_count(self):
+        with open(TESTFN, "rb") as f:
+            ret, data = self.sendfile(f, count=5000)
+            self.assertEqual(f.tell(), 5000)
+        self.assertEqual(ret, 5000)
+        self.assertEqual(data, self.FILEDATA[:5000])
+
+    def test_offset_and_count(self):
+        with open(TESTFN, "rb") as f:
+            ret, data = self.sendfile(f, offset=5000, count=100001)
+            self.assertEqual(f.tell(), 105001)
+        self.assertEqual(ret, 100001)
+        self.assertEqual(data, self.FILEDATA[5000:105001])
+
+    def test_count_beyond_eof(self):
+        with open(TESTFN, "rb") as f:
+            ret, data = self.sendfile(f, offset=self.FILESIZE - 10,
+                                      count=100)
+        self.assertEqual(ret, 10)
+        self.assertEqual(data, self.FILEDATA[-10:])
+
+    def test_empty_file(self):
+        with io.BytesIO() as f:
+            ret, data = self.sendfile(f)
+        self.assertEqual(ret, 0)
+        self.assertEqual(data, b"")
+
+    def test_non_blocking(self):
+        # a slow reader makes sendfile() fail with EAGAIN
+        with open(TESTFN, "rb") as f:
+            ret, data = self.sendfile(f, delay=0.2, timeout=0)
+        self.assertEqual(ret, self.FILESIZE)
+        self.assertEqual(data, self.FILEDATA)
+
+    def test_timeout(self):
+        with open(TESTFN, "rb") as f:
+            sock, receiver = self.connect(delay=1)
+            sock.settimeout(0.05)
+            self.assertRaises(socket.timeout, zerocopy.sendfile, sock, f)
+            # position reflects the bytes which were sent
+            self.assertLess(f.tell(), self.FILESIZE)
+
+    def test_fallback_non_regular_file(self):
+        sock = socket.socket()
+        self.addCleanup(sock.close)
+        with io.BytesIO(self.FILEDATA) as f:
+            self.assertRaises(_GiveupOnSendfile, _sendfile_use_sendfile,
+                              sock, f)
+            ret, data = self.sendfile(f, offset=10, count=100000)
+            self.assertEqual(f.tell(), 100010)
+        self.assertEqual(ret, 100000)
+        self.assertEqual(data, self.FILEDATA[10:100010])
+
+    @unittest.skipIf(CERTFILE is None, "no certificate to test SSL with")
+    def test_fallback_ssl_socket(self):
+        sock, receiver = self.connect(ssl_contexts=get_ssl_contexts())
+        with mock.patch("_zerocopy.sendfile") as m:
+            with open(TESTFN, "rb") as f:
+                ret = zerocopy.sendfile(sock, f, count=100000)
+        self.assertFalse(m.called)
+        sock.close()
+        receiver.join(5)
+        self.assertEqual(ret, 100000)
+        self.assertEqual(receiver.data, self.FILEDATA[:100000])
+
+    def test_fallback_no_sendfile(self):
+        with mock.patch("zerocopy._sendfile.HAS_SENDFILE", False):
+            with open(TESTFN, "rb") as f:
+                ret, data = self.sendfile(f, delay=0.2, timeout=0)
+        self.assertEqual(ret, self.FILESIZE)
+        self.assertEqual(data, self.FILEDATA)
+
+    def test_invalid_args(self):
+        sock = socket.socket()
+        self.addCleanup(sock.close)
+        with open(TESTFN, "r") as f:
+            self.assertRaises(ValueError, zerocopy.sendfile, sock, f)
+        with open(TESTFN, "rb") as f:
+            self.assertRaises(ValueError, zerocopy.sendfile, sock, f,
+                              count=0)
+            self.assertRaises(ValueError, zerocopy.sendfile, sock, f,
+                              count=1.5)
+            self.assertRaises(ValueError, zerocopy.sendfile, sock, f,
+                              offset=-1)
+            self.assertRaises(ValueError, zerocopy.sendfile, sock, f,
+                              offset=1.5)
+            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.addCleanup(udp.close)
+            self.assertRaises(ValueError, zerocopy.sendfile, udp, f)
+            # SOCK_SEQPACKET & SOCK_STREAM != 0
+            a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            self.addCleanup(a.close)
+            self.addCleanup(b.close)
+            self.assertRaises(ValueError, zerocopy.sendfile, a, f)
+
+
+@unittest.skipIf(not LINUX, "Linux only")
+class TestSendfileHeaderTrailer(_SendfileTestCase):
+    """Tests for header / trailer args of low-level _zerocopy.sendfile()
+    which are emulated on Linux via TCP_CORK.
+    """
+
+    def sendfile_hdtr(self, sock, receiver, nbytes, **kwargs):
+        with open(TESTFN, "rb") as f:
+            ret = _zerocopy.sendfile(sock.fileno(), f.fileno(), 0, nbytes,
+                                     **kwargs)
+        sock.close()
+        receiver.join(5)
+        return ret, receiver.data
+
+    def test_header_and_trailer(self):
+        sock, receiver = self.connect()
+        ret, data = self.sendfile_hdtr(sock, receiver, 100000,
+                                       header=b"HEAD", trailer=b"TAIL")
+        self.assertEqual(ret, 100008)
+        self.assertEqual(data, b"HEAD" + self.FILEDATA[:100000] + b"TAIL")
+
+    def test_header_only(self):
+        sock, receiver = self.connect()
+        ret, data = self.sendfile_hdtr(sock, receiver, 100000,
+                                       header=b"HEAD")
+        self.assertEqual(ret, 100004)
+        self.assertEqual(data, b"HEAD" + self.FILEDATA[:100000])
+
+    def test_trailer_after_eof(self):
+        sock, receiver = self.connect()
+        ret, data = self.sendfile_hdtr(sock, receiver, self.FILESIZE * 2,
+                                       trailer=b"TAIL")
+        self.assertEqual(ret, self.FILESIZE + 4)
+        self.assertEqual(data, self.FILEDATA + b"TAIL")
+
+    def test_cork_state_restored(self):
+        for cork in (0, 1):
+            sock, receiver = self.connect()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, cork)
+            with open(TESTFN, "rb") as f:
+                _zerocopy.sendfile(sock.fileno(), f.fileno(), 0, 100000,
+                                   header=b"HEAD", trailer=b"TAIL")
+            self.assertEqual(
+                sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_CORK), cork)
+            sock.close()
+            receiver.join(5)
+            self.assertEqual(receiver.data,
+                             b"HEAD" + self.FILEDATA[:100000] + b"TAIL")
+
+    def test_non_tcp_socket(self):
+        # TCP_CORK can't be set; MSG_MORE is used instead
+        a, b = socket.socketpair()
+        self.addCleanup(b.close)
+        try:
+            with open(TESTFN, "rb") as f:
+                ret = _zerocopy.sendfile(a.fileno(), f.fileno(), 0, 10,
+                                         header=b"HEAD", trailer=b"TAIL")
+        finally:
+            a.close()
+        self.assertEqual(ret, 18)
+        self.assertEqual(b.recv(100), b"HEAD" + self.FILEDATA[:10] + b"TAIL")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,107 @@
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+from zerocopy.test import mock
+from zerocopy.test import PY3
+from zerocopy.test import read_file
+from zerocopy.test import write_file
+
+import zerocopy
+
+
+ORIG_COPYFILE = shutil.copyfile
+
+
+class TestPatchShutil(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.src = os.path.join(self.tmpdir, "src")
+        self.dst = os.path.join(self.tmpdir, "dst")
+        write_file(self.src, b"hello", binary=True)
+        zerocopy.patch_shutil()
+        self.addCleanup(zerocopy.unpatch_shutil)
+
+    def assert_zerocopy_used(self, fun, *args, **kwargs):
+        with mock.patch("zerocopy._shutil.copyfile",
+                        wraps=zerocopy.copyfile) as m:
+            ret = fun(*args, **kwargs)
+            assert m.called
+        return ret
+
+    def test_patch_unpatch(self):
+        self.assertIsNot(shutil.copyfile, ORIG_COPYFILE)
+        zerocopy.patch_shutil()  # no-op
+        zerocopy.unpatch_shutil()
+        self.assertIs(shutil.copyfile, ORIG_COPYFILE)
+        zerocopy.unpatch_shutil()  # no-op
+        self.assertIs(shutil.copyfile, ORIG_COPYFILE)
+
+    def test_context_manager(self):
+        zerocopy.unpatch_shutil()
+        with zerocopy.patched_shutil():
+            self.assertIsNot(shutil.copyfile, ORIG_COPYFILE)
+        self.assertIs(shutil.copyfile, ORIG_COPYFILE)
+        # if already patched it is left alone
+        zerocopy.patch_shutil()
+        with zerocopy.patched_shutil():
+            pass
+        self.assertIsNot(shutil.copyfile, ORIG_COPYFILE)
+
+    def test_copyfile(self):
+        ret = self.assert_zerocopy_used(shutil.copyfile, self.src, self.dst)
+        self.assertEqual(ret, self.dst)
+        self.assertEqual(read_file(self.dst, binary=True), b"hello")
+
+    def test_copy(self):
+        ret = self.assert_zerocopy_used(shutil.copy, self.src, self.tmpdir
+                                        + os.sep + "dst")
+        if PY3:  # Python 2 returns None
+            self.assertEqual(ret, self.dst)
+        self.assertEqual(read_file(self.dst, binary=True), b"hello")
+
+    def test_copy2(self):
+        ret = self.assert_zerocopy_used(shutil.copy2, self.src, self.dst)
+        if PY3:  # Python 2 returns None
+            self.assertEqual(ret, self.dst)
+        # Python 2 utime() has microsecond precision
+        self.assertAlmostEqual(os.stat(self.src).st_mtime,
+                               os.stat(self.dst).st_mtime, delta=1e-5)
+
+    def test_copytree(self):
+        srcdir = os.path.join(self.tmpdir, "srcdir")
+        dstdir = os.path.join(self.tmpdir, "dstdir")
+        os.mkdir(srcdir)
+        write_file(os.path.join(srcdir, "foo"), b"foo", binary=True)
+        ret = self.assert_zerocopy_used(shutil.copytree, srcdir, dstdir)
+        if PY3:  # Python 2 returns None
+            self.assertEqual(ret, dstdir)
+        self.assertEqual(read_file(os.path.join(dstdir, "foo"), binary=True),
+                         b"foo")
+
+    def test_move_cross_device(self):
+        with mock.patch("os.rename", side_effect=OSError(errno.EXDEV, "")):
+            self.assert_zerocopy_used(shutil.move, self.src, self.dst)
+        self.assertFalse(os.path.exists(self.src))
+        self.assertEqual(read_file(self.dst, binary=True), b"hello")
+
+    def test_same_file_error(self):
+        self.assertRaises(shutil.Error, shutil.copyfile, self.src, self.src)
+        if hasattr(shutil, "SameFileError"):
+            self.assertRaises(shutil.SameFileError, shutil.copyfile,
+                              self.src, self.src)
+
+    @unittest.skipIf(not hasattr(os, "mkfifo"), "mkfifo() not supported")
+    def test_special_file_error(self):
+        fifo = os.path.join(self.tmpdir, "fifo")
+        os.mkfifo(fifo)
+        exc = getattr(shutil, "SpecialFileError", shutil.Error)
+        self.assertRaises(exc, shutil.copyfile, fifo, self.dst)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
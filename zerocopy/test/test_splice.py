@@ -0,0 +1,404 @@
+import io
+import os
+import socket
+import threading
+import time
+import unittest
+
+from zerocopy.test import CERTFILE
+from zerocopy.test import get_ssl_contexts
+from zerocopy.test import LINUX
+from zerocopy.test import mock
+from zerocopy.test import PY3
+from zerocopy.test import read_file
+from zerocopy.test import safe_remove
+from zerocopy.test import socketpair
+from zerocopy.test import TESTFN
+from zerocopy.test import TESTFN2
+from zerocopy.test import write_file
+from zerocopy.test import write_test_file
+
+import zerocopy
+from zerocopy._splice import _PipePool
+from zerocopy._splice import _zerocopy
+
+
+class _Sender(threading.Thread):
+    """Send some data over a socket, then close it."""
+
+    def __init__(self, sock, data, delay=0, ssl_context=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = sock
+        self.data = data
+        self.delay = delay
+        self.ssl_context = ssl_context
+
+    def run(self):
+        sock = self.sock
+        # Python 2 sockets are not context managers
+        try:
+            if self.ssl_context is not None:
+                sock = self.ssl_context.wrap_socket(sock, server_side=True)
+            if self.delay:
+                time.sleep(self.delay)
+            try:
+                sock.sendall(self.data)
+            except socket.error:
+                pass  # the receiver closed the connection
+        finally:
+            sock.close()
+            # on Python 2 the SSL socket shares the fd with it
+            self.sock.close()
+
+
+class TestRecvfile(unittest.TestCase):
+    FILESIZE = (10 * 1024 * 1024)  # 10 MiB
+
+    @classmethod
+    def setUpClass(cls):
+        write_test_file(TESTFN, cls.FILESIZE)
+        cls.FILEDATA = read_file(TESTFN, binary=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def tearDown(self):
+        safe_remove(TESTFN2)
+
+    def recvfile(self, file, count=None, delay=0, timeout=None,
+                 ssl_contexts=None):
+        server_ctx, client_ctx = ssl_contexts or (None, None)
+        a, b = socketpair()
+        self.addCleanup(a.close)
+        sender = _Sender(b, self.FILEDATA, delay=delay,
+                         ssl_context=server_ctx)
+        sender.start()
+        if client_ctx is not None:
+            a = client_ctx.wrap_socket(a)
+            self.addCleanup(a.close)
+        a.settimeout(timeout)
+        ret = zerocopy.recvfile(a, file, count)
+        a.close()
+        sender.join(5)
+        return ret
+
+    def test_recv(self):
+        with open(TESTFN2, "wb") as f:
+            ret = self.recvfile(f)
+            self.assertEqual(f.tell(), self.FILESIZE)
+        self.assertEqual(ret, self.FILESIZE)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    def test_count(self):
+        with open(TESTFN2, "wb") as f:
+            ret = self.recvfile(f, count=100001)
+        self.assertEqual(ret, 100001)
+        self.assertEqual(read_file(TESTFN2, binary=True),
+                         self.FILEDATA[:100001])
+
+    def test_file_position(self):
+        with open(TESTFN2, "wb") as f:
+            f.write(b"x" * 10)  # buffered; must be flushed first
+            self.recvfile(f, count=1000)
+            f.write(b"y" * 10)
+        self.assertEqual(read_file(TESTFN2, binary=True),
+                         b"x" * 10 + self.FILEDATA[:1000] + b"y" * 10)
+
+    def test_non_blocking(self):
+        with open(TESTFN2, "wb") as f:
+            ret = self.recvfile(f, delay=0.1, timeout=0)
+        self.assertEqual(ret, self.FILESIZE)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    def test_timeout(self):
+        with open(TESTFN2, "wb") as f:
+            self.assertRaises(socket.timeout, self.recvfile, f, delay=1,
+                              timeout=0.05)
+
+    def test_fallback_non_regular_file(self):
+        with io.BytesIO() as f:
+            ret = self.recvfile(f)
+            self.assertEqual(f.getvalue(), self.FILEDATA)
+        self.assertEqual(ret, self.FILESIZE)
+
+    def test_fallback_append_mode(self):
+        # splice() does not support files opened in append mode
+        with open(TESTFN2, "ab") as f:
+            ret = self.recvfile(f)
+        self.assertEqual(ret, self.FILESIZE)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    @unittest.skipIf(CERTFILE is None, "no certificate to test SSL with")
+    def test_fallback_ssl_socket(self):
+        with mock.patch("_zerocopy.splice", wraps=_zerocopy.splice) as m:
+            with open(TESTFN2, "wb") as f:
+                # count: Python 2 + OpenSSL 3 fail on unexpected EOF
+                ret = self.recvfile(f, count=self.FILESIZE, timeout=5,
+                                    ssl_contexts=get_ssl_contexts())
+        self.assertFalse(m.called)
+        self.assertEqual(ret, self.FILESIZE)
+        self.assertEqual(read_file(TESTFN2, binary=True), self.FILEDATA)
+
+    def test_fallback_no_splice(self):
+        with mock.patch("zerocopy._splice.HAS_SPLICE", False):
+            with open(TESTFN2, "wb") as f:
+                ret = self.recvfile(f, count=12345)
+        self.assertEqual(ret, 12345)
+        self.assertEqual(read_file(TESTFN2, binary=True),
+                         self.FILEDATA[:12345])
+
+    def test_invalid_args(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        with open(TESTFN2, "w") as f:
+            self.assertRaises(ValueError, zerocopy.recvfile, a, f)
+        with open(TESTFN2, "wb") as f:
+            self.assertRaises(ValueError, zerocopy.recvfile, a, f, count=0)
+            self.assertRaises(ValueError, zerocopy.recvfile, a, f,
+                              count=1.5)
+
+
+class _Peer(threading.Thread):
+    """Send some data, half-close the connection, then read all data
+    until EOF.
+    """
+
+    def __init__(self, sock, data, ssl_context=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = sock
+        self.data = data
+        self.ssl_context = ssl_context
+        self.chunks = []
+
+    def run(self):
+        sock = self.sock
+        try:
+            if self.ssl_context is not None:
+                sock = self.ssl_context.wrap_socket(sock)
+            sock.sendall(self.data)
+            if self.ssl_context is not None:
+                # half-close the TCP connection only, keeping the SSL
+                # layer for reading
+                socket.socket.shutdown(sock, socket.SHUT_WR)
+            else:
+                sock.shutdown(socket.SHUT_WR)
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                self.chunks.append(chunk)
+        finally:
+            sock.close()
+            self.sock.close()
+
+    @property
+    def received(self):
+        return b"".join(self.chunks)
+
+
+class TestRelay(unittest.TestCase):
+    DATA_A = b"x" * (3 * 1024 * 1024 + 1)
+    DATA_B = b"y" * 1001
+
+    def relay(self, bufsize=None, timeout=None, ssl_contexts=None):
+        # client <-> a <- relay -> b <-> server
+        server_ctx, client_ctx = ssl_contexts or (None, None)
+        client, a = socketpair()
+        b, server = socketpair()
+        for sock in (a, b):
+            self.addCleanup(sock.close)
+        peers = [_Peer(client, self.DATA_A, ssl_context=client_ctx),
+                 _Peer(server, self.DATA_B)]
+        for peer in peers:
+            peer.start()
+        if server_ctx is not None:
+            a = server_ctx.wrap_socket(a, server_side=True)
+            self.addCleanup(a.close)
+        for sock in (a, b):
+            sock.settimeout(timeout)
+        ret = zerocopy.relay(a, b, bufsize=bufsize)
+        for peer in peers:
+            peer.join(5)
+        self.assertEqual(ret, (len(self.DATA_A), len(self.DATA_B)))
+        self.assertEqual(peers[1].received, self.DATA_A)
+        self.assertEqual(peers[0].received, self.DATA_B)
+
+    def test_relay(self):
+        self.relay()
+
+    def test_bufsize(self):
+        self.relay(bufsize=65536)
+
+    def test_bufsize_not_pooled(self):
+        # resized pipes are not given back to the pool
+        pool = _PipePool()
+        self.addCleanup(pool.close)
+        with mock.patch("zerocopy._splice._pipe_pool", pool):
+            self.relay(bufsize=131072)
+            self.assertEqual(pool._pipes, [])
+            self.relay()
+        self.assertTrue(pool._pipes)
+        default = pool.acquire()
+        self.addCleanup(pool.release, default)
+        self.assertNotEqual(default[2], 131072)
+
+    def test_non_blocking(self):
+        self.relay(timeout=0)
+
+    def test_fallback_no_splice(self):
+        with mock.patch("zerocopy._splice.HAS_SPLICE", False):
+            self.relay(bufsize=1000)
+
+    @unittest.skipIf(CERTFILE is None, "no certificate to test SSL with")
+    @unittest.skipIf(not PY3, "Python 2 + OpenSSL 3 fail on unexpected EOF")
+    def test_fallback_ssl_socket(self):
+        # a TLS terminating proxy
+        with mock.patch("_zerocopy.splice", wraps=_zerocopy.splice) as m:
+            self.relay(ssl_contexts=get_ssl_contexts())
+        self.assertFalse(m.called)
+
+    def test_error(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        with mock.patch("zerocopy._splice._pump",
+                        side_effect=[ValueError("x"), 0]):
+            self.assertRaises(ValueError, zerocopy.relay, a, b)
+
+    def test_invalid_args(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(udp.close)
+        self.assertRaises(ValueError, zerocopy.relay, a, udp)
+        # SOCK_SEQPACKET & SOCK_STREAM != 0
+        c, d = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.addCleanup(c.close)
+        self.addCleanup(d.close)
+        self.assertRaises(ValueError, zerocopy.relay, a, c)
+
+
+class TestCopyToMany(unittest.TestCase):
+    FILESIZE = (3 * 1024 * 1024)  # 3 MiB
+
+    @classmethod
+    def setUpClass(cls):
+        write_test_file(TESTFN, cls.FILESIZE)
+        cls.FILEDATA = read_file(TESTFN, binary=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def setUp(self):
+        self.dsts = [TESTFN2 + str(i) for i in range(3)]
+
+    def tearDown(self):
+        for dst in self.dsts:
+            safe_remove(dst)
+
+    def assert_copied(self):
+        for dst in self.dsts:
+            self.assertEqual(read_file(dst, binary=True), self.FILEDATA)
+
+    def test_paths(self):
+        self.assertEqual(zerocopy.copy_to_many(TESTFN, self.dsts), self.dsts)
+        self.assert_copied()
+
+    def test_single_dst(self):
+        zerocopy.copy_to_many(TESTFN, self.dsts[:1])
+        self.assertEqual(read_file(self.dsts[0], binary=True), self.FILEDATA)
+
+    def test_file_objects(self):
+        write_file(self.dsts[1], "x" * 10)
+        with open(self.dsts[1], "ab") as f1:  # no splice() in append mode
+            with open(self.dsts[2], "wb") as f2:
+                f2.write(b"y" * 10)  # buffered; must be flushed first
+                zerocopy.copy_to_many(TESTFN, [self.dsts[0], f1, f2])
+        self.assertEqual(read_file(self.dsts[0], binary=True), self.FILEDATA)
+        self.assertEqual(read_file(self.dsts[1], binary=True),
+                         b"x" * 10 + self.FILEDATA)
+        self.assertEqual(read_file(self.dsts[2], binary=True),
+                         b"y" * 10 + self.FILEDATA)
+
+    def test_socket(self):
+        a, b = socket.socketpair()
+        self.addCleanup(b.close)
+        peer = _Peer(b, b"")
+        peer.start()
+        self.addCleanup(a.close)
+        zerocopy.copy_to_many(TESTFN, [self.dsts[0], a])
+        a.shutdown(socket.SHUT_WR)
+        peer.join(5)
+        self.assertEqual(read_file(self.dsts[0], binary=True), self.FILEDATA)
+        self.assertEqual(peer.received, self.FILEDATA)
+
+    def test_non_regular_file(self):
+        with io.BytesIO() as f:
+            zerocopy.copy_to_many(TESTFN, [self.dsts[0], f])
+            self.assertEqual(f.getvalue(), self.FILEDATA)
+        self.assertEqual(read_file(self.dsts[0], binary=True), self.FILEDATA)
+
+    @unittest.skipIf(not LINUX, "Linux only")
+    def test_short_tee(self):
+        tee = _zerocopy.tee
+        with mock.patch.object(_zerocopy, "tee",
+                               side_effect=lambda r, w, n: tee(r, w, n // 3)):
+            zerocopy.copy_to_many(TESTFN, self.dsts)
+        self.assert_copied()
+
+    def test_fallback_no_tee(self):
+        with mock.patch("zerocopy._splice.HAS_TEE", False):
+            zerocopy.copy_to_many(TESTFN, self.dsts)
+        self.assert_copied()
+
+    def test_invalid_args(self):
+        self.assertRaises(ValueError, zerocopy.copy_to_many, TESTFN, [])
+        self.assertRaises(zerocopy.SameFileError, zerocopy.copy_to_many,
+                          TESTFN, [self.dsts[0], TESTFN])
+
+
+@unittest.skipIf(not LINUX, "Linux only")
+class TestPipePool(unittest.TestCase):
+
+    def test_reuse(self):
+        pool = _PipePool(maxsize=1)
+        self.addCleanup(pool.close)
+        p1 = pool.acquire()
+        self.assertGreaterEqual(p1[2], 65536)
+        pool.release(p1)
+        self.assertEqual(pool.acquire(), p1)
+        p2 = pool.acquire()
+        self.assertNotEqual(p1, p2)
+        pool.release(p1)
+        pool.release(p2)  # pool is full: closed
+        self.assertEqual(pool._pipes, [p1])
+
+    def test_dirty_pipe_is_closed(self):
+        pool = _PipePool()
+        self.addCleanup(pool.close)
+        p = pool.acquire()
+        pool.release(p, clean=False)
+        self.assertEqual(pool._pipes, [])
+
+    def test_fork(self):
+        # a forked child doesn't share pooled pipes with its parent
+        pool = _PipePool()
+        self.addCleanup(pool.close)
+        p1 = pool.acquire()
+        inode = os.fstat(p1[0]).st_ino
+        pool.release(p1)
+        with mock.patch("os.getpid", return_value=os.getpid() + 1):
+            p2 = pool.acquire()
+            pool.release(p2)
+        self.assertNotEqual(os.fstat(p2[0]).st_ino, inode)
+        self.assertEqual(pool._pipes, [p2])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,167 @@
+import errno
+import os
+import unittest
+
+from zerocopy.test import mock
+from zerocopy.test import POSIX
+from zerocopy.test import read_file
+from zerocopy.test import safe_remove
+from zerocopy.test import TESTFN
+from zerocopy.test import TESTFN2
+from zerocopy.test import write_test_file
+
+import zerocopy
+from zerocopy import _stats
+from zerocopy._copyfile import HAS_COPY_FILE_RANGE
+
+
+class TestCopyStats(unittest.TestCase):
+    FILESIZE = 1024 * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        write_test_file(TESTFN, cls.FILESIZE)
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def tearDown(self):
+        safe_remove(TESTFN2)
+        zerocopy.reset_fs_capabilities()
+
+    def test_copy(self):
+        stats = zerocopy.CopyStats()
+        zerocopy.copyfile(TESTFN, TESTFN2, stats=stats)
+        self.assertIsNotNone(stats.strategy)
+        self.assertEqual(stats.bytes, self.FILESIZE)
+        self.assertGreaterEqual(stats.syscalls, 1)
+        self.assertGreater(stats.elapsed, 0)
+        self.assertEqual(stats.fallbacks, [])
+        self.assertIsNone(stats.error)
+        self.assertEqual((stats.src, stats.dst), (TESTFN, TESTFN2))
+        self.assertIn(stats.strategy, repr(stats))
+        self.assertIsNone(_stats.current())
+
+    @unittest.skipIf(not HAS_COPY_FILE_RANGE,
+                     'copy_file_range() not supported')
+    def test_fallback(self):
+        stats = zerocopy.CopyStats()
+        with mock.patch("_zerocopy.copy_file_range",
+                        side_effect=OSError(errno.EXDEV, "yo")):
+            zerocopy.copyfile(TESTFN, TESTFN2, stats=stats)
+        self.assertEqual(len(stats.fallbacks), 1)
+        self.assertEqual(stats.fallbacks[0][0], "copy_file_range")
+        self.assertIn("yo", stats.fallbacks[0][1])
+        self.assertNotEqual(stats.strategy, "copy_file_range")
+        self.assertEqual(stats.bytes, self.FILESIZE)
+
+    @unittest.skipIf(not POSIX, "POSIX only")
+    def test_reflink(self):
+        # a clone engine leaving file offsets untouched
+        def clone(fsrc, fdst):
+            os.write(fdst.fileno(), os.read(fsrc.fileno(), self.FILESIZE))
+            os.lseek(fdst.fileno(), 0, os.SEEK_SET)
+
+        stats = zerocopy.CopyStats()
+        with mock.patch("zerocopy._copyfile.HAS_FICLONE", True):
+            with mock.patch("zerocopy._copyfile._zerocopy_reflink",
+                            side_effect=clone):
+                zerocopy.copyfile(TESTFN, TESTFN2, reflink="auto",
+                                  stats=stats)
+        self.assertEqual(stats.strategy, "reflink")
+        self.assertEqual(stats.bytes, self.FILESIZE)
+
+    @unittest.skipIf(not POSIX, "POSIX only")
+    def test_readinto(self):
+        stats = zerocopy.CopyStats()
+        with mock.patch("zerocopy._copyfile._COPY_BUFSIZE", 65536):
+            with mock.patch("zerocopy._copyfile.HAS_COPY_FILE_RANGE",
+                            False):
+                with mock.patch("zerocopy._copyfile.HAS_COPYFD", False):
+                    with mock.patch("zerocopy._copyfile.HAS_SENDFILE",
+                                    False):
+                        zerocopy.copyfile(TESTFN, TESTFN2, stats=stats)
+        self.assertEqual(stats.strategy, "readinto")
+        # 16 reads + 16 writes + 1 read returning EOF
+        self.assertEqual(stats.syscalls, 33)
+        self.assertEqual(read_file(TESTFN2, binary=True),
+                         read_file(TESTFN, binary=True))
+
+    @unittest.skipIf(not POSIX, "POSIX only")
+    def test_symlink(self):
+        os.symlink(TESTFN, TESTFN2 + "link")
+        self.addCleanup(safe_remove, TESTFN2 + "link")
+        stats = zerocopy.CopyStats()
+        zerocopy.copyfile(TESTFN2 + "link", TESTFN2, follow_symlinks=False,
+                          stats=stats)
+        self.assertEqual(stats.strategy, "symlink")
+
+    def test_error(self):
+        stats = zerocopy.CopyStats()
+        self.assertRaises(EnvironmentError, zerocopy.copyfile,
+                          TESTFN + "nonexistent", TESTFN2, stats=stats)
+        self.assertIsInstance(stats.error, EnvironmentError)
+        self.assertIsNone(_stats.current())
+
+
+class TestMetrics(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        write_test_file(TESTFN, 65536)
+
+    @classmethod
+    def tearDownClass(cls):
+        safe_remove(TESTFN)
+
+    def tearDown(self):
+        safe_remove(TESTFN2)
+        zerocopy.enable_metrics(False)
+        zerocopy.reset_metrics()
+        zerocopy.set_metrics_hook(None)
+
+    def test_disabled(self):
+        self.assertIsNone(_stats.start(None, TESTFN, TESTFN2))
+        zerocopy.copyfile(TESTFN, TESTFN2)
+        self.assertEqual(zerocopy.metrics(), {})
+
+    def test_enabled(self):
+        zerocopy.enable_metrics()
+        stats = zerocopy.CopyStats()
+        zerocopy.copyfile(TESTFN, TESTFN2, stats=stats)
+        zerocopy.copyfile(TESTFN, TESTFN2)
+        entry = zerocopy.metrics()[stats.strategy]
+        self.assertEqual(entry["calls"], 2)
+        self.assertEqual(entry["bytes"], 65536 * 2)
+        self.assertEqual(entry["errors"], 0)
+        self.assertEqual(sum(entry["latency"].values()), 2)
+        self.assertEqual(sorted(entry["latency"]),
+                         list(_stats.LATENCY_BUCKETS))
+        # a copy is returned
+        entry["calls"] = 100
+        self.assertEqual(zerocopy.metrics()[stats.strategy]["calls"], 2)
+
+        zerocopy.reset_metrics()
+        self.assertEqual(zerocopy.metrics(), {})
+
+    def test_errors(self):
+        zerocopy.enable_metrics()
+        self.assertRaises(EnvironmentError, zerocopy.copyfile,
+                          TESTFN + "nonexistent", TESTFN2)
+        self.assertEqual(zerocopy.metrics()["unknown"]["errors"], 1)
+
+    def test_hook(self):
+        collected = []
+        self.assertIsNone(zerocopy.set_metrics_hook(collected.append))
+        zerocopy.copyfile(TESTFN, TESTFN2)
+        self.assertEqual(len(collected), 1)
+        self.assertIsInstance(collected[0], zerocopy.CopyStats)
+        self.assertEqual(collected[0].bytes, 65536)
+        # metrics are not enabled by the hook
+        self.assertEqual(zerocopy.metrics(), {})
+        self.assertEqual(zerocopy.set_metrics_hook(None), collected.append)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)